@@ -0,0 +1,215 @@
+import re
+import encoder as en
+
+# Reachable span of each pointer format, and if it starts at the header size
+# (2 byte pointers hold an offset from it) or at the start of the ROM.
+pointerSpans = {
+    '-2b': (0x10000, True),
+    '-2bs': (0x10000, True),
+    '-2bb': (0x10000, True),
+    '-3b': (0x1000000, False),
+    '-4b': (0x100000000, False),
+}
+
+# Runs of padding bytes long enough to hold text
+paddingRuns = re.compile(rb'\x00{32,}|\xFF{32,}')
+
+def parseRegions(value):
+    """
+    Reads a free region list, "start:size" pairs in hex separated by commas, or "auto".
+
+    Parameters:
+        value (str or list): The regions from the command line or the manifest
+            (a manifest may also give a list of [start, size] pairs).
+
+    Returns:
+        list: Lists [start, end] of every region, or None for "auto".
+    """
+    if value == "auto":
+        return None
+    if isinstance(value, str):
+        value = [pair.split(":") for pair in value.split(",") if pair.strip()]
+    regions = []
+    for start, size in value:
+        start = start if isinstance(start, int) else int(start, 16)
+        size = size if isinstance(size, int) else int(size, 16)
+        if size <= 0:
+            raise ValueError(size)
+        regions.append([start, start + size])
+    return regions
+
+def findFreeRegions(romData, reserved=()):
+    """
+    Finds runs of 0x00 or 0xFF padding in the ROM. The first byte of each run is kept,
+    as it may be the end code of the data before it.
+
+    Parameters:
+        romData (bytes): The complete ROM data.
+        reserved (list): Tuples (start, end) that can't be used, like text blocks and pointer tables.
+
+    Returns:
+        list: Lists [start, end] of every free region.
+    """
+    regions = [[match.start() + 1, match.end()] for match in paddingRuns.finditer(romData)]
+    return reserveRegions(regions, reserved)
+
+def reserveRegions(regions, reserved):
+    """
+    Removes reserved spans from a region list.
+
+    Parameters:
+        regions (list): Lists [start, end] of the free regions.
+        reserved (list): Tuples (start, end) to remove.
+
+    Returns:
+        list: The remaining regions.
+    """
+    for reservedStart, reservedEnd in reserved:
+        remaining = []
+        for start, end in regions:
+            if reservedEnd <= start or reservedStart >= end:
+                remaining.append([start, end])
+                continue
+            if start < reservedStart:
+                remaining.append([start, reservedStart])
+            if reservedEnd < end:
+                remaining.append([reservedEnd, end])
+        regions = remaining
+    return regions
+
+def splitRegions(regions, step, base):
+    """
+    Splits regions at every boundary base + n * step, in place, so no line crosses a bank.
+
+    Parameters:
+        regions (list): Lists [start, end] of the free regions.
+        step (int): The bank size.
+        base (int): ROM offset of a bank start.
+    """
+    pieces = []
+    for start, end in regions:
+        while True:
+            boundary = base + ((start - base) // step + 1) * step
+            if boundary >= end:
+                pieces.append([start, end])
+                break
+            pieces.append([start, boundary])
+            start = boundary
+    regions[:] = pieces
+
+def groupStrings(layout, lineBreakers):
+    """
+    Joins the written lines that run into the next one (no line breaker at their end)
+    with the lines that follow them, so every string is moved as a whole.
+
+    Parameters:
+        layout (list): Tuples (offset, encoded line) of the sequential layout.
+        lineBreakers (set): A set of byte values used as line breakers.
+
+    Returns:
+        list: Tuples (offset, encoded string) of the sequential layout.
+    """
+    strings = []
+    for offset, finalLine in layout:
+        if strings:
+            lastOffset, lastString = strings[-1]
+            if lastString[-1] not in lineBreakers and lastOffset + len(lastString) == offset:
+                strings[-1] = (lastOffset, lastString + finalLine)
+                continue
+        strings.append((offset, finalLine))
+    return strings
+
+def allocateLines(layout, regionGroups, low, high):
+    """
+    Packs encoded lines into the free regions between low and high with a best fit
+    decreasing heuristic: the longest lines go first, each one into the region it leaves
+    the least room in. Every line that fits in the first group of regions goes there,
+    the next group only gets the rest. Lines sharing a region keep their script order.
+    The space used is removed from the regions.
+
+    Parameters:
+        layout (list): Tuples (offset, encoded line) of the sequential layout.
+        regionGroups (list): Lists of regions [start, end], in order of preference.
+        low (int): First ROM offset the pointers can reach.
+        high (int): End of the ROM offsets the pointers can reach.
+
+    Returns:
+        list: The ROM offset of each line.
+
+    Raises:
+        OverflowError: With the number of bytes that found no room.
+    """
+    usable = []
+    room = []
+    chosen = [None] * len(layout)
+    order = sorted(range(len(layout)), key=lambda line: -len(layout[line][1]))
+    for regions in regionGroups:
+        first = len(usable)
+        for region in regions:
+            if region[0] >= low and region[1] <= high:
+                usable.append(region)
+                room.append(region[1] - region[0])
+        for line in order:
+            if chosen[line] is not None:
+                continue
+            size = len(layout[line][1])
+            best = None
+            for index in range(first, len(usable)):
+                if size <= room[index] and (best is None or room[index] < room[best]):
+                    best = index
+            if best is not None:
+                room[best] -= size
+                chosen[line] = best
+    missing = sum(len(layout[line][1]) for line, index in enumerate(chosen) if index is None)
+    if missing:
+        raise OverflowError(missing)
+
+    # Lay out each region in script order
+    places = []
+    for line, index in enumerate(chosen):
+        places.append(usable[index][0])
+        usable[index][0] += len(layout[line][1])
+    return places
+
+def spillText(layout, pointersList, block, regions, lineBreakers):
+    """
+    Places the lines of a block that does not fit in its text size across its own text
+    block and the free regions, and returns the pointers to them. Strings are kept
+    whole, and the text block is filled before any free region is used.
+
+    Parameters:
+        layout (list): Tuples (offset, encoded line) of the sequential layout.
+        pointersList (list): Pointers (cumulative lengths) of the sequential layout.
+        block (dict): The block settings, with integer addresses.
+        regions (list): Lists [start, end] of the free regions shared by every block.
+        lineBreakers (set): A set of byte values used as line breakers.
+
+    Returns:
+        tuple: Containing:
+            - pointersList (list): The ROM offset pointed by each pointer.
+            - spilledBytes (int): The bytes written outside the text block.
+            - writes (list): Tuples (offset, encoded string) to write.
+
+    Raises:
+        OverflowError: With the number of bytes that found no room.
+    """
+    textStartAddress = block["textStartAddress"]
+    textEnd = textStartAddress + block["textSize"]
+    span, fromHeader = pointerSpans[block.get("pointersFormat", "-2b")]
+    low = block["headerSize"] if fromHeader else 0
+    ownRegions = [[textStartAddress, textEnd]]
+    sharedRegions = list(regions)
+    bankSize = block.get("bankSize")
+    for candidates in (ownRegions, sharedRegions):
+        if bankSize:
+            splitRegions(candidates, bankSize, block["headerSize"])
+        splitRegions(candidates, span, low)
+
+    strings = groupStrings(layout, lineBreakers)
+    places = allocateLines(strings, [ownRegions, sharedRegions], low, low + span)
+    writes = [(place, encodedString) for place, (offset, encodedString) in zip(places, strings)]
+
+    # Keep the unused part of the shared regions for the next blocks
+    regions[:] = [region for region in sharedRegions if region[1] > region[0]]
+    spilledBytes = sum(len(encodedString) for place, encodedString in writes if not textStartAddress <= place < textEnd)
+    return en.relocatePointers(pointersList, strings, places), spilledBytes, writes
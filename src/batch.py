@@ -0,0 +1,330 @@
+import json
+import os
+import decoder as de
+import encoder as en
+import stats as st
+
+# Pointer format flags accepted in the manifest, shared with the command line.
+pointersFormats = {
+    '-2b': (de.processPointers2Bytes, en.calculatePointer2Bytes),
+    '-2bs': (de.processPointers2BytesSeparated, en.calculatePointer2BytesSeparated),
+    '-2bb': (de.processPointers2BytesBigEndian, en.calculatePointer2BytesBigEndian),
+    '-3b': (de.processPointers3Bytes, en.calculatePointer3Bytes),
+    '-4b': (de.processPointers4Bytes, en.calculatePointer4Bytes),
+}
+
+def parseHexValue(value):
+    """
+    Converts a manifest value to an integer. Strings are read as hex, like on the command line.
+
+    Parameters:
+        value (str or int): The value from the manifest.
+
+    Returns:
+        int: The parsed value.
+    """
+    if isinstance(value, int):
+        return value
+    return int(value, 16)
+
+def readManifest(manifestFile):
+    """
+    Reads a JSON manifest describing every text block of a ROM.
+    Keys defined at the top level are used as defaults for each block.
+
+    Parameters:
+        manifestFile (str): The path to the manifest file.
+
+    Returns:
+        tuple: Containing:
+            - manifest (dict): The top level settings (rom, decoderTbl, encoderTbl...).
+            - blocks (list): A list of dictionaries, one per block, with defaults applied.
+
+    Raises:
+        ValueError: If the file is not a JSON object.
+        KeyError: With the name of a missing top level value (rom, encoderTbl, decoderTbl,
+            blocks) or of an unsupported pointers format.
+    """
+    import compression as cp
+    with open(manifestFile, "r", encoding="UTF-8") as f:
+        manifest = json.load(f)
+    if not isinstance(manifest, dict):
+        raise ValueError(manifestFile)
+
+    # Every command reads the ROM and a table from the top level
+    for key in ("rom", "encoderTbl", "decoderTbl"):
+        if key not in manifest:
+            raise KeyError(key)
+
+    defaults = {key: value for key, value in manifest.items() if key != "blocks"}
+    blocks = []
+    for entry in manifest["blocks"]:
+        block = dict(defaults)
+        block.update(entry)
+        if block.get("pointersFormat", "-2b") not in pointersFormats:
+            raise KeyError(block["pointersFormat"])
+        if block.get("codec"):
+            cp.parseCodec(block["codec"])
+        blocks.append(block)
+    return manifest, blocks
+
+def iterBlockTexts(romData, block, lineBreakers, charTable, lookupTable=None, breakers=None):
+    """
+    Yields the lines of one manifest block, read through its pointer table.
+
+    Parameters:
+        romData (bytes): The complete ROM data (bytes, mmap or memoryview).
+        block (dict): The block settings.
+        lineBreakers (set): A set of byte values used as line breakers.
+        charTable (dict): A dictionary mapping byte values to characters or sequences.
+        lookupTable (tuple): Optional result of decoder.buildLookupTable for charTable.
+        breakers (Pattern): Optional result of decoder.compileBreakers for lineBreakers.
+
+    Returns:
+        generator: The address, the decoded text and the length in bytes of each line.
+    """
+    import compression as cp
+    pointersFormat = pointersFormats[block.get("pointersFormat", "-2b")][0]
+    pointersStartAddress = parseHexValue(block["pointersStartAddress"])
+    pointerTableSize = parseHexValue(block["tablePointersSize"])
+    headerSize = parseHexValue(block["headerSize"])
+
+    # Pointer table is a view of the same ROM data instead of reopening the file
+    tablePointers = de.readRom(romData, pointersStartAddress, pointerTableSize)
+    lineStartAddress = pointersFormat(tablePointers, headerSize)
+    if block.get("codec"):
+        return cp.iterPackedTexts(romData, lineStartAddress, lineBreakers, charTable, block["codec"],
+                                  parseHexValue(block["textStartAddress"]), parseHexValue(block["textSize"]), lookupTable, breakers)
+    return de.iterTexts(romData, lineStartAddress, lineBreakers, charTable, lookupTable, breakers)
+
+def decodeBlock(romData, block, charTable):
+    """
+    Extracts one manifest block from ROM data already in memory and writes its script file.
+
+    Parameters:
+        romData (bytes): The complete ROM data (bytes, mmap or memoryview).
+        block (dict): The block settings.
+        charTable (dict): A dictionary mapping byte values to characters or sequences.
+
+    Returns:
+        int: Total text block size.
+    """
+    import scriptcache as sc
+    pointersStartAddress = parseHexValue(block["pointersStartAddress"])
+    pointerTableSize = parseHexValue(block["tablePointersSize"])
+    lineBreaker = block["lineBreakers"]
+    texts = iterBlockTexts(romData, block, de.parseLineBreakers(lineBreaker), charTable)
+    totalBytesRead = de.writeScriptStream(block["file"], texts, pointersStartAddress, pointerTableSize, lineBreaker)
+
+    # Keep the binary sidecar next to the script when asked, or when there is one already
+    if block.get("index") or os.path.exists(sc.cacheFileName(block["file"])):
+        sc.buildScriptCache(block["file"])
+    return totalBytesRead
+
+def encodeLines(block, textScript, lineBreakers, charTable, longestChar, trie=None, lineCache=None):
+    """
+    Encodes the lines of one manifest block with its encoding options.
+
+    Parameters:
+        block (dict): The block settings.
+        textScript (iterable): The script lines.
+        lineBreakers (set): A set of byte values used as line breakers.
+        charTable (dict): Dictionary that maps character sequences to byte values.
+        longestChar (int): Maximum length of sequences to consider while encoding.
+        trie (dict): Optional result of encoder.buildTrie for charTable.
+        lineCache (dict): Optional encodeScriptLine results by line, used and filled.
+
+    Returns:
+        tuple: Containing:
+            - encodedText (bytes): The encoded lines, one after another.
+            - pointersList (array): Pointers relative to the text start.
+            - layout (list): Tuples (offset, encoded line) of every written line.
+    """
+    layout = []
+    encodedText, pointersList = en.encodeText(textScript, lineBreakers, charTable, longestChar, block.get("optimal", False), block.get("shareLines"), lineCache, layout, trie)
+    return encodedText, pointersList, layout
+
+def textWrites(block, encodedText, pointersList):
+    """
+    Returns the writes of an encoded block that fits in its text size.
+
+    Parameters:
+        block (dict): The block settings.
+        encodedText (bytes): The encoded lines.
+        pointersList (list): Pointers relative to the text start.
+
+    Returns:
+        list: Tuples (offset, data) of the text and the pointer table.
+    """
+    pointersFormat = pointersFormats[block.get("pointersFormat", "-2b")][1]
+    textStartAddress = parseHexValue(block["textStartAddress"])
+    pointersStartAddress = parseHexValue(block["pointersStartAddress"])
+    headerSize = parseHexValue(block["headerSize"])
+    with st.stage("pointerBuild"):
+        encodedPointers = pointersFormat(pointersList, textStartAddress, headerSize)
+    return [(textStartAddress, encodedText), (pointersStartAddress, bytes(encodedPointers))]
+
+def packText(block, encodedText):
+    """
+    Compresses the encoded text of a block with its codec, if it has one.
+    Pointers keep addressing the decompressed text, as if it was stored at the text start.
+
+    Parameters:
+        block (dict): The block settings.
+        encodedText (bytes): The encoded lines.
+
+    Returns:
+        bytes: The data to write at the text start.
+    """
+    import compression as cp
+    if not block.get("codec"):
+        return encodedText
+    return cp.compress(encodedText, block["codec"])
+
+def encodeBlock(block, charTable, longestChar, freeRegions=None, lineCache=None, addresses=None, script=None):
+    """
+    Encodes one manifest block without touching the ROM, returning the writes to do.
+    When free regions are given, the lines that don't fit in the text size are spilled to them.
+
+    Parameters:
+        block (dict): The block settings.
+        charTable (dict): Dictionary that maps character sequences to byte values.
+        longestChar (int): Maximum length of sequences to consider while encoding.
+        freeRegions (list): Lists [start, end] of free ROM regions shared by every block, or None.
+        lineCache (dict): Optional encodeScriptLine results by line, used and filled.
+        addresses (list): Optional list receiving the ROM address every pointer is made for.
+        script (dict): Optional dict receiving the lines and the lineBreakers of the script,
+            for verify.checkBlock.
+
+    Returns:
+        tuple: Containing:
+            - writes (list): Tuples (offset, data) of the text, the spilled strings and the pointer table.
+            - freeBytes (int): Free space left in the text block.
+            - pointersCount (int): Number of pointers written.
+            - spilledBytes (int): Bytes written in the free regions.
+            - textBytes (int): Size of the encoded text before compression.
+
+    Raises:
+        OverflowError: If the encoded text exceeds the block text size and the free regions.
+            A compressed block is never spilled.
+    """
+    import allocator as al
+    import scriptcache as sc
+    textSize = parseHexValue(block["textSize"])
+    textScript, _, _, _, lineBreaker = sc.openScript(block["file"])
+    try:
+        lineBreakers = de.parseLineBreakers(lineBreaker)
+        lines = textScript
+        if script is not None:
+            lines = list(textScript)
+            script.update(lines=lines, lineBreakers=lineBreakers)
+        encodedText, pointersList, layout = encodeLines(block, lines, lineBreakers, charTable, longestChar, lineCache=lineCache)
+    finally:
+        textScript.close()
+    storedText = packText(block, encodedText)
+    if len(storedText) <= textSize:
+        if addresses is not None:
+            textStartAddress = parseHexValue(block["textStartAddress"])
+            addresses.extend(textStartAddress + pointer for pointer in pointersList)
+        return textWrites(block, storedText, pointersList), textSize - len(storedText), len(pointersList), 0, len(encodedText)
+    if freeRegions is None or block.get("codec"):
+        raise OverflowError(len(storedText) - textSize)
+
+    pointersFormat = pointersFormats[block.get("pointersFormat", "-2b")][1]
+    pointersStartAddress = parseHexValue(block["pointersStartAddress"])
+    headerSize = parseHexValue(block["headerSize"])
+    spillBlock = dict(block, textStartAddress=parseHexValue(block["textStartAddress"]), textSize=textSize, headerSize=headerSize)
+    if "bankSize" in block:
+        spillBlock["bankSize"] = parseHexValue(block["bankSize"])
+    pointersList, spilledBytes, writes = al.spillText(layout, pointersList, spillBlock, freeRegions, lineBreakers)
+    with st.stage("pointerBuild"):
+        encodedPointers = pointersFormat(pointersList, 0, headerSize)
+    writes.append((pointersStartAddress, bytes(encodedPointers)))
+    if addresses is not None:
+        addresses.extend(pointersList)
+    freeBytes = textSize - (len(encodedText) - spilledBytes)
+    return writes, freeBytes, len(pointersList), spilledBytes, len(encodedText)
+
+# ROM mapping and tables of a pool worker, set once per process
+workerState = {}
+
+def initWorker(romFile, charTable, longestChar=None, verify=False):
+    """
+    Prepares a pool worker: maps the ROM read-only (the pages are shared by every worker)
+    and keeps the table, so they are not sent again with every block.
+
+    Parameters:
+        romFile (str): The path to the ROM file, or None when the worker does not read it.
+        charTable (dict): The character table.
+        longestChar (int): Maximum length of sequences to consider while encoding.
+        verify (bool): Send back what verify.checkBlock needs with every encoded block.
+    """
+    workerState["romData"] = de.mapRom(romFile) if romFile else None
+    workerState["charTable"] = charTable
+    workerState["longestChar"] = longestChar
+    workerState["verify"] = verify
+
+def decodeWorker(block):
+    """
+    Decodes one block in a pool worker.
+
+    Parameters:
+        block (dict): The block settings.
+
+    Returns:
+        int: Total text block size.
+    """
+    return decodeBlock(workerState["romData"], block, workerState["charTable"])
+
+def encodeWorker(block):
+    """
+    Encodes one block in a pool worker.
+
+    Parameters:
+        block (dict): The block settings.
+
+    Returns:
+        tuple: The writes, free bytes, pointers count, spilled bytes and text size, like encodeBlock,
+            then the script, the line cache and the addresses for verify.checkBlock (None
+            unless the worker verifies).
+    """
+    if not workerState["verify"]:
+        return encodeBlock(block, workerState["charTable"], workerState["longestChar"]) + (None, None, None)
+    script, lineCache, addresses = {}, {}, []
+    return encodeBlock(block, workerState["charTable"], workerState["longestChar"], None, lineCache, addresses, script) + (script, lineCache, addresses)
+
+def blockRegions(block):
+    """
+    Returns the ROM spans used by a block, its text and its pointer table.
+
+    Parameters:
+        block (dict): The block settings.
+
+    Returns:
+        list: Tuples (start, end).
+    """
+    textStartAddress = parseHexValue(block["textStartAddress"])
+    pointersStartAddress = parseHexValue(block["pointersStartAddress"])
+    spans = [(textStartAddress, textStartAddress + parseHexValue(block["textSize"]))]
+    if "tablePointersSize" in block:
+        spans.append((pointersStartAddress, pointersStartAddress + parseHexValue(block["tablePointersSize"])))
+    return spans
+
+def freeRegions(romData, blocks, value):
+    """
+    Builds the pool of free regions shared by the blocks, without the spans the blocks use.
+
+    Parameters:
+        romData (bytes): The complete ROM data.
+        blocks (list): The block settings.
+        value (str or list): Regions as "start:size" pairs, or "auto" to find padding runs.
+
+    Returns:
+        list: Lists [start, end] of the free regions.
+    """
+    import allocator as al
+    reserved = [span for block in blocks for span in blockRegions(block)]
+    regions = al.parseRegions(value)
+    if regions is None:
+        return al.findFreeRegions(romData, reserved)
+    return al.reserveRegions(regions, reserved)
@@ -0,0 +1,386 @@
+"""
+Benchmark of the decode and encode pipeline on synthetic ROMs.
+
+    python benchmark.py [--lines N] [--density F] [--breakers N] [--formats -2b,-3b]
+                        [--repeat N] [--seed N] [--out results.json]
+                        [--baseline baseline.json] [--threshold PERCENT]
+
+A table with single characters, DTE pairs and MTE words is generated with a script of
+random lines, split in blocks of one 64 KB bank each. Every stage is timed on its own
+(best of the repeats) and reported in bytes/s and lines/s; the data is also checked to
+survive the round trip ROM -> script -> ROM with every pointer format.
+The results can be saved as JSON and compared to a previous run.
+"""
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import decoder as de
+import encoder as en
+import batch as ba
+
+# Characters of the synthetic table, one byte each
+singleChars = " abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789.,!?'-"
+
+# Byte values of the synthetic table
+dteStart = 0x80
+dteCount = 0x40
+mteStart = 0xC0
+mteCount = 0x20
+controlByte = 0xE0
+breakerStart = 0xF0
+maxBreakers = 8
+
+# Chance of a control code (not a breaker) between two tokens of a line
+controlChance = 0.02
+
+# Characters of script text per block, encoded text and pointer table must fit one bank
+blockChars = 0xC000
+bankSize = 0x10000
+headerSize = 0x10
+
+benchmarkOptions = {
+    '--lines': True,
+    '--density': True,
+    '--breakers': True,
+    '--formats': True,
+    '--repeat': True,
+    '--seed': True,
+    '--out': True,
+    '--baseline': True,
+    '--threshold': True,
+}
+
+def parseOptions(args):
+    """
+    Reads the optional flags of the benchmark.
+
+    Parameters:
+        args (list): The command line arguments.
+
+    Returns:
+        tuple: The settings of the run (dict), the report file or None, the baseline
+            file or None and the slowdown threshold in percent.
+    """
+    options = {}
+    args = iter(args)
+    for arg in args:
+        if arg not in benchmarkOptions:
+            print(f"Error: Unknown option {arg}.")
+            sys.exit(1)
+        value = next(args, None)
+        if value is None:
+            print(f"Error: Option {arg} needs a value.")
+            sys.exit(1)
+        options[arg] = value
+    try:
+        settings = {
+            "lines": int(options.get('--lines', 20000)),
+            "density": float(options.get('--density', 0.3)),
+            "breakers": int(options.get('--breakers', 2)),
+            "formats": [name.strip() for name in options.get('--formats', ",".join(ba.pointersFormats)).split(",")],
+            "repeat": int(options.get('--repeat', 5)),
+            "seed": int(options.get('--seed', 1)),
+        }
+        threshold = float(options.get('--threshold', 10))
+    except ValueError:
+        print("Error: Incorrect benchmark value.")
+        sys.exit(1)
+    if settings["lines"] < 1 or settings["repeat"] < 1 or not 0 <= settings["density"] <= 1:
+        print("Error: Incorrect benchmark value.")
+        sys.exit(1)
+    if not 1 <= settings["breakers"] <= maxBreakers:
+        print(f"Error: --breakers must be between 1 and {maxBreakers}.")
+        sys.exit(1)
+    for name in settings["formats"]:
+        if name not in ba.pointersFormats:
+            print(f"Error: Unknown pointer format {name}.")
+            sys.exit(1)
+    return settings, options.get('--out'), options.get('--baseline'), threshold
+
+def makeTable(rng):
+    """
+    Generates the entries of a synthetic table: single characters, DTE pairs and MTE words.
+
+    Parameters:
+        rng (Random): The random generator.
+
+    Returns:
+        dict: Byte values to characters or sequences.
+    """
+    table = {value: char for value, char in enumerate(singleChars)}
+    lowercase = singleChars[:27]
+    sequences = set()
+    while len(sequences) < dteCount:
+        sequences.add(rng.choice(lowercase[1:]) + rng.choice(lowercase))
+    for value, sequence in enumerate(sorted(sequences), dteStart):
+        table[value] = sequence
+    words = set()
+    while len(words) < mteCount:
+        words.add("".join(rng.choice(lowercase[1:]) for _ in range(rng.randint(3, 6))))
+    for value, word in enumerate(sorted(words), mteStart):
+        table[value] = word
+    return table
+
+def writeTable(tblFile, table):
+    """
+    Writes a table to a .tbl file.
+
+    Parameters:
+        tblFile (str): The path to the .tbl file.
+        table (dict): Byte values to characters or sequences.
+    """
+    with open(tblFile, "w", encoding="UTF-8") as f:
+        for value, chars in sorted(table.items()):
+            f.write(f"{value:02X}={chars}\n")
+
+def makeLines(rng, table, settings):
+    """
+    Generates the script lines. Each token is a table sequence longer than one character
+    with the chance given by the density, else a single character; each line ends with
+    one of the breakers.
+
+    Parameters:
+        rng (Random): The random generator.
+        table (dict): Byte values to characters or sequences.
+        settings (dict): The settings of the run.
+
+    Returns:
+        list: The script lines.
+    """
+    sequences = [chars for chars in table.values() if len(chars) > 1]
+    breakers = [f"~{breakerStart + i:02X}~" for i in range(settings["breakers"])]
+    lines = []
+    for _ in range(settings["lines"]):
+        parts = []
+        for _ in range(rng.randint(10, 60)):
+            if rng.random() < controlChance:
+                parts.append(f"~{controlByte:02X}~")
+            if rng.random() < settings["density"]:
+                parts.append(rng.choice(sequences))
+            else:
+                parts.append(rng.choice(singleChars))
+        parts.append(rng.choice(breakers))
+        lines.append("".join(parts))
+    return lines
+
+def splitBlocks(lines):
+    """
+    Splits the lines in blocks that fit one bank with their pointer table.
+
+    Parameters:
+        lines (list): The script lines.
+
+    Returns:
+        list: The lines of each block.
+    """
+    blocks = [[]]
+    size = 0
+    for line in lines:
+        if blocks[-1] and size + len(line) > blockChars:
+            blocks.append([])
+            size = 0
+        blocks[-1].append(line)
+        size += len(line)
+    return blocks
+
+def timeStage(function, repeat):
+    """
+    Runs a stage several times.
+
+    Parameters:
+        function (callable): The stage, without arguments.
+        repeat (int): Number of runs.
+
+    Returns:
+        float: The shortest run, in seconds.
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def runBenchmark(settings, directory):
+    """
+    Builds the synthetic data in a directory, checks the round trip and times every stage.
+
+    Parameters:
+        settings (dict): The settings of the run.
+        directory (str): A temporary directory for the table and script files.
+
+    Returns:
+        tuple: Containing:
+            - results (dict): Seconds, bytes/s and lines/s of every stage.
+            - errors (list): The round trip checks that failed.
+    """
+    rng = random.Random(settings["seed"])
+    table = makeTable(rng)
+    tblFile = os.path.join(directory, "bench.tbl")
+    writeTable(tblFile, table)
+    lines = makeLines(rng, table, settings)
+    blocks = splitBlocks(lines)
+    lineBreakerString = ",".join(f"0x{breakerStart + i:02X}" for i in range(settings["breakers"]))
+    lineBreakers = de.parseLineBreakers(lineBreakerString)
+    repeat = settings["repeat"]
+    results = {}
+    errors = []
+
+    def record(name, seconds, size, count):
+        results[name] = {
+            "seconds": seconds,
+            "bytesPerSecond": size / seconds if seconds else None,
+            "linesPerSecond": count / seconds if seconds and count else None,
+        }
+
+    # Tables
+    tblSize = os.path.getsize(tblFile)
+    record("readTbl", timeStage(lambda: de.readTbl(tblFile), repeat), tblSize, 0)
+    record("readTblFileInverted", timeStage(lambda: en.readTblFileInverted(tblFile), repeat), tblSize, 0)
+    decodeTable = de.readTbl(tblFile)
+    encodeTable, longestChar = en.readTblFileInverted(tblFile)
+
+    # Encoding, every block is laid out in its own bank: header, pointer table, text
+    encoded = [en.encodeText(blockLines, lineBreakers, encodeTable, longestChar) for blockLines in blocks]
+    textBytes = sum(len(encodedText) for encodedText, pointersList in encoded)
+    record("encodeText", timeStage(lambda: [en.encodeText(blockLines, lineBreakers, encodeTable, longestChar) for blockLines in blocks], repeat), textBytes, len(lines))
+    romData = bytearray(bankSize * len(blocks))
+    layouts = []
+    for index, (encodedText, pointersList) in enumerate(encoded):
+        base = index * bankSize
+        pointersStart = base + headerSize
+        textStart = pointersStart + 4 * len(pointersList)
+        if len(pointersList) != len(blocks[index]):
+            errors.append(f"encodeText: block {index} has {len(pointersList)} pointers for {len(blocks[index])} lines")
+        romData[textStart:textStart + len(encodedText)] = encodedText
+        layouts.append((base, pointersStart, textStart, pointersList))
+
+    # Pointer formats
+    for name in settings["formats"]:
+        processPointers, calculatePointer = ba.pointersFormats[name]
+        tables = []
+        for base, pointersStart, textStart, pointersList in layouts:
+            encodedPointers = calculatePointer(pointersList, textStart, base)
+            tables.append((pointersStart, bytes(encodedPointers), base))
+            addresses = list(processPointers(encodedPointers, base))
+            if addresses != [textStart + offset for offset in pointersList]:
+                errors.append(f"{name}: pointers of bank {base // bankSize} don't round trip")
+        tableBytes = sum(len(data) for pointersStart, data, base in tables)
+        record(f"{calculatePointer.__name__}", timeStage(lambda: [calculatePointer(pointersList, textStart, base) for base, pointersStart, textStart, pointersList in layouts], repeat), tableBytes, len(lines))
+        record(f"{processPointers.__name__}", timeStage(lambda: [processPointers(de.readRom(romData, pointersStart, len(data)), base) for pointersStart, data, base in tables], repeat), tableBytes, len(lines))
+
+    # Decoding
+    addressLists = [[textStart + offset for offset in pointersList] for base, pointersStart, textStart, pointersList in layouts]
+    extracted = [de.extractTexts(romData, addresses, lineBreakers, decodeTable) for addresses in addressLists]
+    record("extractTexts", timeStage(lambda: [de.extractTexts(romData, addresses, lineBreakers, decodeTable) for addresses in addressLists], repeat), textBytes, len(lines))
+    for index, records in enumerate(extracted):
+        if list(records.texts()) != blocks[index] or list(records.addresses) != addressLists[index]:
+            errors.append(f"extractTexts: block {index} doesn't decode to its script")
+        if en.encodeText(records, lineBreakers, encodeTable, longestChar) != encoded[index]:
+            errors.append(f"extractTexts: block {index} doesn't encode again from its records")
+
+    # Script files, written from the records
+    scriptFiles = [os.path.join(directory, f"bench{index}.txt") for index in range(len(blocks))]
+
+    def writeScripts():
+        for scriptFile, records, (base, pointersStart, textStart, pointersList) in zip(scriptFiles, extracted, layouts):
+            de.writeScriptStream(scriptFile, records, pointersStart, 2 * len(pointersList), lineBreakerString)
+
+    writeScripts()
+    scriptBytes = sum(os.path.getsize(scriptFile) for scriptFile in scriptFiles)
+    record("writeScriptStream", timeStage(writeScripts, repeat), scriptBytes, len(lines))
+    record("readScriptFile", timeStage(lambda: [en.readScriptFile(scriptFile) for scriptFile in scriptFiles], repeat), scriptBytes, len(lines))
+    for index, scriptFile in enumerate(scriptFiles):
+        textScript, pointersStart, pointersEnd, pointerTableSize, lineBreaker = en.readScriptFile(scriptFile)
+        if textScript != blocks[index]:
+            errors.append(f"readScriptFile: block {index} doesn't read back its lines")
+            continue
+        if de.parseLineBreakers(lineBreaker) != lineBreakers:
+            errors.append(f"readScriptFile: block {index} has other line breakers")
+        if en.encodeText(textScript, lineBreakers, encodeTable, longestChar) != encoded[index]:
+            errors.append(f"encodeText: block {index} doesn't encode again to the same data")
+    return results, errors
+
+def compareBaseline(results, baseline, threshold):
+    """
+    Finds the stages slower than in a baseline run.
+
+    Parameters:
+        results (dict): The stages of this run.
+        baseline (dict): The stages of the baseline run.
+        threshold (float): Slowdown allowed, in percent.
+
+    Returns:
+        dict: Change of the time of every stage found in both runs, in percent.
+        list: The stages slower than allowed.
+    """
+    changes = {}
+    regressions = []
+    for name, result in results.items():
+        previous = baseline.get(name)
+        if not previous or not previous.get("seconds"):
+            continue
+        change = (result["seconds"] / previous["seconds"] - 1) * 100
+        changes[name] = change
+        if change > threshold:
+            regressions.append(name)
+    return changes, regressions
+
+def main():
+    settings, outFile, baselineFile, threshold = parseOptions(sys.argv[1:])
+
+    baseline = None
+    if baselineFile:
+        try:
+            with open(baselineFile, "r", encoding="UTF-8") as f:
+                baseline = json.load(f)
+        except FileNotFoundError:
+            print(f"Error: File {baselineFile} not found in directory.")
+            sys.exit(1)
+        except ValueError:
+            print(f"Error: File {baselineFile} is not a benchmark result.")
+            sys.exit(1)
+
+    with tempfile.TemporaryDirectory() as directory:
+        results, errors = runBenchmark(settings, directory)
+
+    changes, regressions = {}, []
+    if baseline:
+        if baseline.get("settings") != settings:
+            print("Warning: The baseline was run with other settings.")
+        changes, regressions = compareBaseline(results, baseline.get("results", {}), threshold)
+
+    print(f"{settings['lines']} lines, density {settings['density']}, {settings['breakers']} breakers, best of {settings['repeat']}")
+    print(f"{'stage':<34}{'seconds':>10}{'MB/s':>10}{'lines/s':>12}{'baseline':>10}")
+    for name, result in results.items():
+        bytesPerSecond = f"{result['bytesPerSecond'] / 1e6:.2f}" if result["bytesPerSecond"] else "-"
+        linesPerSecond = f"{result['linesPerSecond']:.0f}" if result["linesPerSecond"] else "-"
+        change = f"{changes[name]:+.1f}%" if name in changes else "-"
+        print(f"{name:<34}{result['seconds']:>10.4f}{bytesPerSecond:>10}{linesPerSecond:>12}{change:>10}")
+
+    if outFile:
+        output = {
+            "settings": settings,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "results": results,
+            "roundTrip": not errors,
+        }
+        with open(outFile, "w", encoding="UTF-8") as f:
+            json.dump(output, f, indent=2)
+        print(f"Results written to {outFile}")
+
+    for error in errors:
+        print(f"Error: Round trip failed, {error}.")
+    for name in regressions:
+        print(f"Error: {name} is {changes[name]:.1f}% slower than the baseline.")
+    sys.exit(1 if errors or regressions else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,401 @@
+import heapq
+import re
+import struct
+from array import array
+from collections import Counter
+import decoder as de
+import stats as st
+
+# LZSS settings of the classic ring buffer layout: 4 KB window, matches of 3 to 18 bytes,
+# flag bytes read from the lowest bit (1 = literal), ring filled with spaces and
+# written from N - F.
+lzssWindow = 0x1000
+lzssMaxLength = 18
+lzssMinLength = 3
+lzssFill = 0x20
+# Longest hash chain followed for each position, longer chains find few better matches
+lzssMaxChain = 128
+
+# Canonical Huffman codes are limited to 16 bits, like the header counts allow
+huffmanMaxBits = 16
+
+def decompressLzss(data):
+    """
+    Decompresses LZSS data until the end of the input. Match offsets are ring buffer
+    positions, so the output is kept after a window of fill bytes standing for the ring.
+
+    Parameters:
+        data (bytes): The compressed data.
+
+    Returns:
+        bytes: The decompressed data.
+    """
+    # Output byte k sits at ring position k - F once the window is in front
+    out = bytearray([lzssFill]) * lzssWindow
+    size = len(data)
+    i = 0
+    while i < size:
+        flags = data[i]
+        i += 1
+        for bit in range(8):
+            if i >= size:
+                break
+            if flags >> bit & 1:
+                out.append(data[i])
+                i += 1
+                continue
+            if i + 1 >= size:
+                i = size
+                break
+            position = data[i] | (data[i + 1] & 0xF0) << 4
+            length = (data[i + 1] & 0x0F) + lzssMinLength
+            i += 2
+            # Latest output byte stored at that ring position
+            end = len(out)
+            source = end - 1 - (end - 1 - position - lzssMaxLength) % lzssWindow
+            if source + length <= end:
+                out += out[source:source + length]
+            else:
+                for k in range(source, source + length):
+                    out.append(out[k])
+    return bytes(out[lzssWindow:])
+
+def compressLzss(data):
+    """
+    Compresses data to LZSS. Matches are found through hash chains of 3 byte prefixes,
+    and a match is delayed by one byte when the next position has a longer one.
+
+    Parameters:
+        data (bytes): The data to compress.
+
+    Returns:
+        bytes: The compressed data.
+    """
+    data = bytes(data)
+    size = len(data)
+    maxDistance = lzssWindow - lzssMaxLength
+    head = {}
+    chain = array("l", [-1]) * size
+    inserted = 0
+
+    def insert(limit):
+        # Adds every position before limit to the hash chains
+        nonlocal inserted
+        while inserted < limit:
+            key = data[inserted:inserted + lzssMinLength]
+            chain[inserted] = head.get(key, -1)
+            head[key] = inserted
+            inserted += 1
+
+    def longestMatch(i):
+        insert(i)
+        best = bestSource = 0
+        maxLength = min(lzssMaxLength, size - i)
+        if maxLength < lzssMinLength:
+            return 0, 0
+        source = head.get(data[i:i + lzssMinLength], -1)
+        steps = lzssMaxChain
+        while source >= 0 and i - source <= maxDistance and steps:
+            length = lzssMinLength
+            while length < maxLength and data[source + length] == data[i + length]:
+                length += 1
+            if length > best:
+                best, bestSource = length, source
+                if length == maxLength:
+                    break
+            source = chain[source]
+            steps -= 1
+        return best, bestSource
+
+    out = bytearray()
+    items = []
+    flags = 0
+    i = 0
+    match = longestMatch(0)
+    while i < size:
+        length, source = match
+        if length >= lzssMinLength and i + 1 < size:
+            nextMatch = longestMatch(i + 1)
+            if nextMatch[0] > length:
+                length = 0
+        else:
+            nextMatch = None
+        if length >= lzssMinLength:
+            position = (source + lzssWindow - lzssMaxLength) % lzssWindow
+            items.append(bytes((position & 0xFF, (position >> 4 & 0xF0) | (length - lzssMinLength))))
+            i += length
+            match = longestMatch(i) if i < size else (0, 0)
+        else:
+            flags |= 1 << len(items)
+            items.append(data[i:i + 1])
+            i += 1
+            match = nextMatch if nextMatch is not None else (longestMatch(i) if i < size else (0, 0))
+        if len(items) == 8:
+            out.append(flags)
+            out += b"".join(items)
+            items = []
+            flags = 0
+    if items:
+        out.append(flags)
+        out += b"".join(items)
+    return bytes(out)
+
+def decompressRle(data):
+    """
+    Decompresses PackBits RLE data until the end of the input: a count byte below 0x80
+    copies count + 1 bytes, above 0x80 repeats the next byte 257 - count times.
+
+    Parameters:
+        data (bytes): The compressed data.
+
+    Returns:
+        bytes: The decompressed data.
+    """
+    out = bytearray()
+    size = len(data)
+    i = 0
+    while i < size:
+        count = data[i]
+        i += 1
+        if count < 0x80:
+            out += data[i:i + count + 1]
+            i += count + 1
+        elif count > 0x80 and i < size:
+            out += bytes(data[i:i + 1]) * (257 - count)
+            i += 1
+    return bytes(out)
+
+def compressRle(data):
+    """
+    Compresses data to PackBits RLE. Runs of 3 or more bytes are repeated, the bytes
+    between them are copied in chunks of up to 128.
+
+    Parameters:
+        data (bytes): The data to compress.
+
+    Returns:
+        bytes: The compressed data.
+    """
+    data = bytes(data)
+    out = bytearray()
+
+    def literals(start, end):
+        for chunk in range(start, end, 0x80):
+            part = data[chunk:min(chunk + 0x80, end)]
+            out.append(len(part) - 1)
+            out.extend(part)
+
+    last = 0
+    for match in re.finditer(rb"(.)\1{2,}", data, re.DOTALL):
+        literals(last, match.start())
+        length = match.end() - match.start()
+        while length >= 2:
+            count = min(length, 0x80)
+            out += bytes((257 - count, data[match.start()]))
+            length -= count
+        last = match.end() - length
+    literals(last, len(data))
+    return bytes(out)
+
+def huffmanLengths(counts):
+    """
+    Computes the Huffman code length of every symbol, halving the counts until no code
+    is longer than huffmanMaxBits.
+
+    Parameters:
+        counts (dict): Number of times each byte value is used.
+
+    Returns:
+        dict: The code length of each byte value.
+    """
+    while True:
+        if len(counts) == 1:
+            return {symbol: 1 for symbol in counts}
+        heap = [(count, symbol, (symbol,)) for symbol, count in counts.items()]
+        heapq.heapify(heap)
+        lengths = dict.fromkeys(counts, 0)
+        while len(heap) > 1:
+            firstCount, firstKey, firstSymbols = heapq.heappop(heap)
+            secondCount, secondKey, secondSymbols = heapq.heappop(heap)
+            for symbol in firstSymbols + secondSymbols:
+                lengths[symbol] += 1
+            heapq.heappush(heap, (firstCount + secondCount, min(firstKey, secondKey), firstSymbols + secondSymbols))
+        if max(lengths.values()) <= huffmanMaxBits:
+            return lengths
+        counts = {symbol: (count + 1) // 2 for symbol, count in counts.items()}
+
+def canonicalCodes(lengths):
+    """
+    Assigns canonical codes: symbols sorted by code length then value get consecutive codes.
+
+    Parameters:
+        lengths (dict): The code length of each byte value.
+
+    Returns:
+        list: Tuples (symbol, length, code) in canonical order.
+    """
+    codes = []
+    code = 0
+    previous = 0
+    for symbol, length in sorted(lengths.items(), key=lambda item: (item[1], item[0])):
+        code <<= length - previous
+        codes.append((symbol, length, code))
+        code += 1
+        previous = length
+    return codes
+
+def compressHuffman(data):
+    """
+    Compresses data with canonical Huffman codes. The output holds the data length
+    (4 bytes, little endian), the number of codes of each length from 1 to 16, the symbols
+    in canonical order and the codes, read from the highest bit.
+
+    Parameters:
+        data (bytes): The data to compress.
+
+    Returns:
+        bytes: The compressed data.
+    """
+    data = bytes(data)
+    counts = Counter(data)
+    if not counts:
+        return struct.pack("<I", 0) + bytes(huffmanMaxBits)
+    lengths = huffmanLengths(counts)
+    # 256 codes of 8 bits don't fit in a count byte, the two rarest symbols get 9 bits
+    if len(lengths) == 256 and set(lengths.values()) == {8}:
+        for symbol in sorted(lengths, key=lambda symbol: (counts[symbol], symbol))[:2]:
+            lengths[symbol] = 9
+    codes = canonicalCodes(lengths)
+    perLength = bytearray(huffmanMaxBits)
+    for symbol, length, code in codes:
+        perLength[length - 1] += 1
+    bitTable = [""] * 256
+    for symbol, length, code in codes:
+        bitTable[symbol] = format(code, f"0{length}b")
+
+    # Join the code strings and convert them in one step
+    bits = "".join([bitTable[byte] for byte in data])
+    bits += "0" * (-len(bits) % 8)
+    stream = int(bits, 2).to_bytes(len(bits) // 8, "big")
+    return struct.pack("<I", len(data)) + bytes(perLength) + bytes(symbol for symbol, length, code in codes) + stream
+
+def decompressHuffman(data):
+    """
+    Decompresses canonical Huffman data, see compressHuffman for the layout.
+
+    Parameters:
+        data (bytes): The compressed data.
+
+    Returns:
+        bytes: The decompressed data.
+    """
+    size, = struct.unpack_from("<I", data)
+    perLength = data[4:4 + huffmanMaxBits]
+    symbolsStart = 4 + huffmanMaxBits
+    symbolsCount = sum(perLength)
+    symbols = data[symbolsStart:symbolsStart + symbolsCount]
+    if not size:
+        return b""
+    lengths = {}
+    position = 0
+    for length, count in enumerate(perLength, 1):
+        for symbol in symbols[position:position + count]:
+            lengths[symbol] = length
+        position += count
+    table = {format(code, f"0{length}b"): symbol for symbol, length, code in canonicalCodes(lengths)}
+
+    # The codes are prefix free, so one alternation splits the whole bit string
+    stream = bytes(data[symbolsStart + symbolsCount:])
+    bits = format(int.from_bytes(stream, "big"), f"0{len(stream) * 8}b") if stream else ""
+    pattern = re.compile("|".join(sorted(table, key=len)))
+    decoded = pattern.findall(bits)[:size]
+    if len(decoded) < size:
+        raise ValueError(size)
+    return bytes(table[code] for code in decoded)
+
+# Codec stages accepted with --codec and in the manifest: (decompress, compress).
+# A new stage only needs an entry here.
+codecStages = {
+    'lzss': (decompressLzss, compressLzss),
+    'rle': (decompressRle, compressRle),
+    'huffman': (decompressHuffman, compressHuffman),
+}
+
+def parseCodec(value):
+    """
+    Reads a codec, stage names separated by commas in the order they compress
+    (for example "rle,huffman").
+
+    Parameters:
+        value (str): The codec from the command line or the manifest.
+
+    Returns:
+        list: The stage names.
+
+    Raises:
+        KeyError: If a stage is not supported.
+    """
+    stages = [stage.strip().lower() for stage in value.split(",") if stage.strip()]
+    for stage in stages:
+        if stage not in codecStages:
+            raise KeyError(stage)
+    return stages
+
+def compress(data, codec):
+    """
+    Runs the compression stages of a codec in order.
+
+    Parameters:
+        data (bytes): The encoded text.
+        codec (str): The codec stages.
+
+    Returns:
+        bytes: The data to write to the ROM.
+    """
+    with st.stage("compression"):
+        for stage in parseCodec(codec):
+            data = codecStages[stage][1](data)
+    return data
+
+def decompress(data, codec):
+    """
+    Runs the decompression stages of a codec in reverse order.
+
+    Parameters:
+        data (bytes): The data read from the ROM.
+        codec (str): The codec stages.
+
+    Returns:
+        bytes: The encoded text.
+    """
+    with st.stage("compression"):
+        for stage in reversed(parseCodec(codec)):
+            data = codecStages[stage][0](data)
+    return data
+
+def iterPackedTexts(romData, addressesList, lineBreakers, charTable, codec, textStartAddress, textSize, lookupTable=None, breakers=None):
+    """
+    Yields the texts of a compressed block like decoder.iterTexts. The block is decompressed
+    as if it was stored at textStartAddress, so the pointers are read as usual.
+
+    Parameters:
+        romData (bytes): The complete ROM data (bytes, mmap or memoryview).
+        addressesList (list): A list of addresses to read the texts from.
+        lineBreakers (set): A set of byte values used as line breakers.
+        charTable (dict): A dictionary mapping byte values to characters or sequences.
+        codec (str): The codec stages.
+        textStartAddress (int): Start of the compressed block.
+        textSize (int): Size of the compressed block.
+        lookupTable (tuple): Optional result of decoder.buildLookupTable for charTable.
+        breakers (Pattern): Optional result of decoder.compileBreakers for lineBreakers.
+
+    Yields:
+        tuple: The address, the decoded text and the length in bytes of each line.
+    """
+    packedData = de.readRom(romData, textStartAddress, textSize)
+    if len(packedData) < textSize:
+        raise IndexError(textStartAddress)
+    textData = decompress(packedData, codec)
+    offsets = [address - textStartAddress for address in addressesList]
+    for offset, text, length in de.iterTexts(textData, offsets, lineBreakers, charTable, lookupTable, breakers):
+        yield offset + textStartAddress, text, length
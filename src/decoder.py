@@ -1,16 +1,41 @@
+import codecs
+import mmap
+import os
+import re
+import sys
+from array import array
+import records as rc
+import stats as st
+
+def mapRom(romFile):
+    """
+    Maps the whole ROM file into memory read-only, without copying it.
+    
+    Parameters:
+        romFile (str): The path to the ROM file.
+    
+    Returns:
+        mmap: The mapped ROM data, indexable and sliceable like bytes.
+    """
+    with st.stage("romRead"), open(romFile, "rb") as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
 def readRom(romFile, startAddress, tableSize):
     """
     Reads a segment of the ROM file from startOffset to endOffset.
+    If romFile is already mapped (mmap, bytes or memoryview), a zero-copy view is returned instead.
     
     Parameters:
-        romFile (str): The path to the ROM file.
+        romFile (str or buffer): The path to the ROM file, or the mapped ROM data.
         startOffset (int): The starting position in the file to read from.
         tableSize (int): Table pointer Size.
     
     Returns:
-        bytes: The data read from the ROM file.
+        bytes: The data read from the ROM file (memoryview for a mapped ROM).
     """
-    with open(romFile, "rb") as f:
+    if not isinstance(romFile, str):
+        return memoryview(romFile)[startAddress:startAddress + tableSize]
+    with st.stage("romRead"), open(romFile, "rb") as f:
         f.seek(startAddress)
         data = f.read(tableSize)
     return data
@@ -42,6 +67,71 @@ def readTbl(tblFile):
                     continue
     return charTable
 
+# Pointer table layouts: (record size, offset of the 2 pointer bytes, byte order)
+pointerLayouts = {
+    '2b': (2, 0, 'little'),
+    '2bb': (2, 0, 'big'),
+    '3b': (3, 1, 'little'),
+    '4b': (4, 2, 'big'),
+}
+
+def pointerValues(data, layout):
+    """
+    Reads the 2 pointer bytes of every record at once using strided views instead of a loop per pointer.
+    The low and high bytes of every pointer are gathered as two planes and joined into an unsigned short array.
+    
+    Parameters:
+        data (bytes): The raw pointer data (bytes, mmap or memoryview).
+        layout (str): A key of pointerLayouts, or '2bs' for split lsb/msb tables.
+    
+    Returns:
+        array: The 16 bit value of every complete record.
+    """
+    data = memoryview(data)
+    if layout == '2bs':
+        # First half holds every lsb, second half every msb
+        count = len(data) // 2
+        lsb, msb = data[:count], data[count:count * 2]
+    else:
+        size, offset, byteorder = pointerLayouts[layout]
+        count = len(data) // size
+        first, second = data[offset::size][:count], data[offset + 1::size][:count]
+        lsb, msb = (first, second) if byteorder == 'little' else (second, first)
+
+    # Interleave both planes into little-endian unsigned shorts
+    pairs = bytearray(count * 2)
+    pairs[0::2] = lsb
+    pairs[1::2] = msb
+    values = array('H', pairs)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+def decodePointers(data, header, layout):
+    """
+    Decodes a whole pointer table at once with pointerValues, and adds the header offset in a single pass.
+    
+    Parameters:
+        data (bytes): The raw pointer data read from the ROM (bytes, mmap or memoryview).
+        header (int): The offset to add to each pointer.
+        layout (str): A key of pointerLayouts, or '2bs' for split lsb/msb tables.
+    
+    Returns:
+        array: The processed pointers as a compact integer array.
+    """
+    st.count("bytesScanned", len(data))
+    with st.stage("pointerDecode"):
+        values = pointerValues(data, layout)
+        result = array('q', map(header.__add__, values))
+
+        # A truncated last record is still read as the original per pointer loop did
+        if layout != '2bs':
+            size, offset, byteorder = pointerLayouts[layout]
+            remainder = memoryview(data)[len(values) * size:]
+            if len(remainder):
+                result.append(int.from_bytes(remainder[offset:offset + 2], byteorder=byteorder) + header)
+    return result
+
 def processPointers2Bytes(data, header):
     """
     Processes the pointer data by converting it to pairs and transforming it to big-endian,
@@ -52,16 +142,9 @@ def processPointers2Bytes(data, header):
         header (int): The offset to add to each pointer.
     
     Returns:
-        list: A list of processed pointers as integers.
-    """
-    result = []
-    for i in range(0, len(data), 2):
-        # Read two bytes as a pair and convert to big-endian
-        pair = data[i:i + 2][::-1]  
-        # Convert the pair to an integer
-        value = int.from_bytes(pair, byteorder='big') + header
-        result.append(value)
-    return result
+        array: The processed pointers as integers.
+    """
+    return decodePointers(data, header, '2b')
 
 def processPointers2BytesBigEndian(data, header):
     """
@@ -73,20 +156,13 @@ def processPointers2BytesBigEndian(data, header):
         header (int): The offset to add to each pointer.
     
     Returns:
-        list: A list of processed pointers as integers.
-    """
-    result = []
-    for i in range(0, len(data), 2):
-        # Read two bytes as a pair and convert to big-endian
-        pair = data[i:i + 2]
-        # Convert the pair to an integer
-        value = int.from_bytes(pair, byteorder='big') + header
-        result.append(value)
-    return result
+        array: The processed pointers as integers.
+    """
+    return decodePointers(data, header, '2bb')
 
 def processPointers2BytesSeparated(data, header):
     """
-    Processes the pointer data by converting it to pairs and transforming it to big-endian,
+    Processes the pointer data by joining the lsb half and the msb half of the table,
     then adding the header offset.
     
     Parameters:
@@ -94,21 +170,9 @@ def processPointers2BytesSeparated(data, header):
         header (int): The offset to add to each pointer.
     
     Returns:
-        list: A list of processed pointers as integers.
-    """
-    result = []
-    half = len(data) // 2
-    for i in range(half):
-        # reorder list
-        firstByte = data[i]
-        secondByte = data[i + half]
-        # Read two bytes as a pair and convert to big-endian
-        pair = [firstByte, secondByte][::-1]  
-        # Convert the pair to an integer
-        value = int.from_bytes(pair, byteorder='big') + header
-        result.append(value)
-    return result
-
+        array: The processed pointers as integers.
+    """
+    return decodePointers(data, header, '2bs')
 
 def processPointers3Bytes(data, header):
     """
@@ -121,127 +185,139 @@ def processPointers3Bytes(data, header):
         header (int): The offset to add to each pointer.
     
     Returns:
-        list: A list of processed pointers as integers.
+        array: The processed pointers as integers.
     """
-    result = []
-    for i in range(0, len(data), 3):
-        # Read three bytes as a triplet
-        triplet = data[i:i + 3]
-        
-        # Get last two byte of the triplet and convert to big-endian
-        get2Bytes = triplet[1:][::-1]
-        
-        # Convert the final triplet to an integer
-        value = int.from_bytes(get2Bytes, byteorder='big') + header
-        result.append(value)    
-    return result
+    return decodePointers(data, header, '3b')
 
 def processPointers4Bytes(data, header):
     """
-    Processes the pointer data by converting it to pairs and transforming it to big-endian,
-    then adding the header offset.
+    Processes the pointer data by converting it to quartets and reading the last two bytes
+    in big-endian, then adding the header offset.
     
     Parameters:
         data (bytes): The raw pointer data read from the ROM.
         header (int): The offset to add to each pointer.
     
     Returns:
-        list: A list of processed pointers as integers.
+        array: The processed pointers as integers.
     """
-    result = []
-    for i in range(0, len(data), 4):
-        # Read four bytes as a quartet
-        quartet = data[i:i + 4]
-        
-        # Get last two byte of the quartet
-        get2Bytes = quartet[2:]
-        
-        # Convert the final triplet to an integer
-        value = int.from_bytes(get2Bytes, byteorder='big') + header
-        result.append(value)
-    return result
+    return decodePointers(data, header, '4b')
 
-def extractTexts(romData, addressesList, lineBreakers, charTable):
+def buildLookupTable(charTable):
     """
-    Extracts texts from the ROM data at specified addresses until a line breaker is encountered.
+    Precompiles the character table into 256 output fragments, one per byte value.
+    Bytes without a mapping get their ~XX~ escape baked in.
     
     Parameters:
-        romData (bytes): The complete ROM data.
+        charTable (dict): A dictionary mapping byte values to characters or sequences.
+    
+    Returns:
+        tuple: 256 strings, indexed by byte value.
+    """
+    return tuple(charTable.get(byte) or f"~{byte:02X}~" for byte in range(256))
+
+def compileBreakers(lineBreakers):
+    """
+    Compiles the line breakers into a byte class pattern, so the end of a line
+    is found with a single scan instead of a test per byte.
+    
+    Parameters:
+        lineBreakers (set): A set of byte values used as line breakers.
+    
+    Returns:
+        Pattern: A compiled regular expression matching any line breaker byte.
+    """
+    return re.compile(b"[" + b"".join(re.escape(bytes([byte])) for byte in sorted(lineBreakers)) + b"]")
+
+def iterTexts(romData, addressesList, lineBreakers, charTable, lookupTable=None, breakers=None):
+    """
+    Returns the texts of the ROM data at the specified addresses one by one, like scanTexts,
+    timed and counted when stats are collected.
+    
+    Parameters:
+        romData (bytes): The complete ROM data (bytes, mmap or memoryview).
         addressesList (list): A list of addresses to read the texts from.
         lineBreakers (set): A set of byte values used as line breakers.
         charTable (dict): A dictionary mapping byte values to characters or sequences.
+        lookupTable (tuple): Optional result of buildLookupTable for charTable, to skip building it.
+        breakers (Pattern): Optional result of compileBreakers for lineBreakers.
     
     Returns:
-        tuple: Containing:
-            - texts (list): Script text.
-            - totalBytesRead (int): Total text block size.
-            - linesLength (int): Lenght of each line.
+        generator: The address, the decoded text and the length in bytes of each line.
+    """
+    texts = scanTexts(romData, addressesList, lineBreakers, charTable, lookupTable, breakers)
+    if st.collector is None:
+        return texts
+    return countTexts(texts)
+
+def countTexts(texts):
+    """
+    Times the extraction of texts and counts the bytes read and the ~XX~ sequences
+    written for unmapped bytes (table entries never hold a ~).
+    
+    Parameters:
+        texts (iterable): Tuples (address, text, length in bytes), like scanTexts yields.
     
-        tuple: A list of extracted texts, the total bytes read, and the lengths of each extracted line in bytes.
+    Yields:
+        tuple: The same tuples.
     """
-    texts = []  
-    linesLength = []
-    bytesLineCounter = 0
-    total= 0
+    for addr, decodeText, length in st.timed(texts, "textExtraction"):
+        st.count("linesDecoded")
+        st.count("bytesScanned", length)
+        st.count("unmappedEscapes", decodeText.count("~") // 2)
+        yield addr, decodeText, length
+
+def scanTexts(romData, addressesList, lineBreakers, charTable, lookupTable=None, breakers=None):
+    """
+    Yields the texts of the ROM data at the specified addresses one by one, so a whole
+    dump never sits in memory. Each line is located with one breaker scan and translated as a whole run.
+    
+    Parameters:
+        romData (bytes): The complete ROM data (bytes, mmap or memoryview).
+        addressesList (list): A list of addresses to read the texts from.
+        lineBreakers (set): A set of byte values used as line breakers.
+        charTable (dict): A dictionary mapping byte values to characters or sequences.
+        lookupTable (tuple): Optional result of buildLookupTable for charTable, to skip building it.
+        breakers (Pattern): Optional result of compileBreakers for lineBreakers.
+    
+    Yields:
+        tuple: The address, the decoded text and the length in bytes of each line.
+    """
+    romView = memoryview(romData)
+    if lookupTable is None:
+        lookupTable = buildLookupTable(charTable)
+    if breakers is None:
+        breakers = compileBreakers(lineBreakers)
 
     # Loop over each starting address in the list
     for addr in addressesList:
-        text = bytearray()
-        
-        while True:
-            byte = romData[addr]  
-            bytesLineCounter += 1
+        if not 0 <= addr < len(romView):
+            raise IndexError(addr)
+        # Find the line breaker, the line ends right after it
+        match = breakers.search(romView, addr)
+        if match is None:
+            raise IndexError(addr)
+        end = match.end()
 
-            # If the byte is a line-breaker, stop extracting
-            if byte in lineBreakers:
-                breakerByte = byte
-                break
+        # Translate the whole line, breaker included, with the precompiled fragments
+        decodeText, _ = codecs.charmap_decode(romView[addr:end], 'strict', lookupTable)
+        yield addr, decodeText, end - addr
 
-            # Map the byte using charTable to get the character
-            char = charTable.get(byte, None)  
-            if char:
-                # If single character
-                if len(char) == 1:
-                    text.append(ord(char))
-                # If multiple characters (DTE/MTE)
-                else:  
-                    for c in char:
-                        text.append(ord(c))
-            # If byte is not in charTable, print in format ~hex~
-            else:
-                hexValue = format(byte, '02X')
-                text.extend(f"~{hexValue}~".encode('UTF-8'))
-            addr += 1
-            
-        # Add the breaker byte to the text
-        if breakerByte is not None:
-            char = charTable.get(breakerByte, None)
-            if char:
-                # if assigned to a single character
-                if len(char) == 1:
-                    text.append(ord(char))
-                # if assigned to a chain characters
-                else:
-                    for c in char:
-                        text.append(ord(c))
-            else:
-                # If the breaker byte doesn't have a mapping,  print in format ~hex~
-                hexValue = format(breakerByte, '02X')
-                text.extend(f"~{hexValue}~".encode('UTF-8'))
-                            
-        # Convert byte array to string
-        decodeText = text.decode('iso-8859-1', errors='replace')
-
-        # Append the decoded text to the list
-        texts.append(decodeText)
-        linesLength.append(bytesLineCounter)
-        total = total + bytesLineCounter
-        bytesLineCounter = 0
-
-    # Calculate total bytes read 
-    totalBytesRead = abs((addressesList[-1] + linesLength[-1]) - addressesList[0])
-
-    return texts, totalBytesRead, linesLength
+def extractTexts(romData, addressesList, lineBreakers, charTable):
+    """
+    Extracts texts from the ROM data at specified addresses until a line breaker is encountered.
+    
+    Parameters:
+        romData (bytes): The complete ROM data (bytes, mmap or memoryview).
+        addressesList (list): A list of addresses to read the texts from.
+        lineBreakers (set): A set of byte values used as line breakers.
+        charTable (dict): A dictionary mapping byte values to characters or sequences.
+    
+    Returns:
+        LineRecords: The address, text and length in bytes of every line, in compact
+        arrays. records.totalBytes() is the total text block size.
+    """
+    return rc.LineRecords(iterTexts(romData, addressesList, lineBreakers, charTable))
 
 def parseLineBreakers(string):
     """
@@ -295,16 +371,44 @@ def writeOutFile(file, scriptText, pointersStartAddress, pointerTableSize, addre
         linesLenght (list): A list of the length of each line in the script.
         lineBreaker (int): A value used to split lines.
     """     
-    with open(file, "w", encoding='UTF-8') as f:
-        formattedString = formatHexString(lineBreaker)
-        f.write(f";{{{pointersStartAddress:08X}-{(pointersStartAddress + pointerTableSize - 1):08X}-{pointerTableSize:08X}}}{formattedString}\n")
-        i = 0
-        for line in scriptText:
-            # Format the address as uppercase hex with leading zeros (8 digits wide)
-            addressStr = f"{addressList[i]:08X}"
-            # Write the formatted address followed by the line content and length
-            f.write(f"@{i+1}\n")
-            f.write(f";{addressStr}{{{line}}}#{len(line)}#{linesLenght[i]}\n")
-            f.write(f"{line}\n")
-            f.write("|\n")
-            i += 1
+    writeScriptStream(file, zip(addressList, scriptText, linesLenght), pointersStartAddress, pointerTableSize, lineBreaker)
+
+def writeScriptStream(file, records, pointersStartAddress, pointerTableSize, lineBreaker):
+    """
+    Writes script records as they come, through a large write buffer.
+    The script goes to a temporary file that replaces the output only when every
+    line was written, so an error keeps the previous script.
+    
+    Parameters:
+        file (str): The path to the output file.
+        records (iterable): Tuples (address, text, length in bytes), like iterTexts yields
+            or a LineRecords holds.
+        pointersStartAddress (int): The starting address of the pointer table.
+        pointerTableSize (int): The size of the pointer table).
+        lineBreaker (int): A value used to split lines.
+    
+    Returns:
+        int: Total text block size, from the first line to the end of the last one.
+    """
+    with st.stage("fileWrite"):
+        tempFile = file + ".tmp"
+        firstAddress = lastEnd = None
+        try:
+            with open(tempFile, "w", encoding='UTF-8', buffering=1 << 20) as f:
+                formattedString = formatHexString(lineBreaker)
+                f.write(f";{{{pointersStartAddress:08X}-{(pointersStartAddress + pointerTableSize - 1):08X}-{pointerTableSize:08X}}}{formattedString}\n")
+                for i, (address, line, length) in enumerate(records, 1):
+                    if firstAddress is None:
+                        firstAddress = address
+                    lastEnd = address + length
+                    # Address as uppercase hex with leading zeros (8 digits wide), then the line content and length
+                    f.write(f"@{i}\n;{address:08X}{{{line}}}#{len(line)}#{length}\n{line}\n|\n")
+            # A table without pointers has no text block
+            if firstAddress is None:
+                raise IndexError(pointersStartAddress)
+        except BaseException:
+            if os.path.exists(tempFile):
+                os.remove(tempFile)
+            raise
+        os.replace(tempFile, file)
+    return abs(lastEnd - firstAddress)
@@ -0,0 +1,178 @@
+import heapq
+import itertools
+import re
+from collections import Counter
+
+# Splits a script line into plain text and ~XX~ hexadecimal sequences
+hexSplit = re.compile(r'~[A-Za-z0-9]+~')
+hexCode = re.compile(r'~([0-9A-Fa-f]{2})~')
+
+# First private use character, stands for the entries already chosen
+placeholderBase = 0xE000
+
+# Characters no entry can hold: piece separators and chosen entry placeholders
+boundaryChars = re.compile("[\n\ue000-\uf8ff]")
+
+def findFreeCodes(charTable, textScripts, lineBreakers):
+    """
+    Finds the byte values not used by the table, the line breakers or the ~XX~ codes of the scripts.
+    
+    Parameters:
+        charTable (dict): Dictionary that maps character sequences to byte values.
+        textScripts (list): A list of scripts, each a list of lines.
+        lineBreakers (set): A set of byte values used as line breakers.
+    
+    Returns:
+        list: The free byte values in increasing order.
+    """
+    usedCodes = set(charTable.values()) | set(lineBreakers)
+    for textScript in textScripts:
+        for line in textScript:
+            for code in hexCode.findall(line):
+                usedCodes.add(int(code, 16))
+    return [byte for byte in range(256) if byte not in usedCodes]
+
+def buildCorpus(textScripts):
+    """
+    Joins the plain text pieces of every script into one string, skipping ~XX~ codes
+    and & lines. Pieces are separated by newlines, which no entry can span.
+    
+    Parameters:
+        textScripts (list): A list of scripts, each a list of lines.
+    
+    Returns:
+        str: The plain text of all the scripts.
+    """
+    pieces = []
+    for textScript in textScripts:
+        for line in textScript:
+            if line.startswith("&"):
+                continue
+            pieces.extend(piece for piece in hexSplit.split(line) if piece)
+    return "\n".join(pieces)
+
+def iterSequences(text, maxLength):
+    """
+    Iterates over every sequence from 2 to maxLength characters of a text, boundaries included.
+    The slicing runs in C through map, so feeding it to a Counter never enters Python code.
+    
+    Parameters:
+        text (str): The text to scan.
+        maxLength (int): The longest sequence to count.
+    
+    Returns:
+        iterator: Every sequence of the text.
+    """
+    textLength = len(text)
+    return itertools.chain.from_iterable(
+        map(text.__getitem__, map(slice, range(textLength - length + 1), range(length, textLength + 1)))
+        for length in range(2, maxLength + 1)
+    )
+
+def countSequences(corpus, maxLength):
+    """
+    Counts every sequence from 2 to maxLength characters in the corpus, skipping
+    those that hold a boundary character.
+    
+    Parameters:
+        corpus (str): The text to scan.
+        maxLength (int): The longest sequence to count.
+    
+    Returns:
+        Counter: Each sequence with its number of occurrences.
+    """
+    counts = Counter(iterSequences(corpus, maxLength))
+    for seq in [seq for seq in counts if boundaryChars.search(seq)]:
+        del counts[seq]
+    return counts
+
+def coveredSequences(corpus, matches, seqLength, maxLength):
+    """
+    Iterates over the sequences overlapping the given occurrences, each counted once:
+    a sequence belongs to the first occurrence it overlaps. Offsets of the covered
+    sequences only depend on the room around an occurrence, so they are computed once
+    per case and the slicing runs in C.
+    
+    Parameters:
+        corpus (str): The text.
+        matches (list): Tuples (start, end) of non overlapping occurrences, in order.
+        seqLength (int): The length of the occurrences.
+        maxLength (int): The longest sequence counted.
+    
+    Returns:
+        iterator: One iterator of covered sequences per occurrence.
+    """
+    patterns = {}
+    corpusLength = len(corpus)
+    previousEnd = 0
+    for start, end in matches:
+        # Sequences overlapping the previous occurrence were already counted
+        first = max(-maxLength + 1, previousEnd - start)
+        limit = min(corpusLength - start, seqLength + maxLength - 1)
+        if (first, limit) not in patterns:
+            pairs = [(i, j) for i in range(first, seqLength) for j in range(max(i + 2, 1), min(i + maxLength, limit) + 1)]
+            patterns[first, limit] = ([i for i, j in pairs], [j for i, j in pairs])
+        starts, stops = patterns[first, limit]
+        yield map(corpus.__getitem__, map(slice, map(start.__add__, starts), map(start.__add__, stops)))
+        previousEnd = end
+
+def generateDictionary(textScripts, freeCodes, maxLength=8, maxEntries=None):
+    """
+    Chooses the DTE/MTE entries that save most bytes in the scripts.
+    Sequences are counted once; after each choice only the sequences overlapping the
+    replaced occurrences are discounted, and a lazy max-heap returns the next best
+    saving (occurrences x (length - 1)).
+    
+    Parameters:
+        textScripts (list): A list of scripts, each a list of lines.
+        freeCodes (list): The byte values available for new entries.
+        maxLength (int): The longest sequence for an entry.
+        maxEntries (int): Maximum number of entries, by default every free code.
+    
+    Returns:
+        list: Tuples (byte value, sequence) in the order they were chosen.
+    """
+    corpus = buildCorpus(textScripts)
+    counts = countSequences(corpus, maxLength)
+    # Occurrences lost to chosen entries are counted apart, current count = counts - removed
+    removed = Counter()
+
+    heap = [(-count * (len(seq) - 1), seq) for seq, count in counts.items() if count > 1]
+    heapq.heapify(heap)
+
+    entries = []
+    limit = len(freeCodes) if maxEntries is None else min(maxEntries, len(freeCodes))
+    while heap and len(entries) < limit:
+        saving, seq = heapq.heappop(heap)
+        count = counts[seq] - removed[seq]
+        # Stale score, the sequence was partly covered by a previous entry
+        if -saving != count * (len(seq) - 1):
+            if count > 1:
+                heapq.heappush(heap, (-count * (len(seq) - 1), seq))
+            continue
+        placeholder = chr(placeholderBase + len(entries))
+        entries.append((freeCodes[len(entries)], seq))
+
+        # Discount every sequence overlapping a replaced occurrence, then replace them
+        matches = [match.span() for match in re.finditer(re.escape(seq), corpus)]
+        removed.update(itertools.chain.from_iterable(coveredSequences(corpus, matches, len(seq), maxLength)))
+        corpus = corpus.replace(seq, placeholder)
+    return entries
+
+def writeTblFile(tblFile, outFile, entries):
+    """
+    Writes a copy of a .tbl file with the new entries added at the end.
+    
+    Parameters:
+        tblFile (str): The path to the original .tbl file.
+        outFile (str): The path to the new .tbl file.
+        entries (list): Tuples (byte value, sequence) to add.
+    """
+    with open(tblFile, "r", encoding="UTF-8") as f:
+        content = f.read()
+    with open(outFile, "w", encoding="UTF-8") as f:
+        f.write(content)
+        if content and not content.endswith("\n"):
+            f.write("\n")
+        for byte, seq in entries:
+            f.write(f"{byte:02X}={seq}\n")
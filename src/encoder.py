@@ -1,23 +1,31 @@
+import bisect
+import functools
+import os
 import re
+import shutil
+from array import array
+import records as rc
+import stats as st
 
-def readScriptFile(file):
+def openScriptFile(file):
     """
-    Reads a file with a game's text.
-    Extracts pointer information from the first line and handles multiple breaker lines or just one.
+    Opens a file with a game's text and reads its first line only. The text lines are
+    read lazily, so a large script never sits in memory.
     
     Parameters:
         file (str): The path to the file to read.
     
     Returns:
         tuple: Containing:
-            - textData: A list of strings, each representing a line of text from the file.
-            - hexData: A list of important data (pointersStartAddress,pointersEndAddress,PointerTableSize).
+            - textData: An iterator over the text lines of the file.
+            - hexData: Important data (pointersStartAddress,pointersEndAddress,PointerTableSize).
             - dataOut: A string of line breakers.
     """
     hexData = []
     lineBreakers=''
     # Open file
-    with open(file, "r", encoding='UTF-8') as f:
+    f = open(file, "r", encoding='UTF-8')
+    try:
         # Read first line
         firstLine = f.readline().strip()
         match = re.match(r";\{([0-9A-Fa-f\-]+)\}-(.*)", firstLine)
@@ -27,13 +35,43 @@ def readScriptFile(file):
         # Extract and format breakerLines
         byte = match.group(2)
         lineBreakers = ",".join([f"0x{val}" for val in byte.split('-')])
-        
-    # Process text (excluding comments)
-        textData = [
-            line.rstrip() for line in f.readlines()
-            if not (line.startswith(";") or line.startswith("@") or line.startswith("|"))
-        ]
-    return textData, hexData[0], hexData[1], hexData[2], lineBreakers
+    except BaseException:
+        f.close()
+        raise
+    return iterScriptLines(f), hexData[0], hexData[1], hexData[2], lineBreakers
+
+def iterScriptLines(f):
+    """
+    Yields the text lines of an open script file (excluding comments), then closes it.
+    
+    Parameters:
+        f (file): The script file, after its first line.
+    
+    Yields:
+        str: Each text line.
+    """
+    with f:
+        for line in f:
+            if not (line.startswith(";") or line.startswith("@") or line.startswith("|")):
+                yield line.rstrip()
+
+def readScriptFile(file):
+    """
+    Reads a file with a game's text.
+    Extracts pointer information from the first line and handles multiple breaker lines or just one.
+    
+    Parameters:
+        file (str): The path to the file to read.
+    
+    Returns:
+        tuple: Containing:
+            - textData: A list of strings, each representing a line of text from the file.
+            - hexData: A list of important data (pointersStartAddress,pointersEndAddress,PointerTableSize).
+            - dataOut: A string of line breakers.
+    """
+    with st.stage("scriptParse"):
+        textData, pointersStartAddress, pointersEndAddress, pointerTableSize, lineBreakers = openScriptFile(file)
+        return list(textData), pointersStartAddress, pointersEndAddress, pointerTableSize, lineBreakers
 
 def readTblFileInverted(tblFile):
     """
@@ -66,89 +104,353 @@ def readTblFileInverted(tblFile):
                     continue
     return charTable, maxSequence
 
-def encodeText(textScript, lineBreakers, charTable, longestChar):
+def buildTrie(charTable):
+    """
+    Compiles the inverted character table into a trie, so the longest sequence at a
+    position is found by walking the text once instead of probing every length.
+    
+    Parameters:
+        charTable (dict): Dictionary that maps character sequences to byte values.
+    
+    Returns:
+        dict: Nested dictionaries keyed by character, the byte value of a complete
+            sequence is stored under the None key of its last node.
+    """
+    trie = {}
+    for seq, value in charTable.items():
+        if not seq:
+            continue
+        node = trie
+        for char in seq:
+            node = node.setdefault(char, {})
+        node[None] = value
+    return trie
+
+def encodeGreedy(part, trie, longestChar, counts=None):
+    """
+    Encodes a piece of text taking the longest sequence of the table at each position.
+    
+    Parameters:
+        part (str): The text to encode.
+        trie (dict): The compiled character table from buildTrie.
+        longestChar (int): Maximum length of sequences to consider while encoding.
+        counts (dict): Optional sequenceHits, singleChars and fallbackChars counters, increased
+            for each byte written: a DTE/MTE sequence, a single character or a character
+            missing from the table.
+    
+    Returns:
+        bytearray: The encoded text.
+    """
+    i = 0
+    partLength = len(part)
+    encodedPart = bytearray()
+    while i < partLength:
+        # Walk the trie as far as the text allows, keeping the longest sequence found
+        node = trie
+        matchValue = None
+        j = i
+        limit = min(i + longestChar, partLength)
+        while j < limit:
+            node = node.get(part[j])
+            if node is None:
+                break
+            j += 1
+            if None in node:
+                matchValue = node[None]
+                matchEnd = j
+        # If the sequence is found in the character table, encode it
+        if matchValue is not None:
+            encodedPart.append(matchValue)
+            if counts is not None:
+                counts["sequenceHits" if matchEnd - i > 1 else "singleChars"] += 1
+            i = matchEnd
+        else:
+            # If no sequence is found, encode the character individually (ASCII)
+            encodedPart.append(ord(part[i]))
+            if counts is not None:
+                counts["fallbackChars"] += 1
+            i += 1
+    return encodedPart
+
+def encodeOptimal(part, trie, longestChar, counts=None):
+    """
+    Encodes a piece of text with the fewest bytes possible. Walking backwards, the
+    cheapest encoding of every suffix is computed from all the table sequences that
+    start at that position (shortest path over the text). On ties the longest
+    sequence wins, like in the greedy encoder.
+    
+    Parameters:
+        part (str): The text to encode.
+        trie (dict): The compiled character table from buildTrie.
+        longestChar (int): Maximum length of sequences to consider while encoding.
+        counts (dict): Optional counters, see encodeGreedy.
+    
+    Returns:
+        bytearray: The encoded text.
+    """
+    partLength = len(part)
+    cost = [0] * (partLength + 1)
+    choice = [None] * partLength
+    for i in range(partLength - 1, -1, -1):
+        node = trie
+        best = None
+        j = i
+        limit = min(i + longestChar, partLength)
+        while j < limit:
+            node = node.get(part[j])
+            if node is None:
+                break
+            j += 1
+            if None in node and (best is None or cost[j] <= cost[best[0]]):
+                best = (j, node[None], True)
+        # If no sequence is found, encode the character individually (ASCII)
+        if best is None:
+            best = (i + 1, ord(part[i]), False)
+        choice[i] = best
+        cost[i] = cost[best[0]] + 1
+
+    # Follow the chosen sequences from the start of the text
+    encodedPart = bytearray()
+    i = 0
+    while i < partLength:
+        start = i
+        i, value, found = choice[i]
+        encodedPart.append(value)
+        if counts is not None:
+            counts["fallbackChars" if not found else "sequenceHits" if i - start > 1 else "singleChars"] += 1
+    return encodedPart
+
+def findTailHosts(encodedLines):
+    """
+    Finds, for every encoded line that is the ending of a longer one, the longest line
+    holding it. Lines are sorted by their reversed bytes, so a line is an ending of
+    another exactly when its reverse is a prefix of the next reversed line.
+    
+    Parameters:
+        encodedLines (iterable): The distinct encoded lines (bytes).
+    
+    Returns:
+        dict: Each encoded line that can share the tail of another, with its host line.
+    """
+    reversedLines = sorted(line[::-1] for line in encodedLines if line)
+    hosts = {}
+    host = None
+    # Walk backwards so the host of the next line is already known
+    for i in range(len(reversedLines) - 1, -1, -1):
+        if host is not None and reversedLines[i + 1].startswith(reversedLines[i]):
+            hosts[reversedLines[i][::-1]] = host
+        else:
+            host = reversedLines[i][::-1]
+    return hosts
+
+def encodeScriptLine(line, trie, longestChar, encodePart, counts=None):
+    """
+    Encodes a whole script line, ~XX~ sequences included.
+    The result only depends on the line, so it can be cached between runs.
+    
+    Parameters:
+        line (str): The script line.
+        trie (dict): The compiled character table from buildTrie.
+        longestChar (int): Maximum length of sequences to consider while encoding.
+        encodePart (function): encodeGreedy or encodeOptimal.
+        counts (dict): Optional counters of what the line is made of: the ones of encodeGreedy,
+            escapesEncoded and pointerReuses.
+    
+    Returns:
+        tuple: Containing:
+            - finalLine (bytes): The encoded line.
+            - repeatLine (bool): True if the line holds a & (repeat last pointer) marker.
+            - lastPart (bytes): The last encoded piece, its line breakers end the line.
+                Empty if the line has no encoded piece, None if the line is empty.
+    """
+    # Format to find hexadecimal sequences ~XX~
+    hexCode = r'~([0-9A-Fa-f]{2})~'
+
+    # Break the line into substrings of normal text and hexadecimal sequences
+    parts = [part for part in re.split(r'(~[A-Za-z0-9]+~)', line) if part]
+    processedParts = []
+    repeatLine = False
+    for part in parts:
+        # Repeat last pointer function
+        if part.startswith("&"):
+            repeatLine = True
+            if counts is not None:
+                counts["pointerReuses"] += 1
+        # If it is a hexadecimal sequence
+        elif re.match(hexCode, part):
+            processedParts.append(bytes([int(part[1:3], 16)]))
+            if counts is not None:
+                counts["escapesEncoded"] += 1
+        else:
+            # Encode the sequence using the .tbl table
+            processedParts.append(bytes(encodePart(part, trie, longestChar, counts)))
+
+    if processedParts:
+        lastPart = processedParts[-1]
+    else:
+        lastPart = b"" if parts else None
+    return b"".join(processedParts), repeatLine, lastPart
+
+def encodeText(textScript, lineBreakers, charTable, longestChar, optimal=False, shareLines=None, lineCache=None, layout=None, trie=None):
     """
     Encodes the text into bytes (supports DTE/MTE).
+    Identical lines can be written once with every pointer on the same copy ('lines'),
+    and lines ending another line can point inside it ('tails').
     
     Parameters:
-        textScript (list): List of text strings to encode.
+        textScript (iterable): Text strings to encode, or the LineRecords of a decoded block,
+            read only once unless shareLines is 'tails'.
         charTable (dict): Dictionary that maps character sequences to byte values.
         longestChar (int): Maximum length of sequences to consider while encoding.
+        optimal (bool): Use the shortest encoding of each line instead of the greedy one.
+        shareLines (str): None, 'lines' or 'tails'.
+        lineCache (dict): Optional encodeScriptLine results by line, used and filled.
+        layout (list): Optional list receiving (offset, encoded line) for every line written.
+        trie (dict): Optional result of buildTrie for charTable, to skip building it.
         
     Returns:
         tuple: A tuple containing:
             - bytearray: The encoded text data.
-            - pointers: List of pointers (cumulative lengths).
+            - pointers: Array of pointers (cumulative lengths).
     """
-    encodedData = bytearray()
-    totalBytes = 0
-    cumulativeLength = [0]
-    
-    # Format to find hexadecimal sequences ~XX~
-    hexCode = r'~([0-9A-Fa-f]{2})~'
+    with st.stage("encode"):
+        if isinstance(textScript, rc.LineRecords):
+            textScript = textScript.texts()
+        counting = st.collector is not None
+        if counting:
+            # Lines read lazily count as script parsing, the content of each line is counted once
+            textScript = st.timed(textScript, "scriptParse")
+            lineCounts = {}
+        encodedData = bytearray()
+        totalBytes = 0
+        cumulativeLength = array('I', [0])
+        if trie is None:
+            trie = buildTrie(charTable)
+        encodePart = encodeOptimal if optimal else encodeGreedy
 
-    for line in textScript:
-        # Break the line into substrings of normal text and hexadecimal sequences
-        parts = []
-        splitLine = re.split(r'(~[A-Za-z0-9]+~)', line)
-        splitLine = [part for part in splitLine if part]
-        parts.extend(splitLine)
-        # Process each substring
-        processedParts = []
-        for part in parts:
+        def encodeLine(line):
+            if not counting:
+                return encodeScriptLine(line, trie, longestChar, encodePart)
+            # The counters of a line are taken while it is encoded
+            counts = dict.fromkeys(("sequenceHits", "singleChars", "fallbackChars", "escapesEncoded", "pointerReuses"), 0)
+            encodedLine = encodeScriptLine(line, trie, longestChar, encodePart, counts)
+            lineCounts[line] = counts
+            return encodedLine
+    
+        if lineCache is None and shareLines != 'tails':
+            # Lines are read lazily, a bounded cache keeps memory flat on large scripts
+            encodeCached = functools.lru_cache(maxsize=4096)(encodeLine)
+        else:
+            if lineCache is None:
+                lineCache = {}
+        
+            def encodeCached(line):
+                if line not in lineCache:
+                    lineCache[line] = encodeLine(line)
+                return lineCache[line]
+    
+        # Lines already written with their offset, and pointers waiting for their host line
+        writtenLines = {}
+        pendingPointers = {}
+        nextLinePointer = 0
+        tailHosts = {}
+        if shareLines == 'tails':
+            # Every line must be known before the first one is written, and only complete
+            # strings (ending in a line breaker) can host the tail of another
+            textScript = list(textScript)
+            encodedLines = {encodeCached(line)[0] for line in textScript}
+            tailHosts = findTailHosts(line for line in encodedLines if line and line[-1] in lineBreakers)
+    
+        # An empty line ends like the line before it
+        lastPart = b""
+        for line in textScript:
+            lineStart = totalBytes
+            finalLine, repeatLine, linePart = encodeCached(line)
+            if linePart is not None:
+                lastPart = linePart
+            if counting:
+                # Lines given already encoded in lineCache are only encoded to be counted
+                if line not in lineCounts:
+                    encodeLine(line)
+                for name, amount in lineCounts[line].items():
+                    st.count(name, amount)
+        
             # Repeat last pointer function
-            if part.startswith("&"):
+            if repeatLine:
+                pendingPointers.pop(len(cumulativeLength) - 1, None)
                 cumulativeLength.pop()
-                copyLength = totalBytes
-                totalBytes = cumulativeLength[-1]
-                cumulativeLength.append(totalBytes)
-                totalBytes = copyLength
-                continue
-            # If it is a hexadecimal sequence
-            elif re.match(hexCode, part):
-                processedParts.append(bytes([int(part[1:3], 16)])) 
-                totalBytes += 1
+                cumulativeLength.append(cumulativeLength[-1])
+                if len(cumulativeLength) - 2 in pendingPointers:
+                    pendingPointers[len(cumulativeLength) - 1] = pendingPointers[len(cumulativeLength) - 2]
+            totalBytes += len(finalLine)
+        
+            # Share the line when the last pointer was made for it, no other pointer
+            # (like the one of an empty line) points at it, and a copy exists. A line
+            # without a line breaker goes on into the next one, so it is never shared.
+            sharedLine = False
+            completeLine = bool(finalLine) and finalLine[-1] in lineBreakers
+            ownPointer = nextLinePointer == len(cumulativeLength) - 1
+            if ownPointer and len(cumulativeLength) > 1 and len(cumulativeLength) - 2 not in pendingPointers:
+                ownPointer = cumulativeLength[-2] != lineStart
+            if shareLines and completeLine and not repeatLine and ownPointer:
+                host = tailHosts.get(finalLine, finalLine)
+                if host in writtenLines:
+                    cumulativeLength[-1] = writtenLines[host] + len(host) - len(finalLine)
+                    sharedLine = True
+                elif host != finalLine:
+                    pendingPointers[len(cumulativeLength) - 1] = (host, len(host) - len(finalLine))
+                    sharedLine = True
+        
+            if sharedLine:
+                totalBytes = lineStart
             else:
-                # Encode the sequence using the .tbl table
-                i = 0
-                encodedPart = bytearray()
-                while i < len(part):
-                    # Try to match the longest possible sequence starting from the current position
-                    for length in range(min(longestChar, len(part) - i), 0, -1):
-                        seq = part[i:i+length]
-                        # If the sequence is found in the character table, encode it
-                        if seq in charTable:
-                            encodedPart.append(charTable[seq])
-                            totalBytes += 1
-                            i += length
-                            break
-                    else:
-                         # If no sequence is found, encode the character individually (ASCII)
-                        encodedPart.append(ord(part[i]))
-                        totalBytes += 1
-                        i += 1
-                
-                # Add the encoded part to processed parts
-                processedParts.append(encodedPart)
-
-        # Replace the hexadecimal sequences with their values
-        finalLine = bytearray()
-        for part in processedParts:
-            finalLine.extend(part)
-
-        # Add the processed line to the final result
-        encodedData.extend(finalLine)
+                # Add the processed line to the final result
+                if shareLines and completeLine:
+                    writtenLines.setdefault(finalLine, lineStart)
+                encodedData.extend(finalLine)
+                if layout is not None and finalLine:
+                    layout.append((lineStart, finalLine))
         
-        # Mark the end of the line as a pointer (cumulative length)
-        for char in part:
-            if char in lineBreakers:
-                cumulativeLength.append(totalBytes)
+            # Mark the end of the line as a pointer (cumulative length)
+            nextLinePointer = None
+            for byte in lastPart:
+                if byte in lineBreakers:
+                    cumulativeLength.append(totalBytes)
+                    nextLinePointer = len(cumulativeLength) - 1
+
+        # Point the lines sharing a later line to their host
+        for index, (host, offset) in pendingPointers.items():
+            if index < len(cumulativeLength) - 1:
+                cumulativeLength[index] = writtenLines[host] + offset
 
-    # Remove the unnecessary pointer at the end
-    cumulativeLength.pop()
+        # Remove the unnecessary pointer at the end
+        cumulativeLength.pop()
+        if counting:
+            st.count("linesEncoded", len(cumulativeLength))
+            st.count("bytesEncoded", len(encodedData))
     
     return encodedData, cumulativeLength
 
+def relocatePointers(pointersList, layout, places):
+    """
+    Moves the pointers of a sequential layout to the new place of their line.
+    Pointers inside a line (shared tails) or past the last one keep their distance to the line start.
+
+    Parameters:
+        pointersList (list): Pointers (cumulative lengths) of the sequential layout.
+        layout (list): Tuples (offset, encoded line) of the sequential layout.
+        places (list): The new offset of each line.
+
+    Returns:
+        array: The relocated pointers.
+    """
+    starts = [offset for offset, finalLine in layout]
+    relocated = array('I')
+    for ptr in pointersList:
+        line = max(bisect.bisect_right(starts, ptr) - 1, 0)
+        relocated.append(places[line] + ptr - starts[line])
+    return relocated
+
 def calculatePointer2Bytes(listCumulativeLength, firstPointer, headerSize):
     """
     Calculates and returns the pointer data after adjusting each pointer with the header size
@@ -291,6 +593,41 @@ def writeROM(romFile, startOffset, data):
         startOffset (int): The offset in the ROM file where data should be written.
         data (bytes or bytearray): The data to write to the ROM.
     """
-    with open(romFile, "r+b") as f: 
+    with st.stage("romWrite"), open(romFile, "r+b") as f:
         f.seek(startOffset)
         f.write(data)
+
+def writeROMAtomic(romFile, data):
+    """
+    Replaces the ROM file with new data in one step: the data goes to a temporary file
+    next to it that is renamed over the ROM, so a reader never sees a partial write.
+    
+    Parameters:
+        romFile (str): The path to the ROM file.
+        data (bytes or bytearray): The complete ROM data.
+    """
+    tempFile = romFile + ".tmp"
+    try:
+        with st.stage("romWrite"), open(tempFile, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        shutil.copymode(romFile, tempFile)
+        os.replace(tempFile, romFile)
+    except BaseException:
+        if os.path.exists(tempFile):
+            os.remove(tempFile)
+        raise
+
+def writeROMRanges(romFile, ranges):
+    """
+    Writes several pieces of data to the ROM opening it only once.
+    
+    Parameters:
+        romFile (str): The path to the ROM file.
+        ranges (list): Tuples (offset, data) to write.
+    """
+    with st.stage("romWrite"), open(romFile, "r+b") as f:
+        for startOffset, data in ranges:
+            f.seek(startOffset)
+            f.write(data)
@@ -0,0 +1,253 @@
+"""
+Library interface of HexString, to decode and encode text blocks in-process.
+
+    import hexstring as hs
+
+    table = hs.Table("decoder.tbl", "encoder.tbl", "0x2F,0x21,0xFF")
+    with hs.Rom("game.nes") as rom:
+        lines = [text for address, text, length in hs.decodeBlock(rom, table, block)]
+        hs.encodeBlock(rom, table, block, lines)
+
+A block is a dictionary like the blocks of a manifest (pointersFormat, pointersStartAddress,
+tablePointersSize, textStartAddress, textSize, headerSize, optimal, shareLines, codec).
+The table and the ROM are parsed once and reused by every call.
+"""
+import codecs
+import decoder as de
+import encoder as en
+import batch as ba
+import tablecache as tc
+
+# Encoded lines kept by a table for each encoding mode before the cache is cleared
+lineCacheSize = 65536
+
+class Table:
+    """
+    Compiled character table, in both directions, with the line breakers.
+
+    Attributes:
+        decodeTable (dict): Byte values to characters or sequences, like decoder.readTbl.
+        encodeTable (dict): Characters or sequences to byte values, like encoder.readTblFileInverted.
+        longestChar (int): Length of the longest sequence of encodeTable.
+        lineBreakers (set): Byte values used as line breakers.
+        lookupTable (tuple): The 256 decoded fragments, from decoder.buildLookupTable.
+        breakers (Pattern): The line breakers pattern, from decoder.compileBreakers.
+        trie (dict): The longest match structure, from encoder.buildTrie.
+    """
+
+    def __init__(self, decoderTbl, encoderTbl=None, lineBreakers="0x00"):
+        """
+        Parameters:
+            decoderTbl (str): The path to the decoder .tbl file.
+            encoderTbl (str): The path to the encoder .tbl file, decoderTbl if not given.
+            lineBreakers (str or set): Comma-separated hex values, or a set of byte values.
+        """
+        # Compiled structures come from the table cache
+        decoding = tc.loadTable(decoderTbl)
+        encoding = tc.loadTable(encoderTbl or decoderTbl)
+        self.decodeTable = decoding["decodeTable"]
+        self.lookupTable = decoding["lookupTable"]
+        self.encodeTable = encoding["encodeTable"]
+        self.longestChar = encoding["longestChar"]
+        self.trie = encoding["trie"]
+        if isinstance(lineBreakers, str):
+            lineBreakers = de.parseLineBreakers(lineBreakers)
+        self.lineBreakers = set(lineBreakers)
+        self.breakers = de.compileBreakers(self.lineBreakers)
+        self.lineCaches = {False: {}, True: {}}
+
+    def decodeBytes(self, data):
+        """
+        Decodes raw bytes, unmapped bytes come out as ~XX~.
+
+        Parameters:
+            data (bytes): The encoded text.
+
+        Returns:
+            str: The decoded text.
+        """
+        return codecs.charmap_decode(data, 'strict', self.lookupTable)[0]
+
+    def encodeLine(self, line, optimal=False):
+        """
+        Encodes one script line, ~XX~ sequences included.
+
+        Parameters:
+            line (str): The script line.
+            optimal (bool): Use the shortest encoding instead of the greedy one.
+
+        Returns:
+            bytes: The encoded line.
+        """
+        encodePart = en.encodeOptimal if optimal else en.encodeGreedy
+        return en.encodeScriptLine(line, self.trie, self.longestChar, encodePart)[0]
+
+    def lineCache(self, optimal=False):
+        """
+        Returns the encoded lines kept between calls for an encoding mode.
+
+        Parameters:
+            optimal (bool): The encoding mode.
+
+        Returns:
+            dict: encoder.encodeScriptLine results by line.
+        """
+        lineCache = self.lineCaches[bool(optimal)]
+        if len(lineCache) > lineCacheSize:
+            lineCache.clear()
+        return lineCache
+
+class Rom:
+    """
+    ROM file opened once. Reads are views of a single read-only mapping; writes are
+    kept in memory, seen by the next reads, and written to the file together by flush.
+    Used in a with statement, pending writes are flushed when the block ends without error.
+
+    Attributes:
+        romFile (str): The path to the ROM file.
+        data (mmap or bytearray): The ROM data, with the pending writes applied.
+        pending (list): Tuples (offset, size) not written to the file yet.
+    """
+
+    def __init__(self, romFile):
+        """
+        Parameters:
+            romFile (str): The path to the ROM file.
+        """
+        self.romFile = romFile
+        self.data = de.mapRom(romFile)
+        self.pending = []
+
+    def view(self, startAddress, size):
+        """
+        Returns a zero-copy view of a part of the ROM.
+
+        Parameters:
+            startAddress (int): Offset of the first byte.
+            size (int): Number of bytes.
+
+        Returns:
+            memoryview: The bytes, shorter if the ROM ends before.
+        """
+        return de.readRom(self.data, startAddress, size)
+
+    def write(self, offset, data):
+        """
+        Patches the ROM data in memory and keeps the write for flush.
+        The mapping is copied once, on the first write; bytes that don't change are skipped.
+
+        Parameters:
+            offset (int): Offset of the first byte.
+            data (bytes): The bytes to write.
+        """
+        if self.data[offset:offset + len(data)] == data:
+            return
+        if not isinstance(self.data, bytearray):
+            mapping = self.data
+            self.data = bytearray(mapping)
+            try:
+                mapping.close()
+            except BufferError:
+                # A view of the mapping is still in use, it is released with it
+                pass
+        self.data[offset:offset + len(data)] = data
+        self.pending.append((offset, len(data)))
+
+    def flush(self, atomic=False):
+        """
+        Writes the pending writes to the file, overlapping and adjacent ones merged.
+        An atomic flush replaces the whole file instead, so a reader (like an emulator)
+        never sees half of the writes; if the file can't be replaced, it is patched in place.
+
+        Parameters:
+            atomic (bool): Replace the file instead of patching it.
+
+        Returns:
+            int: The number of bytes written.
+        """
+        if not self.pending:
+            return 0
+        spans = []
+        for offset, size in sorted(self.pending):
+            if spans and offset <= spans[-1][1]:
+                spans[-1][1] = max(spans[-1][1], offset + size)
+            else:
+                spans.append([offset, offset + size])
+        replaced = False
+        if atomic:
+            try:
+                en.writeROMAtomic(self.romFile, self.data)
+                replaced = True
+            except PermissionError:
+                # The file is locked by another program, patch it in place
+                pass
+        if not replaced:
+            en.writeROMRanges(self.romFile, [(start, bytes(self.data[start:end])) for start, end in spans])
+        self.pending = []
+        return sum(end - start for start, end in spans)
+
+    def close(self):
+        """
+        Releases the ROM data, pending writes are dropped.
+        """
+        if not isinstance(self.data, bytearray):
+            try:
+                self.data.close()
+            except BufferError:
+                pass
+        self.data = None
+        self.pending = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        if excType is None:
+            self.flush()
+        self.close()
+
+def decodeBlock(rom, table, block):
+    """
+    Decodes the lines of a block.
+
+    Parameters:
+        rom (Rom): The ROM.
+        table (Table): The compiled table.
+        block (dict): The block settings, addresses as integers or hex strings.
+
+    Returns:
+        list: Tuples (address, text, length in bytes) of every line.
+    """
+    return list(ba.iterBlockTexts(rom.data, block, table.lineBreakers, table.decodeTable, table.lookupTable, table.breakers))
+
+def encodeBlock(rom, table, block, textScript, lineBreakers=None):
+    """
+    Encodes lines into a block of the ROM, as pending writes. Lines that don't fit are
+    not spilled to free regions.
+
+    Parameters:
+        rom (Rom): The ROM.
+        table (Table): The compiled table.
+        block (dict): The block settings, addresses as integers or hex strings.
+        textScript (iterable): The lines, like in a script file.
+        lineBreakers (set): The line breakers of the script, the ones of the table if not given.
+
+    Returns:
+        tuple: Containing:
+            - freeBytes (int): Free space left in the text block.
+            - pointersCount (int): Number of pointers written.
+
+    Raises:
+        OverflowError: With the number of bytes over the text size (compressed size for a codec block).
+    """
+    lineCache = table.lineCache(block.get("optimal", False))
+    if lineBreakers is None:
+        lineBreakers = table.lineBreakers
+    encodedText, pointersList, layout = ba.encodeLines(block, textScript, lineBreakers, table.encodeTable, table.longestChar, table.trie, lineCache)
+    storedText = ba.packText(block, encodedText)
+    textSize = ba.parseHexValue(block["textSize"])
+    if len(storedText) > textSize:
+        raise OverflowError(len(storedText) - textSize)
+    for offset, data in ba.textWrites(block, storedText, pointersList):
+        rom.write(offset, data)
+    return textSize - len(storedText), len(pointersList)
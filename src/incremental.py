@@ -0,0 +1,244 @@
+import hashlib
+import json
+import decoder as de
+import encoder as en
+import batch as ba
+import scriptcache as sc
+import stats as st
+
+# Bump when the cache layout changes, old caches are then ignored
+cacheVersion = 1
+
+def cacheFileName(scriptFile):
+    """
+    Returns the sidecar cache path of a script file.
+
+    Parameters:
+        scriptFile (str): The path to the script file.
+
+    Returns:
+        str: The path to the cache file.
+    """
+    return scriptFile + ".cache"
+
+def fileHash(file):
+    """
+    Hashes the content of a file.
+
+    Parameters:
+        file (str): The path to the file.
+
+    Returns:
+        str: The hexadecimal SHA-1 digest.
+    """
+    with open(file, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+def lineHash(line):
+    """
+    Hashes a script line.
+
+    Parameters:
+        line (str): The script line.
+
+    Returns:
+        str: The hexadecimal digest.
+    """
+    return hashlib.sha1(line.encode("UTF-8")).hexdigest()[:20]
+
+def loadCache(cacheFile):
+    """
+    Reads a sidecar cache, an unreadable or outdated cache counts as empty.
+
+    Parameters:
+        cacheFile (str): The path to the cache file.
+
+    Returns:
+        dict: The cache content.
+    """
+    try:
+        with open(cacheFile, "r", encoding="UTF-8") as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if cache.get("version") != cacheVersion:
+        return {}
+    return cache
+
+def saveCache(cacheFile, encodingKey, layoutKey, textScript, lineCache, layout):
+    """
+    Writes the sidecar cache with the encoded bytes of every script line and the placement of the written lines.
+
+    Parameters:
+        cacheFile (str): The path to the cache file.
+        encodingKey (str): Identifies the table and encoding options used.
+        layoutKey (str): Identifies the ROM addresses and sizes used.
+        textScript (list): The script lines.
+        lineCache (dict): encodeScriptLine results by line.
+        layout (list): Tuples (offset, length) of every written line.
+    """
+    lines = {}
+    for line in textScript:
+        finalLine, repeatLine, lastPart = lineCache[line]
+        lines[lineHash(line)] = [finalLine.hex(), repeatLine, None if lastPart is None else lastPart.hex()]
+    cache = {
+        "version": cacheVersion,
+        "encodingKey": encodingKey,
+        "layoutKey": layoutKey,
+        "lines": lines,
+        "layout": layout,
+    }
+    with open(cacheFile, "w", encoding="UTF-8") as f:
+        json.dump(cache, f)
+
+def placeInPlace(oldLayout, newLayout, textSize, lineBreakers):
+    """
+    Keeps every written line at its previous offset when each one still fits in its old slot
+    (the room up to the next line, or to the end of the block for the last one). A line
+    without a line breaker goes on into the next one, so it must fill its slot exactly:
+    a gap after it would leave old bytes inside the string.
+
+    Parameters:
+        oldLayout (list): Tuples (offset, length) of the lines of the previous run.
+        newLayout (list): Tuples (offset, encoded line) of the sequential layout.
+        textSize (int): Text block size.
+        lineBreakers (set): A set of byte values used as line breakers.
+
+    Returns:
+        list: The offset of each new line, or None if the lines can't stay in place.
+    """
+    if not oldLayout or len(oldLayout) != len(newLayout):
+        return None
+    offsets = [offset for offset, length in oldLayout]
+    if offsets != sorted(offsets):
+        return None
+    slots = [nextOffset - offset for offset, nextOffset in zip(offsets, offsets[1:] + [textSize])]
+    for (offset, finalLine), slot in zip(newLayout, slots):
+        if len(finalLine) > slot:
+            return None
+        if len(finalLine) < slot and finalLine[-1] not in lineBreakers:
+            return None
+    return offsets
+
+def dirtyRanges(oldData, newData, startOffset, gap=8):
+    """
+    Finds the byte ranges that differ between two versions of a ROM region.
+    Ranges closer than gap bytes are merged to save seeks.
+
+    Parameters:
+        oldData (bytes): The region before patching.
+        newData (bytes): The region after patching, same length.
+        startOffset (int): ROM offset of the region.
+        gap (int): Largest run of equal bytes kept inside a range.
+
+    Returns:
+        list: Tuples (offset, data) to write.
+    """
+    ranges = []
+    if oldData == newData:
+        return ranges
+    start = None
+    lastDiff = None
+    for i, (old, new) in enumerate(zip(oldData, newData)):
+        if old == new:
+            continue
+        if start is None:
+            start = i
+        elif i - lastDiff > gap:
+            ranges.append((startOffset + start, bytes(newData[start:lastDiff + 1])))
+            start = i
+        lastDiff = i
+    ranges.append((startOffset + start, bytes(newData[start:lastDiff + 1])))
+    return ranges
+
+def encodeBlock(romData, block, charTable, longestChar, tableKey, lineCache=None, addresses=None, script=None):
+    """
+    Encodes one block reusing the sidecar cache of its script: only edited lines are
+    encoded again, lines stay at their previous offset when they all still fit, and
+    only the bytes that changed are returned for writing. The ROM data is not modified.
+
+    Parameters:
+        romData (bytes): The ROM data.
+        block (dict): The block settings, like in a manifest.
+        charTable (dict): Dictionary that maps character sequences to byte values.
+        longestChar (int): Maximum length of sequences to consider while encoding.
+        tableKey (str): Hash of the .tbl file content.
+        lineCache (dict): Optional dict receiving the encodeScriptLine result of every line.
+        addresses (list): Optional list receiving the ROM address every pointer is made for.
+        script (dict): Optional dict receiving the lines and the lineBreakers of the script,
+            for verify.checkBlock.
+
+    Returns:
+        tuple: Containing:
+            - freeBytes (int): Free space left in the text block.
+            - pointersCount (int): Number of pointers written.
+            - ranges (list): Tuples (offset, data) of the bytes that changed, to stage.
+            - inPlace (bool): True if the lines kept their previous offsets.
+
+    Raises:
+        OverflowError: If the encoded text exceeds the block text size.
+    """
+    pointersFormat = ba.pointersFormats[block.get("pointersFormat", "-2b")][1]
+    textStartAddress = ba.parseHexValue(block["textStartAddress"])
+    textSize = ba.parseHexValue(block["textSize"])
+    pointersStartAddress = ba.parseHexValue(block["pointersStartAddress"])
+    headerSize = ba.parseHexValue(block["headerSize"])
+    optimal = block.get("optimal", False)
+    shareLines = block.get("shareLines")
+
+    encodingKey = f"{tableKey}:{optimal}"
+    layoutKey = f"{block.get('pointersFormat', '-2b')}:{textStartAddress}:{textSize}:{pointersStartAddress}:{headerSize}:{shareLines}"
+    cacheFile = cacheFileName(block["file"])
+    cache = loadCache(cacheFile)
+
+    openedScript, _, _, _, lineBreaker = sc.openScript(block["file"])
+    try:
+        textScript = list(openedScript)
+    finally:
+        openedScript.close()
+    lineBreakers = de.parseLineBreakers(lineBreaker)
+    if script is not None:
+        script.update(lines=textScript, lineBreakers=lineBreakers)
+
+    # Reuse the encoding of unchanged lines
+    if lineCache is None:
+        lineCache = {}
+    if cache.get("encodingKey") == encodingKey:
+        cachedLines = cache["lines"]
+        for line in textScript:
+            entry = cachedLines.get(lineHash(line))
+            if entry is not None:
+                finalLine, repeatLine, lastPart = entry
+                lineCache[line] = (bytes.fromhex(finalLine), repeatLine, None if lastPart is None else bytes.fromhex(lastPart))
+
+    newLayout = []
+    encodedText, pointersList = en.encodeText(textScript, lineBreakers, charTable, longestChar, optimal, shareLines, lineCache, newLayout)
+
+    # Keep the lines where they were if the layout allows it
+    places = None
+    if cache.get("layoutKey") == layoutKey and cache.get("encodingKey") == encodingKey:
+        places = placeInPlace(cache.get("layout"), newLayout, textSize, lineBreakers)
+    if places is not None:
+        pointersList = en.relocatePointers(pointersList, newLayout, places)
+        placedLines = [(place, finalLine) for place, (offset, finalLine) in zip(places, newLayout)]
+    else:
+        if len(encodedText) > textSize:
+            raise OverflowError(len(encodedText) - textSize)
+        placedLines = newLayout
+    usedBytes = max((place + len(finalLine) for place, finalLine in placedLines), default=0)
+    if addresses is not None:
+        addresses.extend(textStartAddress + pointer for pointer in pointersList)
+    with st.stage("pointerBuild"):
+        encodedPointers = pointersFormat(pointersList, textStartAddress, headerSize)
+
+    # Patch a copy of the text and keep the bytes that changed
+    oldText = bytes(romData[textStartAddress:textStartAddress + usedBytes])
+    newText = bytearray(oldText)
+    for place, finalLine in placedLines:
+        newText[place:place + len(finalLine)] = finalLine
+    ranges = dirtyRanges(oldText, newText, textStartAddress)
+    oldPointers = bytes(romData[pointersStartAddress:pointersStartAddress + len(encodedPointers)])
+    ranges += dirtyRanges(oldPointers, encodedPointers, pointersStartAddress)
+
+    saveCache(cacheFile, encodingKey, layoutKey, textScript, lineCache, [(place, len(finalLine)) for place, finalLine in placedLines])
+    return textSize - usedBytes, len(pointersList), ranges, places is not None
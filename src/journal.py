@@ -0,0 +1,230 @@
+import os
+import zlib
+import encoder as en
+import stats as st
+
+# Size of the pieces compared at once when looking for changed bytes
+diffChunkSize = 0x1000
+
+class WriteJournal:
+    """
+    Stages every patch of a build in memory and writes the ROM once at the end: the
+    patched data goes to a temporary copy that replaces the ROM, so a build that fails
+    at any point leaves the ROM untouched. Incremental builds write only the changed
+    runs into the ROM file instead.
+
+    Attributes:
+        romFile (str): The path to the ROM file.
+        baseData (bytes): The ROM data when the journal was opened.
+        romData (bytearray): The patched ROM data, only patched through stage.
+        staged (list): Tuples (offset, data, label) of every staged patch.
+    """
+
+    def __init__(self, romFile):
+        """
+        Parameters:
+            romFile (str): The path to the ROM file.
+        """
+        self.romFile = romFile
+        with st.stage("romRead"), open(romFile, "rb") as f:
+            self.baseData = f.read()
+        self.romData = bytearray(self.baseData)
+        self.staged = []
+
+    def stage(self, offset, data, label=None):
+        """
+        Stages a patch. Patches can't grow the ROM, and two patches can only overlap
+        if they write the same bytes.
+
+        Parameters:
+            offset (int): Offset of the first byte.
+            data (bytes): The bytes to write.
+            label (str): What the patch is, for error messages.
+
+        Raises:
+            IndexError: If the patch ends past the end of the ROM.
+            ValueError: With the offset and labels of the two patches that overlap.
+        """
+        end = offset + len(data)
+        if offset < 0 or end > len(self.romData):
+            raise IndexError(offset)
+        for otherOffset, otherData, otherLabel in self.staged:
+            start = max(offset, otherOffset)
+            stop = min(end, otherOffset + len(otherData))
+            if start < stop and data[start - offset:stop - offset] != otherData[start - otherOffset:stop - otherOffset]:
+                raise ValueError(start, otherLabel, label)
+        self.staged.append((offset, bytes(data), label))
+        self.romData[offset:end] = data
+
+    def changes(self):
+        """
+        Finds the bytes that differ from the ROM data when the journal was opened.
+
+        Returns:
+            list: Tuples (offset, data) of every changed run.
+        """
+        return diffRanges(self.baseData, self.romData)
+
+    def commit(self, patchFile=None, inPlace=False):
+        """
+        Writes the patched ROM in one pass: temporary copy, fsync, rename over the ROM.
+        In place, only the changed runs are written into the ROM file, which is faster
+        for a few edits but not atomic. Nothing is written if no byte changed.
+
+        Parameters:
+            patchFile (str): Optional .ips or .bps patch to write with the changes.
+            inPlace (bool): Write the changed runs into the ROM file instead of replacing it.
+
+        Returns:
+            list: Tuples (offset, data) of every changed run.
+        """
+        with st.stage("romWrite"):
+            ranges = self.changes()
+            if patchFile:
+                writePatch(patchFile, self.baseData, self.romData, ranges)
+            if ranges and inPlace:
+                en.writeROMRanges(self.romFile, ranges)
+            elif ranges:
+                en.writeROMAtomic(self.romFile, self.romData)
+        self.baseData = bytes(self.romData)
+        self.staged = []
+        return ranges
+
+def diffRanges(baseData, newData):
+    """
+    Finds the runs of bytes that differ between two versions of the ROM, the same size.
+    Equal chunks are skipped with one comparison each.
+
+    Parameters:
+        baseData (bytes): The original data.
+        newData (bytes): The patched data.
+
+    Returns:
+        list: Tuples (offset, data) of every changed run, data taken from newData.
+    """
+    ranges = []
+    start = None
+    baseView = memoryview(baseData)
+    newView = memoryview(newData)
+    for chunk in range(0, len(newView), diffChunkSize):
+        chunkEnd = min(chunk + diffChunkSize, len(newView))
+        if baseView[chunk:chunkEnd] == newView[chunk:chunkEnd]:
+            if start is not None:
+                ranges.append((start, bytes(newView[start:chunk])))
+                start = None
+            continue
+        for i in range(chunk, chunkEnd):
+            if baseView[i] != newView[i]:
+                if start is None:
+                    start = i
+            elif start is not None:
+                ranges.append((start, bytes(newView[start:i])))
+                start = None
+    if start is not None:
+        ranges.append((start, bytes(newView[start:])))
+    return ranges
+
+def makeIps(newData, ranges):
+    """
+    Builds an IPS patch: "PATCH", records of a 3 byte offset, a 2 byte size and the data
+    (long runs of one byte value as RLE records), then "EOF".
+
+    Parameters:
+        newData (bytes): The patched data.
+        ranges (list): Tuples (offset, data) of every changed run.
+
+    Returns:
+        bytes: The patch.
+
+    Raises:
+        OverflowError: If a change is past the 16 MB IPS offsets can reach.
+    """
+    patch = bytearray(b"PATCH")
+    for offset, data in ranges:
+        for piece in range(0, len(data), 0xFFFE):
+            pieceOffset = offset + piece
+            size = min(0xFFFE, len(data) - piece)
+            # An offset spelling "EOF" would end the patch early, start one byte before
+            if pieceOffset == 0x454F46:
+                pieceOffset -= 1
+                size += 1
+            if pieceOffset + size > 0x1000000:
+                raise OverflowError(pieceOffset)
+            part = bytes(newData[pieceOffset:pieceOffset + size])
+            patch += pieceOffset.to_bytes(3, "big")
+            if size > 8 and part.count(part[:1]) == size:
+                patch += bytes(2) + size.to_bytes(2, "big") + part[:1]
+            else:
+                patch += size.to_bytes(2, "big") + part
+    patch += b"EOF"
+    return bytes(patch)
+
+def bpsNumber(number):
+    """
+    Encodes a number in the variable length format of BPS patches.
+
+    Parameters:
+        number (int): The number.
+
+    Returns:
+        bytes: The encoded number.
+    """
+    out = bytearray()
+    while True:
+        low = number & 0x7F
+        number >>= 7
+        if number == 0:
+            out.append(0x80 | low)
+            return bytes(out)
+        out.append(low)
+        number -= 1
+
+def makeBps(baseData, newData, ranges):
+    """
+    Builds a BPS patch: unchanged runs are copied from the source (SourceRead),
+    changed runs are stored in the patch (TargetRead). Checksums are CRC32.
+
+    Parameters:
+        baseData (bytes): The original data.
+        newData (bytes): The patched data.
+        ranges (list): Tuples (offset, data) of every changed run.
+
+    Returns:
+        bytes: The patch.
+    """
+    patch = bytearray(b"BPS1")
+    patch += bpsNumber(len(baseData)) + bpsNumber(len(newData)) + bpsNumber(0)
+    position = 0
+    for offset, data in ranges + [(len(newData), b"")]:
+        if offset > position:
+            patch += bpsNumber((offset - position - 1) << 2 | 0)
+        if data:
+            patch += bpsNumber((len(data) - 1) << 2 | 1) + data
+        position = offset + len(data)
+    patch += zlib.crc32(baseData).to_bytes(4, "little") + zlib.crc32(newData).to_bytes(4, "little")
+    patch += zlib.crc32(patch).to_bytes(4, "little")
+    return bytes(patch)
+
+def writePatch(patchFile, baseData, newData, ranges):
+    """
+    Writes an IPS or BPS patch of the changes, by the extension of the patch file.
+
+    Parameters:
+        patchFile (str): The path of the patch, .ips or .bps.
+        baseData (bytes): The original data.
+        newData (bytes): The patched data.
+        ranges (list): Tuples (offset, data) of every changed run.
+
+    Raises:
+        ValueError: If the extension is not .ips or .bps.
+        OverflowError: If an IPS patch can't reach a change.
+    """
+    extension = os.path.splitext(patchFile)[1].lower()
+    if extension == ".ips":
+        patch = makeIps(newData, ranges)
+    elif extension == ".bps":
+        patch = makeBps(baseData, newData, ranges)
+    else:
+        raise ValueError(extension)
+    with open(patchFile, "wb") as f:
+        f.write(patch)
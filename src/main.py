@@ -4,220 +4,1361 @@
 
 import sys
 import os
-import decoder as de
-import encoder as en
+
+# Modules are imported by the functions using them, so a command only loads what it runs
 
 def showHelp():
-    sys.stdout.write("Usage: -d <pointersFormat> <romFile> <PointersStartAddress> <PointerTableSize> <HeaderSize> <LineBreaker> <outFile> <tblFile>\n")
-    sys.stdout.write("       -e <pointersFormat> <TextFile> <TextStartAddress> <TextSize> <PointersStartAddress> <HeaderSize> <romFile> <tblFile>\n")
+    sys.stdout.write("Usage: -d <pointersFormat> <romFile> <PointersStartAddress> <PointerTableSize> <HeaderSize> <LineBreaker> <outFile> <tblFile> [--index] [--codec <stages> --text <start:size>] [--stats <file.json|->]\n")
+    sys.stdout.write("       -e <pointersFormat> <TextFile> <TextStartAddress> <TextSize> <PointersStartAddress> <HeaderSize> <romFile> <tblFile> [--optimal] [--dedupe|--merge-tails] [--incremental] [--free <regions|auto>] [--bank-size N] [--codec <stages>] [--patch <file.ips|file.bps>] [--stats <file.json|->] [--verify [--decoder-tbl <tblFile>]]\n")
+    sys.stdout.write("       -md <manifestFile> [--jobs N] [--index] [--codec <stages>] [--stats <file.json|->] decode every block listed in the manifest.\n")
+    sys.stdout.write("       -me <manifestFile> [--jobs N] [--optimal] [--dedupe|--merge-tails] [--incremental] [--free <regions|auto>] [--bank-size N] [--codec <stages>] [--patch <file.ips|file.bps>] [--stats <file.json|->] [--verify [--decoder-tbl <tblFile>]] encode every block listed in the manifest.\n")
+    sys.stdout.write("       -w <manifestFile> [--interval S] [--optimal] [--dedupe|--merge-tails] [--codec <stages>] encode every block again each time its script is saved.\n")
+    sys.stdout.write("       -g <manifestFile> <outTblFile> [--max-length N] [--max-entries N] [--optimal] generate DTE/MTE entries.\n")
+    sys.stdout.write("       -s <romFile> <tblFile> <LineBreaker> [--formats -2b,-3b] [--headers H1,H2] [--bank-size N] [--cpu-base A1,A2] [--min-pointers N] [--max-length N] [--top N] [--jobs N] find pointer tables.\n")
+    sys.stdout.write("       -t <romFile> <tblFile> <LineBreaker> <outFile> [--start A] [--end B] [--min-length N] [--min-score F] extract strings without pointers.\n")
+    sys.stdout.write("       -r run the commands read from the standard input, one JSON array of arguments per line.\n")
     sys.stdout.write("       -h show help.\n")
     sys.stdout.write("       -v show version.\n")
 
-def main():
-    if len(sys.argv) == 1 or len(sys.argv) == 9:
-        showHelp()
-        sys.exit(1)
-    # Decoding arguments
-    if sys.argv[1] == '-d':
-        # Pointers Format
-        if sys.argv[2] == '-2b':
-            pointersFormat = de.processPointers2Bytes
-        elif sys.argv[2] == '-2bs':
-            pointersFormat = de.processPointers2BytesSeparated
-        elif sys.argv[2] == '-2bb':
-            pointersFormat = de.processPointers2BytesBigEndian
-        elif sys.argv[2] == '-3b':
-            pointersFormat = de.processPointers3Bytes
-        elif sys.argv[2] == '-4b':
-            pointersFormat = de.processPointers4Bytes
+# Optional flags accepted after the positional arguments, True when the flag takes a value
+encodeOptions = {'--optimal': False, '--dedupe': False, '--merge-tails': False, '--incremental': False, '--free': True, '--bank-size': True, '--codec': True, '--patch': True, '--stats': True, '--verify': False, '--decoder-tbl': True}
+decodeOptions = {'--index': False, '--codec': True, '--text': True, '--stats': True}
+manifestDecodeOptions = {'--index': False, '--codec': True, '--jobs': True, '--stats': True}
+manifestEncodeOptions = dict(encodeOptions, **{'--jobs': True})
+scanOptions = {'--formats': True, '--headers': True, '--bank-size': True, '--cpu-base': True, '--min-pointers': True, '--max-length': True, '--top': True, '--jobs': True}
+watchOptions = {'--optimal': False, '--dedupe': False, '--merge-tails': False, '--codec': True, '--interval': True}
+textScanOptions = {'--start': True, '--end': True, '--min-length': True, '--min-score': True}
+dictionaryOptions = {'--optimal': False, '--max-length': True, '--max-entries': True}
+
+def parseOptions(args, allowed):
+    """
+    Reads the optional flags given after the positional arguments.
+
+    Parameters:
+        args (list): The remaining command line arguments.
+        allowed (dict): The flags accepted by the current mode, True for those taking a value.
+
+    Returns:
+        dict: The flags found, with their value or True.
+    """
+    options = {}
+    args = iter(args)
+    for arg in args:
+        if arg not in allowed:
+            print(f"Error: Unknown option {arg}.")
+            sys.exit(1)
+        if allowed[arg]:
+            value = next(args, None)
+            if value is None:
+                print(f"Error: Option {arg} needs a value.")
+                sys.exit(1)
+            options[arg] = value
         else:
-            sys.stdout.write("Error: Pointers format argument not found.")
-            sys.exit(1) 
+            options[arg] = True
+    return options
 
-        # Other Arguments
-        romFile = sys.argv[3]                                       # ROM file path
-        try:
-            pointersStartAddress = int(sys.argv[4], 16)             # Start offset of pointer table
-        except ValueError:
-            print("Error: Incorrect hex value.")
+def shareLinesMode(options):
+    """
+    Reads the line sharing mode from the optional flags.
+
+    Parameters:
+        options (dict): Optional flags given on the command line.
+
+    Returns:
+        str: None, 'lines' or 'tails'.
+    """
+    if '--merge-tails' in options:
+        return 'tails'
+    if '--dedupe' in options:
+        return 'lines'
+    return None
+
+def jobsCount(options):
+    """
+    Reads the number of worker processes from the optional flags.
+
+    Parameters:
+        options (dict): Optional flags given on the command line.
+
+    Returns:
+        int: The number of processes, 1 to work serially. 0 on the command line uses every CPU.
+    """
+    try:
+        jobs = int(options.get('--jobs', 1))
+    except ValueError:
+        print("Error: --jobs needs a number.")
+        sys.exit(1)
+    if jobs <= 0:
+        jobs = os.cpu_count() or 1
+    return jobs
+
+def startStats(options):
+    """
+    Starts collecting the time of each stage and the counters when --stats is given.
+
+    Parameters:
+        options (dict): Optional flags given on the command line.
+    """
+    import stats as st
+    if '--stats' not in options:
+        return
+    if jobsCount(options) > 1:
+        print("Error: --stats can't be used with --jobs.")
+        sys.exit(1)
+    st.enable()
+
+def writeStats(options):
+    """
+    Writes the collected stats as JSON, to the --stats file or to the standard output for -.
+
+    Parameters:
+        options (dict): Optional flags given on the command line.
+    """
+    import json
+    import stats as st
+    if st.collector is None:
+        return
+    if options['--stats'] == '-':
+        print(json.dumps(st.collector.report(), indent=2))
+        return
+    try:
+        st.collector.write(options['--stats'])
+    except OSError:
+        print(f"Error: Can't write {options['--stats']}.")
+        sys.exit(1)
+    print(f"Stats written to {options['--stats']}")
+
+def verifyTable(options, tblFile):
+    """
+    Loads the decoder table used by --verify, the one given with --decoder-tbl if any.
+
+    Parameters:
+        options (dict): Optional flags given on the command line.
+        tblFile (str): The path to the default decoder .tbl file.
+
+    Returns:
+        tuple: The 256 decoded fragments of the table, or None without --verify.
+    """
+    import tablecache as tc
+    if '--verify' not in options:
+        return None
+    tblFile = options.get('--decoder-tbl', tblFile)
+    try:
+        return tc.loadTable(tblFile)["lookupTable"]
+    except FileNotFoundError:
+        print(f"Error: File {tblFile} not found in directory.")
+        sys.exit(1)
+    except UnicodeDecodeError:
+        print(f"Error: File {tblFile} is not in UTF-8.")
+        sys.exit(1)
+
+def reportProblems(scriptFile, problems):
+    """
+    Prints what --verify found wrong in a block.
+
+    Parameters:
+        scriptFile (str): The script of the block.
+        problems (list): The messages of verify.checkBlock.
+    """
+    import verify as vf
+    for problem in problems[:vf.maxReported]:
+        print(f"Error: {scriptFile}: {problem}")
+    if len(problems) > vf.maxReported:
+        print(f"Error: {scriptFile}: {len(problems) - vf.maxReported} more problems.")
+
+def codecOption(options):
+    """
+    Reads the codec stages from the optional flags, exiting if a stage is not supported.
+
+    Parameters:
+        options (dict): Optional flags given on the command line.
+
+    Returns:
+        str: The codec, or None for raw text.
+    """
+    import compression as cp
+    if '--codec' not in options:
+        return None
+    try:
+        cp.parseCodec(options['--codec'])
+    except KeyError as e:
+        print(f"Error: Codec stage {e} not supported, use {', '.join(cp.codecStages)}.")
+        sys.exit(1)
+    return options['--codec']
+
+def loadManifest(manifestFile):
+    """
+    Reads a manifest file, exiting with an error message if it is not valid.
+
+    Parameters:
+        manifestFile (str): The path to the manifest file.
+
+    Returns:
+        tuple: The manifest settings and the list of blocks.
+    """
+    import batch as ba
+    try:
+        return ba.readManifest(manifestFile)
+    except FileNotFoundError:
+        print(f"Error: File {manifestFile} not found in directory.")
+        sys.exit(1)
+    except ValueError:
+        print(f"Error: File {manifestFile} is not a valid JSON manifest.")
+        sys.exit(1)
+    except KeyError as e:
+        print(f"Error: Manifest value {e} not found or not supported.")
+        sys.exit(1)
+
+def decodeManifest(manifestFile, options):
+    """
+    Decodes every block of a manifest reading the ROM and the table only once.
+    With --jobs, blocks are decoded by a pool of processes sharing the ROM mapping.
+
+    Parameters:
+        manifestFile (str): The path to the manifest file.
+        options (dict): Optional flags given on the command line.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    import decoder as de
+    import batch as ba
+    import tablecache as tc
+    import stats as st
+    manifest, blocks = loadManifest(manifestFile)
+    romFile = manifest["rom"]
+    tblFile = manifest["decoderTbl"]
+    jobs = jobsCount(options)
+    codec = codecOption(options)
+    for block in blocks:
+        if '--index' in options:
+            block["index"] = True
+        if codec:
+            block["codec"] = codec
+
+    # Map the ROM once for every block
+    try:
+        romData = de.mapRom(romFile)
+    except FileNotFoundError:
+        print(f"Error: File {romFile} not found in directory.")
+        sys.exit(1)
+    except ValueError:
+        print(f"Error: File {romFile} is empty.")
+        sys.exit(1)
+
+    # Load the character table once for every block
+    try:
+        charTable = tc.readTbl(tblFile)
+    except FileNotFoundError:
+        print(f"Error: File {tblFile} not found in directory.")
+        sys.exit(1)
+    except UnicodeDecodeError:
+        print(f"Error: File {tblFile} is not in UTF-8.")
+        sys.exit(1)
+
+    if jobs > 1:
+        # Two blocks writing the same script would race
+        files = [block["file"] for block in blocks]
+        if len(set(files)) != len(files):
+            print("Error: Several blocks use the same file, --jobs needs one file per block.")
             sys.exit(1)
+        pool = ProcessPoolExecutor(jobs, initializer=ba.initWorker, initargs=(romFile, charTable))
+        results = pool.map(ba.decodeWorker, blocks)
+    else:
+        pool = None
+        results = (ba.decodeBlock(romData, block, charTable) for block in blocks)
+
+    # Results come back in block order, like serial mode
+    for block in blocks:
+        st.block(block.get("file"))
         try:
-            pointerTableSize = int(sys.argv[5], 16)                 # Pointer table size
-        except ValueError:
-            print("Error: Incorrect hex value.")
+            totalBytesRead = next(results)
+        except (KeyError, ValueError):
+            print(f"Error: Incorrect or missing value in block {block.get('file')}.")
             sys.exit(1)
-        try:
-            headerSize = int(sys.argv[6], 16)                       # Header size
-        except ValueError:
-            print("Error: Incorrect hex value.")
+        except IndexError:
+            print(f"Error: Start address is bigger than the ROM size.")
             sys.exit(1)
-        lineBreaker = sys.argv[7]                                   # Line breaker input (comma-separated)
-        outFile = sys.argv[8]                                       # Output file for the extracted text
-        tblFile = sys.argv[9]                                       # Tbl file argument
+        print(f"TEXT BLOCK SIZE: {totalBytesRead} / {hex(totalBytesRead)} bytes.")
+        print(f"Text extracted to {block['file']}")
+    st.block(None)
+    if pool:
+        pool.shutdown()
+    print("Decoding complete.\n")
 
-        # Read ROM pointers table
-        try:
-            tablePointers = de.readRom(romFile, pointersStartAddress, pointerTableSize)
-        except FileNotFoundError:
-            print(f"Error: File {romFile} not found in directory.")
+def applyEncodeOptions(blocks, options):
+    """
+    Sets the encoding flags of the command line on every manifest block.
+
+    Parameters:
+        blocks (list): The block settings, modified in place.
+        options (dict): Optional flags given on the command line.
+    """
+    for block in blocks:
+        if '--optimal' in options:
+            block["optimal"] = True
+        if shareLinesMode(options):
+            block["shareLines"] = shareLinesMode(options)
+        if '--bank-size' in options:
+            block["bankSize"] = options['--bank-size']
+        if codecOption(options):
+            block["codec"] = codecOption(options)
+
+def encodeManifest(manifestFile, options):
+    """
+    Encodes every block of a manifest and writes the ROM only once.
+    If any block does not fit, nothing is written.
+
+    Parameters:
+        manifestFile (str): The path to the manifest file.
+        options (dict): Optional flags given on the command line.
+    """
+    manifest, blocks = loadManifest(manifestFile)
+    applyEncodeOptions(blocks, options)
+    regions = options.get('--free', manifest.get("freeRegions"))
+    jobs = jobsCount(options)
+    lookupTable = verifyTable(options, manifest["decoderTbl"])
+    if jobs > 1 and (regions is not None or '--incremental' in options):
+        print("Error: --jobs can't be used with free regions or --incremental.")
+        sys.exit(1)
+    if '--incremental' in options:
+        if regions is not None:
+            print("Error: --incremental can't be used with free regions.")
             sys.exit(1)
+        if any(block.get("codec") for block in blocks):
+            print("Error: --incremental can't be used with compressed blocks.")
+            sys.exit(1)
+        encodeIncremental(manifest["rom"], manifest["encoderTbl"], blocks, options.get('--patch'), lookupTable)
+        return
+    encodeBlocks(manifest["rom"], manifest["encoderTbl"], blocks, regions, jobs, options.get('--patch'), lookupTable)
 
-        # Parse line breakers.
+def openJournal(romFile):
+    """
+    Opens the write journal of a ROM.
+
+    Parameters:
+        romFile (str): The path to the ROM file.
+
+    Returns:
+        WriteJournal: The journal, with the ROM data read once.
+    """
+    import journal as jn
+    try:
+        return jn.WriteJournal(romFile)
+    except FileNotFoundError:
+        print(f"Error: File {romFile} not found in directory.")
+        sys.exit(1)
+
+def commitJournal(journal, patchFile=None, inPlace=False):
+    """
+    Writes the staged changes to the ROM, and the patch if one is given.
+
+    Parameters:
+        journal (WriteJournal): The journal of the ROM.
+        patchFile (str): Optional .ips or .bps patch to write.
+        inPlace (bool): Write only the changed runs into the ROM file instead of replacing it.
+
+    Returns:
+        list: Tuples (offset, data) of every changed run.
+    """
+    try:
+        ranges = journal.commit(patchFile, inPlace)
+    except ValueError:
+        print("Error: Patch file must be .ips or .bps.")
+        sys.exit(1)
+    except OverflowError as e:
+        print(f"Error: Offset {hex(e.args[0])} can't be reached by an IPS patch, use .bps.")
+        sys.exit(1)
+    if patchFile:
+        print(f"Patch written to {patchFile}")
+    return ranges
+
+def stageWrites(journal, writes, label):
+    """
+    Stages the writes of a block in the journal, exiting if they overlap with different
+    data already staged, by this block or by another one.
+
+    Parameters:
+        journal (WriteJournal): The journal of the ROM.
+        writes (list): Tuples (offset, data).
+        label (str): The script of the block, for error messages.
+    """
+    try:
+        for offset, data in writes:
+            journal.stage(offset, data, label)
+    except IndexError:
+        print(f"Error: {label} writes past the end of {journal.romFile}.")
+        sys.exit(1)
+    except ValueError as e:
+        offset, otherLabel, label = e.args
+        if otherLabel == label:
+            print(f"Error: The text and the pointer table of {label} overlap at offset {hex(offset)}.")
+        else:
+            print(f"Error: {otherLabel} and {label} write different data at offset {hex(offset)}.")
+        sys.exit(1)
+
+def encodeBlocks(romFile, tblFile, blocks, regions=None, jobs=1, patchFile=None, lookupTable=None):
+    """
+    Encodes blocks into the ROM data of a write journal and writes the ROM only once.
+    If any block does not fit, nothing is written. With several jobs, blocks are
+    encoded by a pool of processes and their writes merged in block order,
+    stopping if two blocks write different data to the same bytes.
+
+    Parameters:
+        romFile (str): The path to the ROM file.
+        tblFile (str): The path to the encoder .tbl file.
+        blocks (list): The block settings, like in a manifest.
+        regions (str or list): Free regions to spill overflowing lines to, "auto", or None.
+        jobs (int): Number of processes.
+        patchFile (str): Optional .ips or .bps patch to write with the changes.
+        lookupTable (tuple): Decoder table fragments to check every block with before
+            writing (--verify), or None.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    import batch as ba
+    import tablecache as tc
+    import stats as st
+    import verify as vf
+    # Read the complete ROM data once for every block
+    journal = openJournal(romFile)
+    romData = journal.romData
+
+    # Load the character table once for every block
+    try:
+        charTable, longestChar = tc.readTblFileInverted(tblFile)
+    except FileNotFoundError:
+        print(f"Error: File {tblFile} not found in directory.")
+        sys.exit(1)
+    except UnicodeDecodeError:
+        print(f"Error: File {tblFile} is not in UTF-8.")
+        sys.exit(1)
+
+    # Free regions are shared by every block
+    freeRegions = None
+    if regions is not None:
         try:
-            parseLineBreakers = de.parseLineBreakers(lineBreaker)
-        except ValueError:
-            print("Error: Incorrect hex value.")
+            freeRegions = ba.freeRegions(romData, blocks, regions)
+        except (KeyError, ValueError):
+            print("Error: Incorrect free regions, use start:size pairs in hex or auto.")
             sys.exit(1)
-        
-        # Process read pointers
-        lineStartAddress = pointersFormat(tablePointers, headerSize)
-        
-        # Read the complete ROM data to extract texts
-        romData = de.readRom(romFile, 0, os.path.getsize(romFile))
 
-        # Load the character table
+    if jobs > 1:
+        pool = ProcessPoolExecutor(jobs, initializer=ba.initWorker, initargs=(None, charTable, longestChar, bool(lookupTable)))
+        results = pool.map(ba.encodeWorker, blocks)
+    else:
+        pool = None
+        results = None
+    verifyFailed = False
+
+    for block in blocks:
+        scriptFile = block.get("file")
+        st.block(scriptFile)
         try:
-            charTable = de.readTbl(tblFile)
+            if pool:
+                writes, freeBytes, pointersCount, spilledBytes, textBytes, script, lineCache, addresses = next(results)
+            else:
+                addresses = []
+                lineCache = {} if lookupTable else None
+                script = {} if lookupTable else None
+                writes, freeBytes, pointersCount, spilledBytes, textBytes = ba.encodeBlock(block, charTable, longestChar, freeRegions, lineCache, addresses, script)
         except FileNotFoundError:
-            print(f"Error: File {tblFile} not found in directory.")
+            print(f"Error: File {scriptFile} not found in directory.")
             sys.exit(1)
-        except UnicodeDecodeError:
-            print(f"Error: File {tblFile} is not in UTF-8.")
-            
-        # Extract the texts
-        try:
-            texts, totalBytesRead, linesLenght = de.extractTexts(romData, lineStartAddress, parseLineBreakers, charTable)
-        except IndexError:
-            print(f"Error: Start address is bigger than the ROM size.")
+        except AttributeError:
+            print(f"Error: First line attributes not found in {scriptFile}.")
             sys.exit(1)
-            
-        # Writing the text to a file
-        de.writeOutFile(outFile, texts, pointersStartAddress, pointerTableSize, lineStartAddress, linesLenght, lineBreaker)
-        print(f"TEXT BLOCK SIZE: {totalBytesRead} / {hex(totalBytesRead)} bytes.")
-        print(f"Text extracted to {outFile}")
-        print("Decoding complete.\n")
-        sys.exit(1)
-    
-    elif sys.argv[1] == '-e':
-        # Pointers Format
-        if sys.argv[2] == '-2b':
-            pointersFormat = en.calculatePointer2Bytes
-        elif sys.argv[2] == '-2bs':
-            pointersFormat = en.calculatePointer2BytesSeparated
-        elif sys.argv[2] == '-2bb':
-            pointersFormat = en.calculatePointer2BytesBigEndian
-        elif sys.argv[2] == '-3b':
-            pointersFormat = en.calculatePointer3Bytes
-        elif sys.argv[2] == '-4b':
-            pointersFormat = en.calculatePointer4Bytes
-        else:
-            sys.stdout.write("Error: Pointers format argument not found.")
+        except (KeyError, ValueError):
+            print(f"Error: Incorrect or missing value in block {scriptFile}.")
             sys.exit(1)
-            
-        # Encoding arguments
-        scriptFile = sys.argv[3]                                    # Input file with Script
-        try:
-            textStartAddress = int(sys.argv[4], 16)                 # Start offset of text script
-        except ValueError:
-            print("Error: Incorrect hex value.")
+        except OverflowError as e:
+            if block.get("codec"):
+                sys.stdout.write(f"Error: The compressed text of {scriptFile} exceeds the maximum block limit by {e.args[0]} bytes.\n")
+                sys.exit(1)
+            sys.stdout.write("Error: The number of bytes read exceeds the maximum block limit.\n")
+            sys.stdout.write(f"Remove {e.args[0]} bytes from {scriptFile} file.\n")
             sys.exit(1)
+        stageWrites(journal, writes, scriptFile)
+        if block.get("codec"):
+            packedBytes = ba.parseHexValue(block["textSize"]) - freeBytes
+            print(f"{scriptFile}: {pointersCount} pointers, {textBytes} bytes compressed to {packedBytes} with {block['codec']} ({packedBytes * 100 // max(textBytes, 1)}%), free space: {freeBytes} bytes.")
+        elif spilledBytes:
+            print(f"{scriptFile}: {pointersCount} pointers, {spilledBytes} bytes spilled to free regions, free space: {freeBytes} bytes.")
+        else:
+            print(f"{scriptFile}: {pointersCount} pointers, free space: {freeBytes} bytes.")
+        if lookupTable:
+            # Read back what was just staged, from memory
+            problems = vf.checkBlock(journal.romData, block, lookupTable, script, addresses, lineCache)
+            reportProblems(scriptFile, problems)
+            verifyFailed = verifyFailed or bool(problems)
+
+    st.block(None)
+    if verifyFailed:
+        print(f"Error: Verification failed, nothing written to {romFile}.")
+        sys.exit(1)
+    if pool:
+        pool.shutdown()
+
+    # Replace the ROM with the patched data in a single write
+    commitJournal(journal, patchFile)
+    print(f"Data written to {romFile}")
+    print("Encoding complete.\n")
+
+def encodeIncremental(romFile, tblFile, blocks, patchFile=None, lookupTable=None):
+    """
+    Encodes blocks reusing the sidecar cache of each script, and writes the ROM
+    only if some bytes changed.
+
+    Parameters:
+        romFile (str): The path to the ROM file.
+        tblFile (str): The path to the encoder .tbl file.
+        blocks (list): The block settings, like in a manifest.
+        patchFile (str): Optional .ips or .bps patch to write with the changes.
+        lookupTable (tuple): Decoder table fragments to check every block with before
+            writing (--verify), or None.
+    """
+    import incremental as inc
+    import tablecache as tc
+    import stats as st
+    import verify as vf
+    journal = openJournal(romFile)
+    try:
+        charTable, longestChar = tc.readTblFileInverted(tblFile)
+        tableKey = inc.fileHash(tblFile)
+    except FileNotFoundError:
+        print(f"Error: File {tblFile} not found in directory.")
+        sys.exit(1)
+    except UnicodeDecodeError:
+        print(f"Error: File {tblFile} is not in UTF-8.")
+        sys.exit(1)
+
+    verifyFailed = False
+    for block in blocks:
+        scriptFile = block.get("file")
+        st.block(scriptFile)
+        addresses = []
+        lineCache = {}
+        script = {}
         try:
-            textSize = int(sys.argv[5], 16)                         # Text length size
-        except ValueError:
-            print("Error: Incorrect hex value.")
+            freeBytes, pointersCount, ranges, inPlace = inc.encodeBlock(journal.romData, block, charTable, longestChar, tableKey, lineCache, addresses, script)
+        except FileNotFoundError:
+            print(f"Error: File {scriptFile} not found in directory.")
             sys.exit(1)
-        try:
-            pointersStartAddress = int(sys.argv[6], 16)             # Start offset of pointer table
-        except ValueError:
-            print("Error: Incorrect hex value.")
+        except AttributeError:
+            print(f"Error: First line attributes not found in {scriptFile}.")
             sys.exit(1)
-        try:
-            headerSize = int(sys.argv[7], 16)                       # Header size
-        except ValueError:
-            print("Error: Incorrect hex value.")
+        except (KeyError, ValueError):
+            print(f"Error: Incorrect or missing value in block {scriptFile}.")
             sys.exit(1)
-        romFile = sys.argv[8]                                       # ROM file path
-        tblFile = sys.argv[9]                                       # Tbl file argument
-    
-        # Read the text file
+        except OverflowError as e:
+            sys.stdout.write("Error: The number of bytes read exceeds the maximum block limit.\n")
+            sys.stdout.write(f"Remove {e.args[0]} bytes from {scriptFile} file.\n")
+            sys.exit(1)
+        stageWrites(journal, ranges, scriptFile)
+        layout = "lines kept in place" if inPlace else "lines written in sequence"
+        print(f"{scriptFile}: {pointersCount} pointers, {layout}, free space: {freeBytes} bytes.")
+        if lookupTable:
+            # Read back what was just staged, from memory
+            problems = vf.checkBlock(journal.romData, block, lookupTable, script, addresses, lineCache)
+            reportProblems(scriptFile, problems)
+            verifyFailed = verifyFailed or bool(problems)
+
+    # Only the changed bytes are written, into the ROM file itself
+    st.block(None)
+    if verifyFailed:
+        print(f"Error: Verification failed, nothing written to {romFile}.")
+        sys.exit(1)
+    ranges = commitJournal(journal, patchFile, inPlace=True)
+    print(f"{sum(len(data) for offset, data in ranges)} bytes written in {len(ranges)} ranges to {romFile}")
+    print("Encoding complete.\n")
+
+def watchTable(manifest):
+    """
+    Compiles the tables of a manifest for watch mode.
+
+    Parameters:
+        manifest (dict): The top level settings of the manifest.
+
+    Returns:
+        Table: The compiled table.
+    """
+    import hexstring as hs
+    tblFile = manifest["encoderTbl"]
+    return hs.Table(manifest.get("decoderTbl") or tblFile, tblFile, manifest.get("lineBreakers", "0x00"))
+
+def watchBlock(rom, table, block):
+    """
+    Encodes one block in watch mode. Errors are reported and the block is left as it was,
+    so the watch goes on.
+
+    Parameters:
+        rom (Rom): The ROM kept in memory.
+        table (Table): The compiled table.
+        block (dict): The block settings.
+    """
+    import decoder as de
+    import hexstring as hs
+    import scriptcache as sc
+    scriptFile = block.get("file")
+    try:
+        textScript, _, _, _, lineBreaker = sc.openScript(scriptFile)
         try:
-            textScript, copyPointersStartAddress, pointersEndAddress, pointerTableSize, lineBreaker = en.readScriptFile(scriptFile)
+            freeBytes, pointersCount = hs.encodeBlock(rom, table, block, textScript, de.parseLineBreakers(lineBreaker))
+        finally:
+            textScript.close()
+    except FileNotFoundError:
+        print(f"Error: File {scriptFile} not found in directory.")
+        return
+    except AttributeError:
+        print(f"Error: First line attributes not found in {scriptFile}.")
+        return
+    except (KeyError, ValueError):
+        print(f"Error: Incorrect or missing value in block {scriptFile}.")
+        return
+    except OverflowError as e:
+        print(f"Error: {scriptFile} exceeds the maximum block limit by {e.args[0]} bytes, block not written.")
+        return
+    print(f"{scriptFile}: {pointersCount} pointers, free space: {freeBytes} bytes.")
+
+def watchManifest(manifestFile, options):
+    """
+    Keeps the ROM and the table in memory and encodes a block again each time its script
+    is saved. Saving the table or the manifest encodes every block again. After each change
+    the ROM file is replaced in one step. Stops with Ctrl+C.
+
+    Parameters:
+        manifestFile (str): The path to the manifest file.
+        options (dict): Optional flags given on the command line.
+    """
+    import time
+    import batch as ba
+    import hexstring as hs
+    import watch as fw
+    try:
+        interval = float(options.get('--interval', '0.5'))
+    except ValueError:
+        print("Error: Incorrect option value.")
+        sys.exit(1)
+    manifest, blocks = loadManifest(manifestFile)
+    applyEncodeOptions(blocks, options)
+    romFile = manifest["rom"]
+    try:
+        rom = hs.Rom(romFile)
+    except FileNotFoundError:
+        print(f"Error: File {romFile} not found in directory.")
+        sys.exit(1)
+    except ValueError:
+        print(f"Error: File {romFile} is empty.")
+        sys.exit(1)
+    try:
+        table = watchTable(manifest)
+    except FileNotFoundError as e:
+        print(f"Error: File {e.filename} not found in directory.")
+        sys.exit(1)
+    except UnicodeDecodeError:
+        print("Error: Table file is not in UTF-8.")
+        sys.exit(1)
+
+    # Every block is encoded once, then only the ones saved
+    pending = blocks
+    watcher = None
+    try:
+        while True:
+            if watcher is None:
+                files = [manifestFile, manifest["encoderTbl"]] + [block["file"] for block in blocks]
+                watcher = fw.FileWatcher(files, interval)
+                mode = "inotify" if watcher.fd is not None else f"polling every {interval} s"
+                print(f"Watching {len(files)} files ({mode}), press Ctrl+C to stop.")
+            started = time.perf_counter()
+            for block in pending:
+                watchBlock(rom, table, block)
+            writtenBytes = rom.flush(atomic=True)
+            if writtenBytes:
+                print(f"{writtenBytes} bytes written to {romFile} in {(time.perf_counter() - started) * 1000:.0f} ms.")
+
+            changed = watcher.wait()
+            if manifestFile in changed or manifest["encoderTbl"] in changed:
+                # Read the settings again, keeping the previous ones if they are not valid
+                try:
+                    newManifest, newBlocks = ba.readManifest(manifestFile)
+                    applyEncodeOptions(newBlocks, options)
+                    table = watchTable(newManifest)
+                    manifest, blocks = newManifest, newBlocks
+                except (OSError, ValueError, KeyError):
+                    print(f"Error: {manifestFile} or its table can't be read, previous settings kept.")
+                pending = blocks
+                watcher.close()
+                watcher = None
+            else:
+                pending = [block for block in blocks if block["file"] in changed]
+    except KeyboardInterrupt:
+        print("\nWatch stopped.")
+    finally:
+        if watcher is not None:
+            watcher.close()
+        rom.close()
+
+def generateDictionary(manifestFile, outTblFile, options):
+    """
+    Proposes DTE/MTE entries for the free codes of the encoder table from the manifest
+    scripts, writes the new table and reports the projected size of every block.
+
+    Parameters:
+        manifestFile (str): The path to the manifest file.
+        outTblFile (str): The path of the new .tbl file.
+        options (dict): Optional flags given on the command line.
+    """
+    import decoder as de
+    import encoder as en
+    import batch as ba
+    import dictionary as di
+    import scriptcache as sc
+    import tablecache as tc
+    manifest, blocks = loadManifest(manifestFile)
+    tblFile = manifest["encoderTbl"]
+    try:
+        maxLength = int(options.get('--max-length', 8))
+        maxEntries = int(options['--max-entries']) if '--max-entries' in options else None
+    except ValueError:
+        print("Error: Incorrect decimal value.")
+        sys.exit(1)
+
+    # Load the character table and every script
+    try:
+        charTable, longestChar = tc.readTblFileInverted(tblFile)
+    except FileNotFoundError:
+        print(f"Error: File {tblFile} not found in directory.")
+        sys.exit(1)
+    except UnicodeDecodeError:
+        print(f"Error: File {tblFile} is not in UTF-8.")
+        sys.exit(1)
+    textScripts = []
+    lineBreakers = set()
+    for block in blocks:
+        scriptFile = block.get("file")
+        try:
+            openedScript, _, _, _, lineBreaker = sc.openScript(scriptFile)
+            try:
+                textScript = list(openedScript)
+            finally:
+                openedScript.close()
         except FileNotFoundError:
             print(f"Error: File {scriptFile} not found in directory.")
             sys.exit(1)
         except AttributeError:
             print(f"Error: First line attributes not found in {scriptFile}.")
             sys.exit(1)
-            
-        # Parse line breakers.
+        textScripts.append(textScript)
+        lineBreakers |= de.parseLineBreakers(lineBreaker)
+
+    # Choose the entries and write the new table
+    freeCodes = di.findFreeCodes(charTable, textScripts, lineBreakers)
+    entries = di.generateDictionary(textScripts, freeCodes, maxLength, maxEntries)
+    di.writeTblFile(tblFile, outTblFile, entries)
+    print(f"{len(entries)} entries added for {len(freeCodes)} free codes.")
+
+    # Projected size of every block with the new table
+    newTable, newLongestChar = tc.readTblFileInverted(outTblFile)
+    for block, textScript in zip(blocks, textScripts):
+        breakers = de.parseLineBreakers(block.get("lineBreakers", "0x00"))
+        # Compressed blocks are measured after their codec
+        oldSize = len(ba.packText(block, en.encodeText(textScript, breakers, charTable, longestChar, '--optimal' in options)[0]))
+        newSize = len(ba.packText(block, en.encodeText(textScript, breakers, newTable, newLongestChar, '--optimal' in options)[0]))
+        textSize = ba.parseHexValue(block["textSize"])
+        print(f"{block['file']}: {oldSize} -> {newSize} / {textSize} bytes, free space: {textSize - newSize} bytes.")
+    print(f"Table written to {outTblFile}\n")
+
+def scanPointers(romFile, tblFile, lineBreaker, options):
+    """
+    Scans the ROM for pointer tables and prints the best candidates.
+
+    Parameters:
+        romFile (str): The path to the ROM file.
+        tblFile (str): The path to the decoder .tbl file.
+        lineBreaker (str): The line breakers, comma-separated hex values.
+        options (dict): Optional flags given on the command line.
+    """
+    import decoder as de
+    import scanner as sn
+    import tablecache as tc
+    try:
+        romSize = os.path.getsize(romFile)
+        with open(romFile, "rb") as f:
+            romHeader = 0x10 if f.read(4) == b"NES\x1a" else 0
+    except FileNotFoundError:
+        print(f"Error: File {romFile} not found in directory.")
+        sys.exit(1)
+    try:
+        charTable = tc.readTbl(tblFile)
+    except FileNotFoundError:
+        print(f"Error: File {tblFile} not found in directory.")
+        sys.exit(1)
+    except UnicodeDecodeError:
+        print(f"Error: File {tblFile} is not in UTF-8.")
+        sys.exit(1)
+    try:
+        lineBreakers = de.parseLineBreakers(lineBreaker)
+        formats = options.get('--formats', ",".join(sn.scanFormats)).split(",")
+        if any(pointersFormat not in sn.scanFormats for pointersFormat in formats):
+            raise ValueError(formats)
+        if '--headers' in options:
+            headers = [int(header, 16) for header in options['--headers'].split(",")]
+        else:
+            bankSize = int(options.get('--bank-size', '0x4000'), 16)
+            cpuBases = [int(cpuBase, 16) for cpuBase in options.get('--cpu-base', '0x8000,0xC000').split(",")]
+            headers = sn.candidateHeaders(romSize, romHeader, bankSize, cpuBases)
+        settings = {
+            "headers": headers,
+            "minPointers": max(int(options.get('--min-pointers', '8')), 2),
+            "maxLength": int(options.get('--max-length', '0x400'), 16),
+            "maxUnmapped": 0.1,
+            "top": int(options.get('--top', '20')),
+        }
+    except ValueError:
+        print("Error: Incorrect option value.")
+        sys.exit(1)
+
+    candidates = sn.scanRom(romFile, lineBreakers, charTable, settings, formats, jobsCount(options))
+    if not candidates:
+        print("No pointer table found.")
+        return
+    print("Rank Format PointersStart TableSize  HeaderSize Pointers Text              Unmapped")
+    for rank, candidate in enumerate(candidates, 1):
+        text = f"{candidate['textStart']:X}-{candidate['textEnd']:X}"
+        print(f"{rank:>4} {candidate['pointersFormat']:<6} {candidate['pointersStartAddress']:#013x} {candidate['tablePointersSize']:#010x} "
+              f"{candidate['headerSize']:#010x} {candidate['pointers']:>8} {text:<17} {candidate['unmapped']:.1%}")
+    best = candidates[0]
+    print(f"\nBest: -d {best['pointersFormat']} {romFile} {best['pointersStartAddress']:#X} {best['tablePointersSize']:#X} {best['headerSize']:#X} {lineBreaker} <outFile> {tblFile}\n")
+
+def scanTexts(romFile, tblFile, lineBreaker, outFile, options):
+    """
+    Scans the ROM for strings without pointers and writes them as a script with their addresses.
+    The first line of the script holds the scanned range instead of a pointer table.
+
+    Parameters:
+        romFile (str): The path to the ROM file.
+        tblFile (str): The path to the decoder .tbl file.
+        lineBreaker (str): The line breakers, comma-separated hex values.
+        outFile (str): The output script file.
+        options (dict): Optional flags given on the command line.
+    """
+    import decoder as de
+    import scanner as sn
+    import tablecache as tc
+    try:
+        romData = de.mapRom(romFile)
+    except FileNotFoundError:
+        print(f"Error: File {romFile} not found in directory.")
+        sys.exit(1)
+    except ValueError:
+        print(f"Error: File {romFile} is empty.")
+        sys.exit(1)
+    try:
+        charTable = tc.readTbl(tblFile)
+    except FileNotFoundError:
+        print(f"Error: File {tblFile} not found in directory.")
+        sys.exit(1)
+    except UnicodeDecodeError:
+        print(f"Error: File {tblFile} is not in UTF-8.")
+        sys.exit(1)
+    try:
+        lineBreakers = de.parseLineBreakers(lineBreaker)
+        start = int(options.get('--start', '0'), 16)
+        end = min(int(options.get('--end', hex(len(romData))), 16), len(romData))
+        minLength = int(options.get('--min-length', '4'))
+        minScore = float(options.get('--min-score', '0.5'))
+    except ValueError:
+        print("Error: Incorrect option value.")
+        sys.exit(1)
+    if not 0 <= start < end:
+        print("Error: Start address is bigger than the ROM size.")
+        sys.exit(1)
+    if minLength < sn.shortestRun:
+        print(f"Error: --min-length must be at least {sn.shortestRun}.")
+        sys.exit(1)
+
+    scanData = de.readRom(romData, start, end - start)
+    textRuns = sn.findTextRuns(scanData, lineBreakers, charTable, minLength, minScore)
+    if not textRuns:
+        print("No text found.")
+        return
+    de.writeScriptStream(outFile, sn.textRecords(scanData, textRuns, charTable, start), start, end - start, lineBreaker)
+    print(f"{len(textRuns)} strings, {sum(length for address, length, score in textRuns)} bytes.")
+    print(f"Text extracted to {outFile}\n")
+
+def decodeCommand(argv):
+    """
+    -d: decodes the text block of a pointer table to a script file.
+
+    Parameters:
+        argv (list): The command line, argv[1] being the command.
+    """
+    import batch as ba
+    import compression as cp
+    import decoder as de
+    import scriptcache as sc
+    import tablecache as tc
+    # Pointers Format
+    try:
+        pointersFormat = ba.pointersFormats[argv[2]][0]
+    except KeyError:
+        sys.stdout.write("Error: Pointers format argument not found.")
+        sys.exit(1)
+
+    # Other Arguments
+    romFile = argv[3]                                           # ROM file path
+    try:
+        pointersStartAddress = int(argv[4], 16)                 # Start offset of pointer table
+    except ValueError:
+        print("Error: Incorrect hex value.")
+        sys.exit(1)
+    try:
+        pointerTableSize = int(argv[5], 16)                     # Pointer table size
+    except ValueError:
+        print("Error: Incorrect hex value.")
+        sys.exit(1)
+    try:
+        headerSize = int(argv[6], 16)                           # Header size
+    except ValueError:
+        print("Error: Incorrect hex value.")
+        sys.exit(1)
+    lineBreaker = argv[7]                                       # Line breaker input (comma-separated)
+    outFile = argv[8]                                           # Output file for the extracted text
+    tblFile = argv[9]                                           # Tbl file argument
+    options = parseOptions(argv[10:], decodeOptions)            # Optional flags
+    startStats(options)
+    codec = codecOption(options)
+    if codec:
+        try:
+            textStartAddress, textSize = (int(value, 16) for value in options['--text'].split(":"))
+        except KeyError:
+            print("Error: --codec needs the compressed block with --text start:size.")
+            sys.exit(1)
+        except ValueError:
+            print("Error: Incorrect hex value.")
+            sys.exit(1)
+
+    # Map the ROM, pointers table and texts are read from the same mapping
+    try:
+        romData = de.mapRom(romFile)
+    except FileNotFoundError:
+        print(f"Error: File {romFile} not found in directory.")
+        sys.exit(1)
+    except ValueError:
+        print(f"Error: File {romFile} is empty.")
+        sys.exit(1)
+    tablePointers = de.readRom(romData, pointersStartAddress, pointerTableSize)
+
+    # Parse line breakers.
+    try:
         parseLineBreakers = de.parseLineBreakers(lineBreaker)
+    except ValueError:
+        print("Error: Incorrect hex value.")
+        sys.exit(1)
+    
+    # Process read pointers
+    lineStartAddress = pointersFormat(tablePointers, headerSize)
+    
+    # Load the character table
+    try:
+        charTable = tc.readTbl(tblFile)
+    except FileNotFoundError:
+        print(f"Error: File {tblFile} not found in directory.")
+        sys.exit(1)
+    except UnicodeDecodeError:
+        print(f"Error: File {tblFile} is not in UTF-8.")
+        
+    # Extract the texts straight into the file
+    try:
+        if codec:
+            texts = cp.iterPackedTexts(romData, lineStartAddress, parseLineBreakers, charTable, codec, textStartAddress, textSize)
+        else:
+            texts = de.iterTexts(romData, lineStartAddress, parseLineBreakers, charTable)
+        totalBytesRead = de.writeScriptStream(outFile, texts, pointersStartAddress, pointerTableSize, lineBreaker)
+    except IndexError:
+        print(f"Error: Start address is bigger than the ROM size.")
+        sys.exit(1)
+
+    # Keep the binary sidecar next to the script when asked, or when there is one already
+    if '--index' in options or os.path.exists(sc.cacheFileName(outFile)):
+        sc.buildScriptCache(outFile)
+    print(f"TEXT BLOCK SIZE: {totalBytesRead} / {hex(totalBytesRead)} bytes.")
+    print(f"Text extracted to {outFile}")
+    print("Decoding complete.\n")
+    writeStats(options)
+
+def encodeCommand(argv):
+    """
+    -e: encodes a script file into the ROM with its pointer table.
+
+    Parameters:
+        argv (list): The command line, argv[1] being the command.
+    """
+    import batch as ba
+    import decoder as de
+    import encoder as en
+    import scriptcache as sc
+    import tablecache as tc
+    import stats as st
+    import verify as vf
+    # Pointers Format
+    try:
+        pointersFormat = ba.pointersFormats[argv[2]][1]
+    except KeyError:
+        sys.stdout.write("Error: Pointers format argument not found.")
+        sys.exit(1)
+        
+    # Encoding arguments
+    scriptFile = argv[3]                                        # Input file with Script
+    try:
+        textStartAddress = int(argv[4], 16)                     # Start offset of text script
+    except ValueError:
+        print("Error: Incorrect hex value.")
+        sys.exit(1)
+    try:
+        textSize = int(argv[5], 16)                             # Text length size
+    except ValueError:
+        print("Error: Incorrect hex value.")
+        sys.exit(1)
+    try:
+        pointersStartAddress = int(argv[6], 16)                 # Start offset of pointer table
+    except ValueError:
+        print("Error: Incorrect hex value.")
+        sys.exit(1)
+    try:
+        headerSize = int(argv[7], 16)                           # Header size
+    except ValueError:
+        print("Error: Incorrect hex value.")
+        sys.exit(1)
+    romFile = argv[8]                                           # ROM file path
+    tblFile = argv[9]                                           # Tbl file argument
+    options = parseOptions(argv[10:], encodeOptions)            # Optional flags
+    startStats(options)
+
+    codec = codecOption(options)
+
+    # Incremental insertion only writes what changed since the last run
+    if '--incremental' in options:
+        if '--free' in options:
+            print("Error: --incremental can't be used with free regions.")
+            sys.exit(1)
+        if codec:
+            print("Error: --incremental can't be used with --codec.")
+            sys.exit(1)
+        block = {
+            "file": scriptFile,
+            "pointersFormat": argv[2],
+            "textStartAddress": textStartAddress,
+            "textSize": textSize,
+            "pointersStartAddress": pointersStartAddress,
+            "headerSize": headerSize,
+            "optimal": '--optimal' in options,
+            "shareLines": shareLinesMode(options),
+        }
+        encodeIncremental(romFile, tblFile, [block], options.get('--patch'), verifyTable(options, tblFile))
+        writeStats(options)
+        return
+
+    # Read the text file
+    try:
+        textScript, copyPointersStartAddress, pointersEndAddress, pointerTableSize, lineBreaker = sc.openScript(scriptFile)
+    except FileNotFoundError:
+        print(f"Error: File {scriptFile} not found in directory.")
+        sys.exit(1)
+    except AttributeError:
+        print(f"Error: First line attributes not found in {scriptFile}.")
+        sys.exit(1)
         
+    # Lines that don't fit are spilled to free regions of the ROM, compressed text is packed as a whole
+    if '--free' in options or codec:
+        block = {
+            "file": scriptFile,
+            "pointersFormat": argv[2],
+            "textStartAddress": textStartAddress,
+            "textSize": textSize,
+            "pointersStartAddress": pointersStartAddress,
+            "tablePointersSize": pointerTableSize,
+            "headerSize": headerSize,
+            "optimal": '--optimal' in options,
+            "shareLines": shareLinesMode(options),
+        }
+        if '--bank-size' in options:
+            block["bankSize"] = options['--bank-size']
+        if codec:
+            block["codec"] = codec
+        # The block is read again by encodeBlocks, only the header was needed here
+        textScript.close()
+        encodeBlocks(romFile, tblFile, [block], options.get('--free'), patchFile=options.get('--patch'), lookupTable=verifyTable(options, tblFile))
+        writeStats(options)
+        return
+
+    try:
+        # Parse line breakers.
+        parseLineBreakers = de.parseLineBreakers(lineBreaker)
+    
         # Load the character table if provided
         try:
-            charTable, longestChar = en.readTblFileInverted(tblFile)
+            charTable, longestChar = tc.readTblFileInverted(tblFile)
         except FileNotFoundError:
             print(f"Error: File {tblFile} not found in directory.")
             sys.exit(1)
         except UnicodeDecodeError:
             print(f"Error: File {tblFile} is not in UTF-8.")
-            
-        # Encode the text
-        encodedText, pointersList = en.encodeText(textScript, parseLineBreakers, charTable, longestChar)
         
-        # Format pointers
+        # Encode the text, keeping every line and its encoding for --verify
+        lookupTable = verifyTable(options, tblFile)
+        lineCache = {} if lookupTable else None
+        lines = list(textScript) if lookupTable else textScript
+        encodedText, pointersList = en.encodeText(lines, parseLineBreakers, charTable, longestChar, '--optimal' in options, shareLinesMode(options), lineCache)
+    finally:
+        textScript.close()
+    
+    # Format pointers
+    with st.stage("pointerBuild"):
         encodedPointers = pointersFormat(pointersList, textStartAddress, headerSize)
 
-        # Check that the size of the data does not exceed the maximum allowed
-        if len(encodedText) > int(textSize):
-            excess = len(encodedText) - int(textSize)
-            sys.stdout.write("Error: The number of bytes read exceeds the maximum block limit.\n")
-            sys.stdout.write(f"Remove {excess} bytes from {scriptFile} file.\n") 
+    # Check that the size of the data does not exceed the maximum allowed
+    if len(encodedText) > int(textSize):
+        excess = len(encodedText) - int(textSize)
+        sys.stdout.write("Error: The number of bytes read exceeds the maximum block limit.\n")
+        sys.stdout.write(f"Remove {excess} bytes from {scriptFile} file.\n") 
+        sys.exit(1)
+
+    # Check free bytes
+    freeBytes = int(textSize) - len(encodedText)
+
+    # Stage the text and the pointers, then write the ROM once
+    journal = openJournal(romFile)
+    stageWrites(journal, [(textStartAddress, encodedText), (pointersStartAddress, encodedPointers)], scriptFile)
+
+    # Read back the staged text and pointers from memory before writing anything
+    if lookupTable:
+        block = {
+            "file": scriptFile,
+            "pointersFormat": argv[2],
+            "textStartAddress": textStartAddress,
+            "textSize": textSize,
+            "pointersStartAddress": pointersStartAddress,
+            "headerSize": headerSize,
+            "optimal": '--optimal' in options,
+        }
+        addresses = [textStartAddress + pointer for pointer in pointersList]
+        script = {"lines": lines, "lineBreakers": parseLineBreakers}
+        problems = vf.checkBlock(journal.romData, block, lookupTable, script, addresses, lineCache)
+        reportProblems(scriptFile, problems)
+        if problems:
+            print(f"Error: Verification failed, nothing written to {romFile}.")
             sys.exit(1)
+    commitJournal(journal, options.get('--patch'))
 
-        # Check free bytes
-        freeBytes = int(textSize) - len(encodedText)
-            
-        # Write the text to the ROM
-        try:
-            en.writeROM(romFile, textStartAddress, encodedText)
-        except FileNotFoundError:
-            print(f"Error: File {romFile} not found in directory.")
-            sys.exit(1)
-            
-        # Write the pointers to the ROM
-        en.writeROM(romFile, pointersStartAddress, encodedPointers)
-
-        print(f"Text written at offset {hex(textStartAddress)}.")
-        print(f"Pointers table written at offset {hex(pointersStartAddress)} with {len(pointersList)} pointers.")
-        print(f"Free space: {freeBytes} bytes.")
-        print(f"Data written to {romFile}")
-        print("Encoding complete.\n")
-        sys.exit(1)
-
-    elif sys.argv[1] == '-h':
-        print("\nUsage: HexString [-d|e] [input_file output_file]")
-        print(" -d  --decode   decode from ROM")
-        print(" -e  --encode   encode from raw binary text")
-        print(" -h  --help     show help")
-        print(" -v  --version  show version number\n")
-        print(" ****** Pointers Format ****** \n")
-        print(" -2b   --2bytes little endian")
-        print(" -2bb  --2bytes big endian")
-        print(" -2bs  --2bytes splitted lsb-msb")
-        print(" -3b   --3bytes (bank/2bytespointer)")
-        print(" -4b   --4bytes")
-        sys.exit(1)
-        
-    elif sys.argv[1] == '-v':
-        sys.stdout.write("\nHexSring created by koda, version 1.1.0")
-        sys.exit(1)
+    print(f"Text written at offset {hex(textStartAddress)}.")
+    print(f"Pointers table written at offset {hex(pointersStartAddress)} with {len(pointersList)} pointers.")
+    print(f"Free space: {freeBytes} bytes.")
+    print(f"Data written to {romFile}")
+    print("Encoding complete.\n")
+    writeStats(options)
 
-    else:
-        sys.stdout.write("Usage: -d <pointersFormat> <romFile> <PointersStartAddress> <PointerTableSize> <HeaderSize> <LineBreaker> <outFile> <tblFile>\n")
-        sys.stdout.write("       -e <pointersFormat> <TextFile> <TextStartAddress> <TextSize> <PointersStartAddress> <HeaderSize> <romFile> <tblFile>\n")
-        sys.stdout.write("       -h show help.\n")
-        sys.stdout.write("       -v show version.\n")
-        sys.exit(1)
+def manifestDecodeCommand(argv):
+    """
+    -md: decodes every block of a manifest.
+
+    Parameters:
+        argv (list): The command line, argv[1] being the command.
+    """
+    options = parseOptions(argv[3:], manifestDecodeOptions)
+    startStats(options)
+    decodeManifest(argv[2], options)
+    writeStats(options)
+
+def manifestEncodeCommand(argv):
+    """
+    -me: encodes every block of a manifest.
+
+    Parameters:
+        argv (list): The command line, argv[1] being the command.
+    """
+    options = parseOptions(argv[3:], manifestEncodeOptions)
+    startStats(options)
+    encodeManifest(argv[2], options)
+    writeStats(options)
+
+def watchCommand(argv):
+    """
+    -w: encodes the blocks of a manifest again each time a script is saved.
+
+    Parameters:
+        argv (list): The command line, argv[1] being the command.
+    """
+    watchManifest(argv[2], parseOptions(argv[3:], watchOptions))
+
+def scanCommand(argv):
+    """
+    -s: finds pointer tables.
+
+    Parameters:
+        argv (list): The command line, argv[1] being the command.
+    """
+    scanPointers(argv[2], argv[3], argv[4], parseOptions(argv[5:], scanOptions))
+
+def textScanCommand(argv):
+    """
+    -t: extracts strings without pointers.
+
+    Parameters:
+        argv (list): The command line, argv[1] being the command.
+    """
+    scanTexts(argv[2], argv[3], argv[4], argv[5], parseOptions(argv[6:], textScanOptions))
+
+def generateCommand(argv):
+    """
+    -g: generates DTE/MTE entries.
+
+    Parameters:
+        argv (list): The command line, argv[1] being the command.
+    """
+    generateDictionary(argv[2], argv[3], parseOptions(argv[4:], dictionaryOptions))
+
+def helpCommand(argv):
+    """
+    -h: shows the commands and options.
+
+    Parameters:
+        argv (list): The command line, argv[1] being the command.
+    """
+    print("\nUsage: HexString [-d|e] [input_file output_file]")
+    print(" -d  --decode   decode from ROM")
+    print(" -e  --encode   encode from raw binary text")
+    print(" -md --manifest-decode  decode every block in a manifest")
+    print(" -me --manifest-encode  encode every block in a manifest")
+    print(" -w  --watch    encode the blocks of a manifest again each time a script is saved")
+    print(" -g  --generate  propose DTE/MTE entries from the manifest scripts")
+    print(" -s  --scan     find pointer tables and their header size")
+    print(" -t  --text-scan  extract strings that have no pointer table")
+    print(" -r  --run      run the commands read from the standard input, one JSON array of arguments per line")
+    print(" -h  --help     show help")
+    print(" -v  --version  show version number\n")
+    print(" ****** Decoding Options ****** \n")
+    print(" --index        also write a binary sidecar (.lines) of the script, read instead of the text on insertion")
+    print(" --codec        the text block is compressed with these stages (lzss, rle, huffman, comma-separated)")
+    print(" --text         -d with --codec: the compressed block, start:size in hex\n")
+    print(" ****** Encoding Options ****** \n")
+    print(" --optimal      use the shortest DTE/MTE encoding instead of the greedy one")
+    print(" --dedupe       write identical lines once, their pointers share the copy")
+    print(" --merge-tails  like --dedupe, and lines ending another line point inside it")
+    print(" --incremental  encode only edited lines (cache next to the script) and write only changed bytes")
+    print(" --free         spill lines that don't fit to free regions: start:size pairs in hex (0x3F000:0x200,...) or auto")
+    print(" --bank-size    keep every spilled line inside one bank of this size (hex)")
+    print(" --codec        compress the text block with these stages, the compressed size must fit the text size")
+    print(" --jobs N       -md/-me: process N blocks at once (0 uses every CPU), same output as serial mode")
+    print(" --interval S   -w: seconds between checks when inotify is not available (default 0.5)\n")
+    print(" ****** Pointers Format ****** \n")
+    print(" -2b   --2bytes little endian")
+    print(" -2bb  --2bytes big endian")
+    print(" -2bs  --2bytes splitted lsb-msb")
+    print(" -3b   --3bytes (bank/2bytespointer)")
+    print(" -4b   --4bytes")
+
+def versionCommand(argv):
+    """
+    -v: shows the version.
+
+    Parameters:
+        argv (list): The command line, argv[1] being the command.
+    """
+    from version import toolVersion
+    sys.stdout.write(f"\nHexSring created by koda, version {toolVersion}")
+
+def runCommand(argv):
+    """
+    Runs one command line.
+
+    Parameters:
+        argv (list): The command line, argv[1] being the command.
+
+    Returns:
+        int: The exit status, 0 on success.
+    """
+    command = commands.get(argv[1]) if len(argv) > 1 else None
+    if command is None or len(argv) < command[1]:
+        showHelp()
+        return 1
+    try:
+        command[0](argv)
+    except SystemExit as e:
+        return e.code or 0
+    return 0
+
+def serveCommands(inStream, outStream):
+    """
+    Runs the commands read from a stream, one per line, in the same process: modules and
+    tables are loaded once for every command. A line is a JSON array of arguments, or an
+    object with "args" and an "id" given back with the answer. Each answer is one JSON line
+    with the id, the exit status and the output of the command.
+
+    Parameters:
+        inStream (file): The stream of commands, read until its end.
+        outStream (file): The stream the answers are written to.
+    """
+    import io
+    import json
+    import traceback
+    from contextlib import redirect_stdout
+    import stats as st
+    for line in inStream:
+        if not line.strip():
+            continue
+        output = io.StringIO()
+        requestId = None
+        with redirect_stdout(output):
+            try:
+                request = json.loads(line)
+                if isinstance(request, dict):
+                    requestId = request.get("id")
+                    request = request["args"]
+                if not isinstance(request, list) or not all(isinstance(arg, str) for arg in request):
+                    raise ValueError(request)
+            except (ValueError, KeyError):
+                print("Error: Commands must be JSON arrays of arguments, or objects with args.")
+                status = 1
+            else:
+                if request[:1] in (['-r'], ['-w']):
+                    print(f"Error: {request[0]} can't be run by -r.")
+                    status = 1
+                else:
+                    try:
+                        status = runCommand(["HexString"] + request)
+                    except Exception:
+                        # A failing command doesn't stop the other ones
+                        traceback.print_exc(file=output)
+                        status = 1
+                    finally:
+                        st.disable()
+        outStream.write(json.dumps({"id": requestId, "status": status, "output": output.getvalue()}) + "\n")
+        outStream.flush()
+
+def serverCommand(argv):
+    """
+    -r: runs the commands read from the standard input.
+
+    Parameters:
+        argv (list): The command line, argv[1] being the command.
+    """
+    serveCommands(sys.stdin, sys.stdout)
+
+# Every command: the function running it and the length of its shortest command line
+commands = {
+    '-d': (decodeCommand, 10),
+    '-e': (encodeCommand, 10),
+    '-md': (manifestDecodeCommand, 3),
+    '-me': (manifestEncodeCommand, 3),
+    '-w': (watchCommand, 3),
+    '-s': (scanCommand, 5),
+    '-t': (textScanCommand, 6),
+    '-g': (generateCommand, 4),
+    '-r': (serverCommand, 2),
+    '-h': (helpCommand, 2),
+    '-v': (versionCommand, 2),
+}
+
+def main():
+    sys.exit(runCommand(sys.argv))
 
 if __name__ == '__main__':
     main()
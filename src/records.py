@@ -0,0 +1,102 @@
+from array import array
+
+class LineRecords:
+    """
+    The lines of a text block stored compactly: addresses and lengths in unsigned int
+    arrays, and every text encoded once in a single UTF-8 buffer with an offset index,
+    like the pool of a script sidecar. A line costs a few bytes plus its text instead
+    of a str and two int objects, and the whole block pickles as four buffers.
+
+    Iterating gives the same (address, text, length in bytes) tuples as decoder.iterTexts,
+    so records can be written with decoder.writeScriptStream, and texts() gives the lines
+    to encode.
+
+    Attributes:
+        addresses (array): ROM address of every line.
+        lengths (array): Length in bytes of every line in the ROM.
+        offsets (array): Start of every text in pool, with one more offset for the end of the last.
+        pool (bytearray): The UTF-8 texts, one after another.
+    """
+
+    def __init__(self, records=()):
+        """
+        Parameters:
+            records (iterable): Tuples (address, text, length in bytes) to store.
+        """
+        self.addresses = array("I")
+        self.lengths = array("I")
+        self.offsets = array("I", [0])
+        self.pool = bytearray()
+        self.extend(records)
+
+    def append(self, address, text, length):
+        """
+        Stores a line.
+
+        Parameters:
+            address (int): The ROM address of the line.
+            text (str): The decoded text.
+            length (int): The length of the line in bytes in the ROM.
+        """
+        self.pool += text.encode("UTF-8")
+        self.addresses.append(address)
+        self.lengths.append(length)
+        self.offsets.append(len(self.pool))
+
+    def extend(self, records):
+        """
+        Stores every line of an iterable.
+
+        Parameters:
+            records (iterable): Tuples (address, text, length in bytes).
+        """
+        for address, text, length in records:
+            self.append(address, text, length)
+
+    def text(self, index):
+        """
+        Decodes the text of a line.
+
+        Parameters:
+            index (int): The line number, from 0.
+
+        Returns:
+            str: The text.
+        """
+        if index < 0:
+            index += len(self.addresses)
+        if not 0 <= index < len(self.addresses):
+            raise IndexError(index)
+        return self.pool[self.offsets[index]:self.offsets[index + 1]].decode("UTF-8")
+
+    def texts(self):
+        """
+        Yields the text of every line, decoded one at a time.
+
+        Yields:
+            str: Each text.
+        """
+        for start, end in zip(self.offsets, self.offsets[1:]):
+            yield self.pool[start:end].decode("UTF-8")
+
+    def totalBytes(self):
+        """
+        Returns the size of the text block, from the first line to the end of the last one.
+
+        Returns:
+            int: The size in bytes, 0 without lines.
+        """
+        if not self.addresses:
+            return 0
+        return abs(self.addresses[-1] + self.lengths[-1] - self.addresses[0])
+
+    def __len__(self):
+        return len(self.addresses)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self.addresses)
+        return self.addresses[index], self.text(index), self.lengths[index]
+
+    def __iter__(self):
+        return zip(self.addresses, self.texts(), self.lengths)
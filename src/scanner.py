@@ -0,0 +1,371 @@
+import codecs
+import itertools
+import operator
+import re
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+import decoder as de
+
+# Record size of each pointer format, and its key in decoder.pointerLayouts
+scanFormats = {
+    '-2b': (2, '2b'),
+    '-2bb': (2, '2bb'),
+    '-2bs': (1, '2bs'),
+    '-3b': (3, '3b'),
+    '-4b': (4, '4b'),
+}
+
+# Pointers checked before scoring a whole run with a header
+probeCount = 8
+
+# Shortest run findTextRuns can score, its first byte pairs need 3 bytes
+shortestRun = 3
+
+# ROM views and settings of a scanning process, set once per process
+scanState = {}
+
+def candidateHeaders(romSize, romHeader, bankSize, cpuBases):
+    """
+    Lists the header sizes that map a bank of the ROM to the CPU addresses it can be loaded at,
+    and the 64 KB steps used by pointers holding a ROM offset (like -3b, whose first byte is the bank).
+
+    Parameters:
+        romSize (int): The ROM size.
+        romHeader (int): Size of the file header (0x10 for iNES ROMs).
+        bankSize (int): The bank size.
+        cpuBases (list): CPU addresses a bank can be mapped at.
+
+    Returns:
+        list: The header sizes.
+    """
+    banks = (romSize - romHeader + bankSize - 1) // bankSize
+    headers = {romHeader + bank * bankSize - cpuBase for bank in range(banks) for cpuBase in cpuBases}
+    return sorted(headers | set(range(0, romSize, 0x10000)))
+
+def initScan(romFile, lineBreakers, charTable, settings):
+    """
+    Precomputes the views shared by every scan task: one byte per ROM byte telling if it
+    is a line breaker, and another telling if the table has no character for it.
+
+    Parameters:
+        romFile (str): The path to the ROM file.
+        lineBreakers (set): A set of byte values used as line breakers.
+        charTable (dict): A dictionary mapping byte values to characters or sequences.
+        settings (dict): headers, minPointers, maxLength and maxUnmapped.
+    """
+    with de.mapRom(romFile) as romMap:
+        romData = romMap[:]
+    scanState["romData"] = romData
+    scanState["breakers"] = romData.translate(bytes(byte in lineBreakers for byte in range(256)))
+    scanState["unmapped"] = romData.translate(bytes(byte not in charTable and byte not in lineBreakers for byte in range(256)))
+    scanState.update(settings)
+
+def monotonicRuns(values, minPointers, maxLength):
+    """
+    Finds runs of values where every step is between 0 and maxLength (modulo 16 bits),
+    like the pointers of consecutive lines. The steps are tested with C level maps and
+    the runs found with a regular expression, not a loop per value.
+
+    Parameters:
+        values (array): The 16 bit values.
+        minPointers (int): Shortest run kept.
+        maxLength (int): Longest step, the longest line.
+
+    Returns:
+        list: Tuples (start, end) of index ranges.
+    """
+    steps = map(operator.and_, map(operator.sub, values[1:], values), itertools.repeat(0xFFFF))
+    smallSteps = bytes(map(maxLength.__ge__, steps))
+    runs = []
+    for match in re.finditer(rb"\x01{%d,}" % (minPointers - 1), smallSteps):
+        start, end = match.start(), match.end() + 1
+        # Skip padding and other runs of one repeated value
+        if len(set(values[start:end])) * 2 >= end - start:
+            runs.append((start, end))
+    return runs
+
+def scoreRun(values, header):
+    """
+    Scores a run of pointers read with a header: pointers whose line ends in a breaker
+    within the longest length and is mostly mapped by the table are kept, and the longest
+    stretch of them is scored by its size and how many lines follow the previous one.
+
+    Parameters:
+        values (array): The 16 bit values of the run.
+        header (int): The header size added to each value.
+
+    Returns:
+        tuple: Start index, end index, contiguous lines, unmapped bytes, text bytes and lines
+            holding only a breaker of the best stretch, or None.
+    """
+    romData = scanState["romData"]
+    breakers = scanState["breakers"]
+    unmapped = scanState["unmapped"]
+    maxLength = scanState["maxLength"]
+    best = None
+    start = None
+    for i in range(len(values) + 1):
+        good = False
+        if i < len(values):
+            target = values[i] + header
+            if 0 <= target < len(romData):
+                end = breakers.find(1, target, target + maxLength)
+                # Control codes are unmapped too, so a single line may hold a few of them
+                if end >= 0 and unmapped.count(1, target, end) * 2 <= end - target + 1:
+                    good = True
+        if good:
+            if start is None:
+                start, contiguous, unmappedBytes, textBytes, emptyLines = i, 0, 0, 0, 0
+            elif target == previous or (target > 0 and breakers[target - 1]):
+                contiguous += 1
+            previous = target
+            unmappedBytes += unmapped.count(1, target, end)
+            textBytes += end - target + 1
+            emptyLines += end == target
+            continue
+        if start is not None and i - start >= scanState["minPointers"]:
+            if best is None or (i - start) + contiguous > (best[1] - best[0]) + best[2]:
+                best = (start, i, contiguous, unmappedBytes, textBytes, emptyLines)
+        start = None
+    return best
+
+def scanValues(values, formatName, recordSize, recordStart):
+    """
+    Finds candidate tables in the values read from a ROM position.
+
+    Parameters:
+        values (array): The 16 bit values.
+        formatName (str): The pointer format flag.
+        recordSize (int): Bytes per record.
+        recordStart (int): ROM offset of the first record.
+
+    Returns:
+        list: The candidate tables, as dictionaries.
+    """
+    breakers = scanState["breakers"]
+    romSize = len(scanState["romData"])
+    candidates = []
+    for runStart, runEnd in monotonicRuns(values, scanState["minPointers"], scanState["maxLength"]):
+        run = values[runStart:runEnd]
+        probe = run[1:probeCount + 1]
+        for header in scanState["headers"]:
+            # Most lines start right after the breaker of the line before
+            hits = sum(1 for value in probe if 0 < value + header < romSize and breakers[value + header - 1])
+            if hits * 4 < len(probe) * 3:
+                continue
+            best = scoreRun(run, header)
+            if best is None:
+                continue
+            start, end, contiguous, unmappedBytes, textBytes, emptyLines = best
+            count = end - start
+            # Padding made of breakers looks like a table of empty lines
+            if contiguous * 2 < count or emptyLines * 2 > count or unmappedBytes > scanState["maxUnmapped"] * textBytes:
+                continue
+            candidates.append({
+                "pointersFormat": formatName,
+                "pointersStartAddress": recordStart + (runStart + start) * recordSize,
+                "tablePointersSize": count * recordSize,
+                "headerSize": header,
+                "pointers": count,
+                "textStart": min(run[start:end]) + header,
+                "textEnd": max(run[start:end]) + header,
+                "unmapped": unmappedBytes / textBytes,
+                "score": count + contiguous,
+            })
+    return candidates
+
+def scanTask(task):
+    """
+    Scans the ROM for one pointer format at one record alignment.
+
+    Parameters:
+        task (tuple): The format flag and the alignment.
+
+    Returns:
+        list: The candidate tables found.
+    """
+    formatName, phase = task
+    romData = scanState["romData"]
+    recordSize, layout = scanFormats[formatName]
+    if layout != '2bs':
+        values = de.pointerValues(memoryview(romData)[phase:], layout)
+        return scanValues(values, formatName, recordSize, phase)
+
+    # Split tables: the msb half is a slowly increasing run, the lsb half sits right before it
+    candidates = []
+    steps = bytes(map(operator.and_, map(operator.sub, romData[1:], romData), itertools.repeat(0xFF)))
+    for match in re.finditer(rb"[\x00\x01]{%d,}" % (scanState["minPointers"] - 1), steps):
+        msbStart, count = match.start(), match.end() + 1 - match.start()
+        if msbStart < count or len(set(romData[msbStart:msbStart + count])) == 1:
+            continue
+        values = de.pointerValues(memoryview(romData)[msbStart - count:msbStart + count], '2bs')
+        for candidate in scanValues(values, formatName, 1, msbStart - count):
+            # Only a whole split table can be read back
+            if candidate["pointers"] == count:
+                candidate["tablePointersSize"] = count * 2
+                candidates.append(candidate)
+    return candidates
+
+def scanTasks(formats):
+    """
+    Lists the scan tasks, one per pointer format and record alignment.
+
+    Parameters:
+        formats (list): The pointer format flags to test.
+
+    Returns:
+        list: Tuples (format flag, alignment).
+    """
+    return [(formatName, phase) for formatName in formats for phase in range(scanFormats[formatName][0])]
+
+def rankCandidates(candidates, top):
+    """
+    Sorts candidate tables by score, dropping those overlapping a better one.
+
+    Parameters:
+        candidates (list): The candidate tables.
+        top (int): Number of candidates kept.
+
+    Returns:
+        list: The best candidates.
+    """
+    ranked = []
+    for candidate in sorted(candidates, key=lambda candidate: (-candidate["score"], candidate["unmapped"], candidate["pointersStartAddress"])):
+        start = candidate["pointersStartAddress"]
+        end = start + candidate["tablePointersSize"]
+        if any(start < other["pointersStartAddress"] + other["tablePointersSize"] and other["pointersStartAddress"] < end for other in ranked):
+            continue
+        ranked.append(candidate)
+        if len(ranked) == top:
+            break
+    return ranked
+
+def scanRom(romFile, lineBreakers, charTable, settings, formats, jobs=1):
+    """
+    Scans a whole ROM for pointer tables, each format and alignment being a separate task
+    run by a pool of processes when jobs is above 1.
+
+    Parameters:
+        romFile (str): The path to the ROM file.
+        lineBreakers (set): A set of byte values used as line breakers.
+        charTable (dict): A dictionary mapping byte values to characters or sequences.
+        settings (dict): headers, minPointers, maxLength, maxUnmapped and top.
+        formats (list): The pointer format flags to test.
+        jobs (int): Number of processes.
+
+    Returns:
+        list: The best candidate tables, best first.
+    """
+    tasks = scanTasks(formats)
+    initArgs = (romFile, lineBreakers, charTable, settings)
+    if jobs > 1:
+        with ProcessPoolExecutor(min(jobs, len(tasks)), initializer=initScan, initargs=initArgs) as pool:
+            results = list(pool.map(scanTask, tasks))
+    else:
+        initScan(*initArgs)
+        results = [scanTask(task) for task in tasks]
+    return rankCandidates(itertools.chain.from_iterable(results), settings["top"])
+
+def classifyBytes(lineBreakers, charTable):
+    """
+    Builds the 256 entry classification used by the text scan: m for bytes the table maps,
+    b for line breakers and u for the rest (control codes or data).
+
+    Parameters:
+        lineBreakers (set): A set of byte values used as line breakers.
+        charTable (dict): A dictionary mapping byte values to characters or sequences.
+
+    Returns:
+        bytes: The class of each byte value, for bytes.translate.
+    """
+    return b"".join(b"b" if byte in lineBreakers else b"m" if byte in charTable else b"u" for byte in range(256))
+
+def findTextRuns(romData, lineBreakers, charTable, minLength=4, minScore=0.5, minBigram=3):
+    """
+    Finds strings without pointers: runs of mapped bytes ending in a line breaker, where
+    one or two unmapped bytes in a row (control codes) may appear between mapped ones.
+    The ROM is classified with one translate pass and split at the breakers found by one
+    regular expression pass. Leading bytes are dropped until one of the next two byte pairs is
+    plausible, then each run is scored by its mapped byte density times the share of its
+    plausible pairs: pairs seen at least minBigram times in every run found, and at least
+    twice as often as their two bytes make likely. Text keeps reusing the same pairs while
+    data mapped by chance does not.
+
+    Parameters:
+        romData (bytes): The ROM data to scan.
+        lineBreakers (set): A set of byte values used as line breakers.
+        charTable (dict): A dictionary mapping byte values to characters or sequences.
+        minLength (int): Shortest run kept, breaker included, at least shortestRun.
+        minScore (float): Lowest score kept, between 0 and 1.
+        minBigram (int): Occurrences a byte pair needs to count as plausible.
+
+    Returns:
+        list: Tuples (address, length, score) in address order.
+    """
+    romData = bytes(romData)
+    classes = romData.translate(classifyBytes(lineBreakers, charTable))
+
+    # Each line ends at a breaker, its text starts after the last 3 unmapped bytes in a row
+    runs = []
+    lineStart = 0
+    for match in re.finditer(rb"b", classes):
+        start, end = lineStart, match.end()
+        lineStart = end
+        if end - start < minLength:
+            continue
+        dataEnd = classes.rfind(b"uuu", start, end)
+        if dataEnd >= 0:
+            start = dataEnd + 3
+        start = classes.find(b"m", start, end)
+        if start >= 0 and end - start >= minLength:
+            runs.append((start, end))
+
+    # Bytes and byte pairs of every run, counted at C level
+    unigrams = Counter()
+    bigrams = Counter()
+    for start, end in runs:
+        run = romData[start:end]
+        unigrams.update(run)
+        bigrams.update(zip(run, run[1:]))
+
+    # A pair is plausible when it is seen far more often than its bytes alone would make it
+    totalBytes = sum(unigrams.values()) or 1
+    totalPairs = sum(bigrams.values())
+    plausiblePairs = {pair for pair, count in bigrams.items()
+                      if count >= minBigram and count * totalBytes * totalBytes >= 2 * totalPairs * unigrams[pair[0]] * unigrams[pair[1]]}
+
+    textRuns = []
+    for start, end in runs:
+        # Skip data glued before the text
+        while end - start >= minLength and (romData[start], romData[start + 1]) not in plausiblePairs \
+                and (romData[start + 1], romData[start + 2]) not in plausiblePairs:
+            start += 1
+        length = end - start
+        if length < minLength:
+            continue
+        density = classes.count(b"m", start, end) / (length - 1)
+        run = romData[start:end]
+        plausible = sum(1 for pair in zip(run, run[1:]) if pair in plausiblePairs) / (length - 1)
+        score = density * plausible
+        if score >= minScore:
+            textRuns.append((start, length, score))
+    return textRuns
+
+def textRecords(romData, textRuns, charTable, baseAddress=0):
+    """
+    Decodes found runs into script records, like decoder.iterTexts yields them.
+
+    Parameters:
+        romData (bytes): The scanned data.
+        textRuns (list): Tuples (address, length, score) from findTextRuns.
+        charTable (dict): A dictionary mapping byte values to characters or sequences.
+        baseAddress (int): ROM offset of the scanned data.
+
+    Yields:
+        tuple: The absolute address, the decoded text and the length in bytes of each run.
+    """
+    lookupTable = de.buildLookupTable(charTable)
+    romView = memoryview(romData)
+    for address, length, score in textRuns:
+        text, _ = codecs.charmap_decode(romView[address:address + length], 'strict', lookupTable)
+        yield baseAddress + address, text, length
@@ -0,0 +1,183 @@
+import hashlib
+import mmap
+import os
+import struct
+import sys
+from array import array
+import encoder as en
+import stats as st
+
+# Sidecar layout: header, line breakers string, padding to 4 bytes, offset index
+# (one more offset than lines, relative to the pool) and the UTF-8 string pool.
+# Header: magic, version, line count, script mtime (ns), script size, script SHA-1,
+# pointersStartAddress, pointersEndAddress, pointerTableSize, line breakers length.
+cacheMagic = b"HSSC"
+cacheVersion = 1
+headerFormat = struct.Struct("<4sHIqQ20sIIIH")
+
+def cacheFileName(scriptFile):
+    """
+    Returns the binary sidecar path of a script file.
+
+    Parameters:
+        scriptFile (str): The path to the script file.
+
+    Returns:
+        str: The path to the sidecar file.
+    """
+    return scriptFile + ".lines"
+
+def fileDigest(file):
+    """
+    Hashes a file in chunks, so large scripts are not read at once.
+
+    Parameters:
+        file (str): The path to the file.
+
+    Returns:
+        bytes: The SHA-1 digest.
+    """
+    digest = hashlib.sha1()
+    with open(file, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.digest()
+
+def buildScriptCache(scriptFile):
+    """
+    Writes the binary sidecar of a script file. Lines are read twice, once to build
+    the offset index and once to copy them to the pool, so memory stays flat.
+
+    Parameters:
+        scriptFile (str): The path to the script file.
+
+    Returns:
+        str: The path to the sidecar file.
+    """
+    lines, pointersStartAddress, pointersEndAddress, pointerTableSize, lineBreakers = en.openScriptFile(scriptFile)
+    offsets = array("I", [0])
+    for line in lines:
+        offsets.append(offsets[-1] + len(line.encode("UTF-8")))
+    if sys.byteorder == "big":
+        offsets.byteswap()
+
+    stat = os.stat(scriptFile)
+    breakers = lineBreakers.encode("UTF-8")
+    header = headerFormat.pack(cacheMagic, cacheVersion, len(offsets) - 1, stat.st_mtime_ns, stat.st_size, fileDigest(scriptFile),
+                               pointersStartAddress, pointersEndAddress, pointerTableSize, len(breakers))
+    padding = b"\0" * (-(len(header) + len(breakers)) % 4)
+
+    cacheFile = cacheFileName(scriptFile)
+    tempFile = cacheFile + ".tmp"
+    with open(tempFile, "wb") as f:
+        f.write(header + breakers + padding)
+        f.write(offsets.tobytes())
+        lines = en.openScriptFile(scriptFile)[0]
+        for line in lines:
+            f.write(line.encode("UTF-8"))
+    os.replace(tempFile, cacheFile)
+    return cacheFile
+
+class ScriptLines:
+    """
+    Read-only view of a binary sidecar, mapped with mmap. Line N is found through
+    the offset index without parsing the script.
+
+    Attributes:
+        pointersStartAddress (int): Start of the pointer table, from the script header.
+        pointersEndAddress (int): End of the pointer table.
+        pointerTableSize (int): Size of the pointer table.
+        lineBreakers (str): The line breakers, like readScriptFile returns them.
+    """
+
+    def __init__(self, cacheFile):
+        with open(cacheFile, "rb") as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, self.count, self.mtime, self.size, self.digest, self.pointersStartAddress,
+         self.pointersEndAddress, self.pointerTableSize, breakersLength) = headerFormat.unpack_from(self.data)
+        if magic != cacheMagic or version != cacheVersion:
+            self.data.close()
+            raise ValueError(cacheFile)
+        breakersStart = headerFormat.size
+        self.lineBreakers = self.data[breakersStart:breakersStart + breakersLength].decode("UTF-8")
+        self.indexStart = breakersStart + breakersLength + (-(breakersStart + breakersLength) % 4)
+        self.poolStart = self.indexStart + (self.count + 1) * 4
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError(index)
+        start, end = struct.unpack_from("<II", self.data, self.indexStart + index * 4)
+        return self.data[self.poolStart + start:self.poolStart + end].decode("UTF-8")
+
+    def __iter__(self):
+        for index in range(self.count):
+            yield self[index]
+
+    def isFresh(self, scriptFile):
+        """
+        Checks the sidecar still matches the script: same mtime and size, or same content.
+
+        Parameters:
+            scriptFile (str): The path to the script file.
+
+        Returns:
+            bool: True if the sidecar can be used.
+        """
+        stat = os.stat(scriptFile)
+        if stat.st_mtime_ns == self.mtime and stat.st_size == self.size:
+            return True
+        return stat.st_size == self.size and fileDigest(scriptFile) == self.digest
+
+    def close(self):
+        self.data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *excInfo):
+        self.close()
+
+def loadScriptCache(scriptFile):
+    """
+    Loads the binary sidecar of a script, rebuilding it first if it is missing, unreadable
+    or no longer matches the script.
+
+    Parameters:
+        scriptFile (str): The path to the script file.
+
+    Returns:
+        ScriptLines: The lines of the script.
+    """
+    cacheFile = cacheFileName(scriptFile)
+    try:
+        lines = ScriptLines(cacheFile)
+    except (OSError, ValueError, struct.error):
+        lines = None
+    if lines is not None and lines.isFresh(scriptFile):
+        return lines
+    if lines is not None:
+        lines.close()
+    return ScriptLines(buildScriptCache(scriptFile))
+
+def openScript(scriptFile):
+    """
+    Opens a script like encoder.openScriptFile, reading the lines from its binary sidecar
+    when the script has one (rebuilt if the script changed).
+
+    Parameters:
+        scriptFile (str): The path to the script file.
+
+    Returns:
+        tuple: The lines, pointersStartAddress, pointersEndAddress, pointerTableSize and line breakers.
+            The lines must be closed by the caller once read.
+    """
+    with st.stage("scriptParse"):
+        if not os.path.exists(cacheFileName(scriptFile)):
+            return en.openScriptFile(scriptFile)
+        lines = loadScriptCache(scriptFile)
+    return lines, lines.pointersStartAddress, lines.pointersEndAddress, lines.pointerTableSize, lines.lineBreakers
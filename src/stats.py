@@ -0,0 +1,239 @@
+"""
+Timing and counters of the decode and encode stages, off unless a collector is active.
+
+    import stats as st
+
+    with st.collect() as collector:
+        ...
+    report = collector.report()
+
+The stages time themselves with st.stage(name) and count with st.count(name), both
+do nothing without a collector. Stage times are exclusive: the time of a stage run
+inside another one is not counted twice.
+"""
+import json
+import time
+from contextlib import contextmanager, nullcontext
+
+# Stages reported even when they didn't run, in pipeline order
+stageNames = (
+    "romRead",
+    "tableParse",
+    "pointerDecode",
+    "textExtraction",
+    "fileWrite",
+    "scriptParse",
+    "encode",
+    "pointerBuild",
+    "compression",
+    "romWrite",
+)
+
+# Collector of the running stages, None when nothing is collected
+collector = None
+
+class Stats:
+    """
+    Wall time of every stage and counters, in total and for each block.
+
+    Attributes:
+        times (dict): Seconds spent in each stage.
+        counters (dict): Value of each counter.
+        blocks (list): Dictionaries with the name, times and counters of each block.
+        current (dict): The block receiving the times and counters with the totals, or None.
+        running (list): Lists [name, start time, time of the stages run inside] of the open stages.
+        started (float): perf_counter when the collector was created.
+    """
+
+    def __init__(self):
+        self.times = dict.fromkeys(stageNames, 0.0)
+        self.counters = {}
+        self.blocks = []
+        self.current = None
+        self.running = []
+        self.started = time.perf_counter()
+
+    def start(self, name):
+        """
+        Opens a stage.
+
+        Parameters:
+            name (str): The stage.
+        """
+        self.running.append([name, time.perf_counter(), 0.0])
+
+    def stop(self):
+        """
+        Closes the last stage opened, adding its own time.
+        """
+        name, started, inner = self.running.pop()
+        elapsed = time.perf_counter() - started
+        self.add("times", name, elapsed - inner)
+        if self.running:
+            self.running[-1][2] += elapsed
+
+    def add(self, kind, name, amount):
+        """
+        Adds to a stage time or a counter, in total and for the current block.
+
+        Parameters:
+            kind (str): "times" or "counters".
+            name (str): The stage or counter.
+            amount (int or float): The value to add.
+        """
+        values = getattr(self, kind)
+        values[name] = values.get(name, 0) + amount
+        if self.current is not None:
+            values = self.current[kind]
+            values[name] = values.get(name, 0) + amount
+
+    def block(self, name):
+        """
+        Starts the times and counters of a new block, or ends the current one.
+
+        Parameters:
+            name (str): The block, usually its script file, None to count only in the totals.
+        """
+        self.current = None
+        if name is not None:
+            self.current = {"name": name, "times": {}, "counters": {}}
+            self.blocks.append(self.current)
+
+    def report(self):
+        """
+        Returns every time and counter.
+
+        Returns:
+            dict: wallTime, times and counters in total, and blocks.
+        """
+        def rounded(times):
+            return {name: round(seconds, 6) for name, seconds in times.items()}
+        return {
+            "wallTime": round(time.perf_counter() - self.started, 6),
+            "times": rounded(self.times),
+            "counters": dict(self.counters),
+            "blocks": [{"name": block["name"], "times": rounded(block["times"]), "counters": dict(block["counters"])} for block in self.blocks],
+        }
+
+    def write(self, file):
+        """
+        Writes the report as JSON.
+
+        Parameters:
+            file (str): The path to the JSON file.
+        """
+        with open(file, "w", encoding="UTF-8") as f:
+            json.dump(self.report(), f, indent=2)
+
+class Stage:
+    """
+    Context manager timing one stage on the active collector.
+
+    Attributes:
+        name (str): The stage.
+        collector (Stats): The collector active when the stage was created.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.collector = collector
+
+    def __enter__(self):
+        self.collector.start(self.name)
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.collector.stop()
+
+def enable():
+    """
+    Starts collecting with a new collector.
+
+    Returns:
+        Stats: The collector.
+    """
+    global collector
+    collector = Stats()
+    return collector
+
+def disable():
+    """
+    Stops collecting.
+    """
+    global collector
+    collector = None
+
+@contextmanager
+def collect():
+    """
+    Collects the stages run inside a with statement, the previous collector is
+    restored at the end.
+
+    Yields:
+        Stats: The collector.
+    """
+    global collector
+    previous = collector
+    try:
+        yield enable()
+    finally:
+        collector = previous
+
+def stage(name):
+    """
+    Times a stage, used in a with statement.
+
+    Parameters:
+        name (str): The stage.
+
+    Returns:
+        Stage or nullcontext: The context manager, doing nothing without a collector.
+    """
+    if collector is None:
+        return nullcontext()
+    return Stage(name)
+
+def count(name, amount=1):
+    """
+    Adds to a counter.
+
+    Parameters:
+        name (str): The counter.
+        amount (int): The value to add.
+    """
+    if collector is not None:
+        collector.add("counters", name, amount)
+
+def block(name):
+    """
+    Starts the times and counters of a new block, or ends the current one.
+
+    Parameters:
+        name (str): The block, usually its script file, None to count only in the totals.
+    """
+    if collector is not None:
+        collector.block(name)
+
+def timed(iterable, name):
+    """
+    Times a lazy stage: only the time spent producing each item counts, not the time
+    the caller spends between items.
+
+    Parameters:
+        iterable (iterable): The items, produced lazily.
+        name (str): The stage.
+
+    Yields:
+        The items of iterable.
+    """
+    active = collector
+    iterator = iter(iterable)
+    while True:
+        active.start(name)
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            active.stop()
+        yield item
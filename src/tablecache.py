@@ -0,0 +1,201 @@
+import hashlib
+import os
+import pickle
+import decoder as de
+import encoder as en
+import stats as st
+from version import toolVersion
+
+# Bump when compileTable builds different structures, old cache entries are then ignored
+cacheVersion = 1
+
+# Cache bounds, the least recently used tables are removed first
+maxCacheEntries = 256
+maxCacheBytes = 64 << 20
+
+# Tables already loaded by this process, by cache key
+loadedTables = {}
+
+def cacheDirectory():
+    """
+    Returns the directory of the compiled table cache: HEXSTRING_CACHE_DIR if set
+    (empty disables the cache), else hexstring under the user cache directory.
+
+    Returns:
+        str: The directory, or None if the cache is disabled.
+    """
+    directory = os.environ.get("HEXSTRING_CACHE_DIR")
+    if directory is not None:
+        return directory or None
+    base = os.environ.get("XDG_CACHE_HOME") or os.environ.get("LOCALAPPDATA") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "hexstring")
+
+def tableKey(tblFile):
+    """
+    Hashes the content of a .tbl file with the cache version and the tool version.
+
+    Parameters:
+        tblFile (str): The path to the .tbl file.
+
+    Returns:
+        str: The hexadecimal SHA-1 digest.
+    """
+    with open(tblFile, "rb") as f:
+        digest = hashlib.sha1(f.read())
+    digest.update(f"{cacheVersion}:{toolVersion}".encode("UTF-8"))
+    return digest.hexdigest()
+
+def compileTable(tblFile):
+    """
+    Parses a .tbl file in both directions and builds the structures used to decode and encode.
+
+    Parameters:
+        tblFile (str): The path to the .tbl file.
+
+    Returns:
+        dict: decodeTable, lookupTable, encodeTable, longestChar and trie.
+    """
+    decodeTable = de.readTbl(tblFile)
+    encodeTable, longestChar = en.readTblFileInverted(tblFile)
+    return {
+        "decodeTable": decodeTable,
+        "lookupTable": de.buildLookupTable(decodeTable),
+        "encodeTable": encodeTable,
+        "longestChar": longestChar,
+        "trie": en.buildTrie(encodeTable),
+    }
+
+def evictTables(directory):
+    """
+    Removes the least recently used compiled tables until the cache is within its bounds.
+
+    Parameters:
+        directory (str): The cache directory.
+    """
+    entries = []
+    for name in os.listdir(directory):
+        if not name.endswith(".pickle"):
+            continue
+        try:
+            stat = os.stat(os.path.join(directory, name))
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, name))
+    entries.sort()
+    totalBytes = sum(size for mtime, size, name in entries)
+    while entries and (len(entries) > maxCacheEntries or totalBytes > maxCacheBytes):
+        mtime, size, name = entries.pop(0)
+        totalBytes -= size
+        try:
+            os.remove(os.path.join(directory, name))
+        except OSError:
+            pass
+
+def isCompiledTable(table):
+    """
+    Checks that an object read from the cache has the structures compileTable builds.
+
+    Parameters:
+        table (object): The unpickled object.
+
+    Returns:
+        bool: True if the table can be used.
+    """
+    return (isinstance(table, dict) and set(table) == {"decodeTable", "lookupTable", "encodeTable", "longestChar", "trie"}
+            and isinstance(table["decodeTable"], dict) and isinstance(table["encodeTable"], dict) and isinstance(table["trie"], dict)
+            and isinstance(table["lookupTable"], tuple) and len(table["lookupTable"]) == 256 and isinstance(table["longestChar"], int))
+
+def readCacheFile(cacheFile):
+    """
+    Reads a compiled table from the cache. A file that can't be unpickled or doesn't hold
+    a compiled table is removed, so it is written again.
+
+    Parameters:
+        cacheFile (str): The path to the cache file.
+
+    Returns:
+        dict: The compiled table, or None if it is missing or unusable.
+    """
+    try:
+        f = open(cacheFile, "rb")
+    except OSError:
+        return None
+    with f:
+        try:
+            table = pickle.load(f)
+        except Exception:
+            table = None
+    if not isCompiledTable(table):
+        try:
+            os.remove(cacheFile)
+        except OSError:
+            pass
+        return None
+    # Mark the entry as recently used
+    try:
+        os.utime(cacheFile)
+    except OSError:
+        pass
+    return table
+
+def loadTable(tblFile):
+    """
+    Returns the compiled structures of a .tbl file, from this process, from the disk cache
+    or compiled (and saved to the cache). Cache errors only cost a compilation.
+
+    Parameters:
+        tblFile (str): The path to the .tbl file.
+
+    Returns:
+        dict: decodeTable, lookupTable, encodeTable, longestChar and trie, shared: don't modify them.
+    """
+    with st.stage("tableParse"):
+        key = tableKey(tblFile)
+        if key in loadedTables:
+            return loadedTables[key]
+
+        directory = cacheDirectory()
+        cacheFile = os.path.join(directory, key + ".pickle") if directory else None
+        table = None
+        if cacheFile:
+            table = readCacheFile(cacheFile)
+        if table is None:
+            table = compileTable(tblFile)
+            if cacheFile:
+                try:
+                    os.makedirs(directory, exist_ok=True)
+                    tempFile = f"{cacheFile}.{os.getpid()}.tmp"
+                    with open(tempFile, "wb") as f:
+                        pickle.dump(table, f, pickle.HIGHEST_PROTOCOL)
+                    os.replace(tempFile, cacheFile)
+                    evictTables(directory)
+                except OSError:
+                    pass
+        loadedTables[key] = table
+        return table
+
+def readTbl(tblFile):
+    """
+    Cached decoder.readTbl.
+
+    Parameters:
+        tblFile (str): The path to the .tbl file.
+
+    Returns:
+        dict: A dictionary where the keys are byte values (int) and the values are strings.
+    """
+    return loadTable(tblFile)["decodeTable"]
+
+def readTblFileInverted(tblFile):
+    """
+    Cached encoder.readTblFileInverted.
+
+    Parameters:
+        tblFile (str): The path to the .tbl file.
+
+    Returns:
+        dict: A dictionary where the keys are strings and the values are byte values (int).
+        int: The length of the longest character sequence in the .tbl file.
+    """
+    table = loadTable(tblFile)
+    return table["encodeTable"], table["longestChar"]
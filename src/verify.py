@@ -0,0 +1,212 @@
+import codecs
+import re
+import allocator as al
+import batch as ba
+import compression as cp
+
+# Bytes written per pointer by each pointer format
+pointerSizes = {'-2b': 2, '-2bs': 2, '-2bb': 2, '-3b': 3, '-4b': 4}
+
+# Mismatches reported for each block, the rest are only counted
+maxReported = 10
+
+def expectedText(line, lookupTable):
+    """
+    Returns the text the decoder should give back for a script line: ~XX~ sequences
+    decoded through the table (a mapped byte comes back as its characters) and &
+    markers dropped, like encoder.encodeScriptLine reads them.
+
+    Parameters:
+        line (str): The script line.
+        lookupTable (tuple): The 256 decoded fragments, from decoder.buildLookupTable.
+
+    Returns:
+        str: The expected text.
+    """
+    parts = []
+    for part in re.split(r'(~[A-Za-z0-9]+~)', line):
+        if not part or part.startswith("&"):
+            continue
+        if re.match(r'~([0-9A-Fa-f]{2})~', part):
+            parts.append(lookupTable[int(part[1:3], 16)])
+        else:
+            parts.append(part)
+    return "".join(parts)
+
+def firstDifference(expected, decoded):
+    """
+    Finds where two texts start to differ.
+
+    Parameters:
+        expected (str): The expected text.
+        decoded (str): The decoded text.
+
+    Returns:
+        int: The index of the first different character.
+    """
+    for i, (first, second) in enumerate(zip(expected, decoded)):
+        if first != second:
+            return i
+    return min(len(expected), len(decoded))
+
+def checkLines(lineCache, lookupTable):
+    """
+    Decodes the encoding of every distinct script line with the decoder table and
+    compares it with the line. Characters missing from the encoder table (encoded as
+    their own code) or mapped to other characters by the decoder table show up here.
+
+    Parameters:
+        lineCache (dict): encoder.encodeScriptLine results by line, filled by encodeText.
+        lookupTable (tuple): The 256 decoded fragments of the decoder table.
+
+    Returns:
+        list: Messages describing each line that doesn't come back the same.
+    """
+    problems = []
+    for line, (finalLine, repeatLine, lastPart) in lineCache.items():
+        expected = expectedText(line, lookupTable)
+        decoded = codecs.charmap_decode(finalLine, 'strict', lookupTable)[0]
+        if decoded == expected:
+            continue
+        column = firstDifference(expected, decoded)
+        problems.append(f'"{expected[column:column + 1]}" at column {column + 1} reads back as "{decoded[column:column + 4]}" in line: {line}')
+    return problems
+
+def checkPointers(romData, block, addresses):
+    """
+    Checks the pointer table of a block in the patched ROM data: every address must be in
+    reach of the pointer format, and the table must hold the bytes the encoder makes for
+    those addresses. The pointers are encoded again with the encoder of the format rather
+    than decoded, as -3b and -4b pointers don't read back as plain addresses.
+
+    Parameters:
+        romData (bytes): The patched ROM data.
+        block (dict): The block settings.
+        addresses (list): The ROM address each pointer was made for.
+
+    Returns:
+        list: Messages describing each pointer that is wrong.
+    """
+    pointersFormat = block.get("pointersFormat", "-2b")
+    pointersStartAddress = ba.parseHexValue(block["pointersStartAddress"])
+    headerSize = ba.parseHexValue(block["headerSize"])
+    span, fromHeader = al.pointerSpans[pointersFormat]
+    low = headerSize if fromHeader else 0
+    problems = []
+    for index, address in enumerate(addresses):
+        if not low <= address < low + span:
+            problems.append(f"pointer {index} can't reach {hex(address)}")
+    size = pointerSizes[pointersFormat]
+    expectedPointers = ba.pointersFormats[pointersFormat][1](addresses, 0, headerSize)
+    tablePointers = bytes(romData[pointersStartAddress:pointersStartAddress + len(expectedPointers)])
+    if len(tablePointers) < len(expectedPointers):
+        problems.append(f"the pointer table ends past the end of the ROM at {hex(pointersStartAddress + len(tablePointers))}")
+    elif tablePointers != expectedPointers:
+        column = firstDifference(expectedPointers, tablePointers)
+        # -2bs keeps every low byte before every high byte
+        index = column % len(addresses) if pointersFormat == '-2bs' else column // size
+        problems.append(f"pointer {index} of the table doesn't point to {hex(addresses[index])}")
+    return problems
+
+def plainText(textScript, lineCache, lineBreakers):
+    """
+    Puts the encoding of every script line one after another, taken from the line cache
+    filled while encoding, with the pointers encoder.encodeText makes when no line is shared.
+    Nothing is encoded again.
+
+    Parameters:
+        textScript (list): The script lines.
+        lineCache (dict): encoder.encodeScriptLine results by line, holding every line.
+        lineBreakers (set): A set of byte values used as line breakers.
+
+    Returns:
+        tuple: The plain text (bytearray) and its pointers (list), relative to its start.
+    """
+    text = bytearray()
+    pointers = [0]
+    # An empty line ends like the line before it
+    lastPart = b""
+    for line in textScript:
+        finalLine, repeatLine, linePart = lineCache[line]
+        if linePart is not None:
+            lastPart = linePart
+        # Repeat last pointer function
+        if repeatLine:
+            pointers[-1] = pointers[-2]
+        text += finalLine
+        for byte in lastPart:
+            if byte in lineBreakers:
+                pointers.append(len(text))
+    pointers.pop()
+    return text, pointers
+
+def checkStrings(textData, baseAddress, addresses, referenceText, referencePointers, lineBreakers, lookupTable):
+    """
+    Compares the string at every pointer address of the written text with the string the
+    same pointer gets in the plain text of the script, one line after another. Shared
+    lines, spilled strings, relocated pointers and compressed text all read like this.
+
+    Parameters:
+        textData (bytes): The text as written, or decompressed for a compressed block.
+        baseAddress (int): The ROM address of the first byte of textData.
+        addresses (list): The ROM address each pointer was made for.
+        referenceText (bytes): The plain text of the script, from plainText.
+        referencePointers (list): Its pointers, relative to its start.
+        lineBreakers (set): A set of byte values used as line breakers.
+        lookupTable (tuple): The 256 decoded fragments of the decoder table.
+
+    Returns:
+        list: Messages describing each string that doesn't read back the same.
+    """
+    problems = []
+    if len(addresses) != len(referencePointers):
+        problems.append(f"{len(addresses)} pointers written instead of {len(referencePointers)}")
+    for index, (address, pointer) in enumerate(zip(addresses, referencePointers)):
+        # A string runs to its first line breaker, or to the end of the text
+        end = pointer
+        while end < len(referenceText) and referenceText[end] not in lineBreakers:
+            end += 1
+        expected = referenceText[pointer:end + 1]
+        start = address - baseAddress
+        written = bytes(textData[start:start + len(expected)]) if start >= 0 else b""
+        if written == expected:
+            continue
+        expectedString = codecs.charmap_decode(expected, 'strict', lookupTable)[0]
+        writtenString = codecs.charmap_decode(written, 'strict', lookupTable)[0]
+        problems.append(f'pointer {index} at {hex(address)} reads "{writtenString}" instead of "{expectedString}"')
+    return problems
+
+def checkBlock(romData, block, lookupTable, script, addresses, lineCache):
+    """
+    Checks an encoded block in the patched ROM data in memory, after compression and
+    spilling: every line decodes back to the script, the pointer table holds the addresses
+    the pointers were made for, and the string at every address reads like in the plain
+    text of the script. Only what the encoding left in memory is used, the script is not
+    read or encoded again.
+
+    Parameters:
+        romData (bytes): The patched ROM data.
+        block (dict): The block settings.
+        lookupTable (tuple): The 256 decoded fragments of the decoder table.
+        script (dict): The lines and the lineBreakers of the script, as encoded.
+        addresses (list): The ROM address each pointer was made for.
+        lineCache (dict): encodeScriptLine results by line, filled while encoding.
+
+    Returns:
+        list: Messages describing every problem found.
+    """
+    lineBreakers = script["lineBreakers"]
+    referenceText, referencePointers = plainText(script["lines"], lineCache, lineBreakers)
+
+    textStartAddress = ba.parseHexValue(block["textStartAddress"])
+    if block.get("codec"):
+        textSize = ba.parseHexValue(block["textSize"])
+        textData = cp.decompress(bytes(romData[textStartAddress:textStartAddress + textSize]), block["codec"])
+        baseAddress = textStartAddress
+    else:
+        textData = romData
+        baseAddress = 0
+    problems = checkLines(lineCache, lookupTable)
+    problems += checkPointers(romData, block, addresses)
+    problems += checkStrings(textData, baseAddress, addresses, referenceText, referencePointers, lineBreakers, lookupTable)
+    return problems
@@ -0,0 +1,2 @@
+# Version of the tool, shown by -v and part of the compiled table cache keys
+toolVersion = "1.1.0"
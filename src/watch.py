@@ -0,0 +1,137 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import time
+
+# inotify events that mean a file of the directory was saved, replaced or removed
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+watchMask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+# Editors save in several steps, changes are read again after this delay (seconds)
+settleTime = 0.02
+
+# With inotify, files are still checked this often (seconds) in case an event was missed
+inotifyTimeout = 2.0
+
+def fileSignature(file):
+    """
+    Returns what identifies a version of a file: modification time and size.
+
+    Parameters:
+        file (str): The path to the file.
+
+    Returns:
+        tuple: (mtime in ns, size), or None if the file does not exist.
+    """
+    try:
+        stat = os.stat(file)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+def openInotify(directories):
+    """
+    Creates an inotify descriptor watching the given directories. Directories are watched
+    instead of files because editors often save by renaming a new file over the old one.
+
+    Parameters:
+        directories (iterable): The directories to watch.
+
+    Returns:
+        int: The descriptor, or None if inotify is not available (not Linux, no libc).
+    """
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    except (OSError, AttributeError, TypeError):
+        return None
+    if fd < 0:
+        return None
+    for directory in directories:
+        if libc.inotify_add_watch(fd, os.fsencode(directory), watchMask) < 0:
+            os.close(fd)
+            return None
+    return fd
+
+class FileWatcher:
+    """
+    Waits for changes of a set of files, woken by inotify when it is available and
+    polling otherwise. Either way a file counts as changed only when its modification
+    time or size differ.
+
+    Attributes:
+        files (dict): Absolute path of every watched file, by the path given.
+        signatures (dict): Last signature of every watched file.
+        interval (float): Polling interval in seconds, without inotify.
+        fd (int): The inotify descriptor, or None when polling.
+    """
+
+    def __init__(self, files, interval=0.5):
+        """
+        Parameters:
+            files (iterable): The paths of the files to watch.
+            interval (float): Polling interval in seconds, without inotify.
+        """
+        self.files = {file: os.path.abspath(file) for file in files}
+        self.signatures = {file: fileSignature(path) for file, path in self.files.items()}
+        self.interval = interval
+        self.fd = openInotify({os.path.dirname(path) for path in self.files.values()})
+
+    def changedFiles(self):
+        """
+        Compares the files with their last signature, and keeps the new ones.
+
+        Returns:
+            set: The paths (as given) of the files that changed.
+        """
+        changed = set()
+        for file, path in self.files.items():
+            signature = fileSignature(path)
+            if signature != self.signatures[file]:
+                self.signatures[file] = signature
+                changed.add(file)
+        return changed
+
+    def wait(self):
+        """
+        Blocks until at least one file changed.
+
+        Returns:
+            set: The paths (as given) of the files that changed.
+        """
+        while True:
+            if self.fd is not None:
+                ready, _, _ = select.select([self.fd], [], [], inotifyTimeout)
+                if ready:
+                    self.drain()
+            else:
+                time.sleep(self.interval)
+            changed = self.changedFiles()
+            if changed:
+                # Let the editor finish writing, and take what changed meanwhile
+                time.sleep(settleTime)
+                if self.fd is not None:
+                    self.drain()
+                return changed | self.changedFiles()
+
+    def drain(self):
+        """
+        Reads every pending inotify event, they are only used to wake up.
+        """
+        try:
+            while os.read(self.fd, 65536):
+                pass
+        except BlockingIOError:
+            pass
+
+    def close(self):
+        """
+        Closes the inotify descriptor.
+        """
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
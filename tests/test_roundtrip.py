@@ -0,0 +1,827 @@
+import contextlib
+import io
+import json
+import os
+import pickle
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+sourceDirectory = os.path.join(os.path.dirname(__file__), "..", "src")
+sys.path.insert(0, sourceDirectory)
+
+import batch as ba
+import compression as cp
+import decoder as de
+import encoder as en
+import incremental as inc
+import journal as jn
+import main
+import records as rc
+import scanner as sn
+import scriptcache as sc
+import stats as st
+import tablecache as tc
+import verify as vf
+
+# Four letters and a line breaker, enough to tell every string apart
+tableText = "10=a\n11=b\n12=c\n13=d\nFF=/\n"
+charTable = {"a": 0x10, "b": 0x11, "c": 0x12, "d": 0x13, "/": 0xFF}
+decodeTable = {byte: chars for chars, byte in charTable.items()}
+lineBreakers = {0xFF}
+
+def setUpModule():
+    # Compiled tables go to a temporary cache, for this process and the commands it runs
+    global cacheDirectory, previousCacheDirectory
+    cacheDirectory = tempfile.mkdtemp()
+    previousCacheDirectory = os.environ.get("HEXSTRING_CACHE_DIR")
+    os.environ["HEXSTRING_CACHE_DIR"] = cacheDirectory
+
+def tearDownModule():
+    if previousCacheDirectory is None:
+        del os.environ["HEXSTRING_CACHE_DIR"]
+    else:
+        os.environ["HEXSTRING_CACHE_DIR"] = previousCacheDirectory
+    shutil.rmtree(cacheDirectory)
+
+def readStrings(data, addresses):
+    """
+    Decodes the string at every address, up to its line breaker.
+
+    Parameters:
+        data (bytes): The text or ROM data.
+        addresses (list): The address of every string.
+
+    Returns:
+        list: The decoded strings.
+    """
+    return [text for address, text, length in de.scanTexts(bytes(data), list(addresses), lineBreakers, decodeTable)]
+
+def encodeStrings(lines, shareLines=None):
+    """
+    Encodes script lines and decodes the string at every pointer.
+
+    Parameters:
+        lines (list): The script lines.
+        shareLines (str): None, 'lines' or 'tails'.
+
+    Returns:
+        tuple: The decoded strings and the size of the encoded text.
+    """
+    encodedText, pointersList = en.encodeText(lines, lineBreakers, charTable, 1, shareLines=shareLines)
+    return readStrings(encodedText, pointersList), len(encodedText)
+
+def baselinePointers(data, header, pointersFormat):
+    """
+    Decodes a pointer table one pointer at a time, the way every format was read before
+    the strided engine.
+
+    Parameters:
+        data (bytes): The raw pointer table.
+        header (int): The offset added to each pointer.
+        pointersFormat (str): The pointer format flag.
+
+    Returns:
+        list: The addresses.
+    """
+    if pointersFormat == "-2bs":
+        half = len(data) // 2
+        return [data[i] + (data[i + half] << 8) + header for i in range(half)]
+    size = {"-2b": 2, "-2bb": 2, "-3b": 3, "-4b": 4}[pointersFormat]
+    records = [data[i:i + size] for i in range(0, len(data), size)]
+    if pointersFormat == "-2b":
+        return [int.from_bytes(record, "little") + header for record in records]
+    if pointersFormat == "-2bb":
+        return [int.from_bytes(record, "big") + header for record in records]
+    if pointersFormat == "-3b":
+        return [int.from_bytes(record[1:], "little") + header for record in records]
+    return [int.from_bytes(record[2:], "big") + header for record in records]
+
+def baselinePointerTable(pointersList, firstPointer, headerSize, pointersFormat):
+    """
+    Encodes a pointer table one pointer at a time, the way every format was written
+    before the strided engine.
+
+    Parameters:
+        pointersList (list): Pointers relative to the first one.
+        firstPointer (int): The address of the first pointer.
+        headerSize (int): The header subtracted from the 2 byte pointers.
+        pointersFormat (str): The pointer format flag.
+
+    Returns:
+        bytes: The pointer table.
+    """
+    addresses = [pointer + firstPointer for pointer in pointersList]
+    if pointersFormat == "-3b":
+        return b"".join(bytes([address >> 16 & 0xFF, address & 0xFF, address >> 8 & 0xFF]) for address in addresses)
+    if pointersFormat == "-4b":
+        return b"".join((address & 0xFFFFFFFF).to_bytes(4, "big") for address in addresses)
+    values = [address - headerSize & 0xFFFF for address in addresses]
+    if pointersFormat == "-2bs":
+        return bytes(value & 0xFF for value in values) + bytes(value >> 8 for value in values)
+    byteOrder = "big" if pointersFormat == "-2bb" else "little"
+    return b"".join(value.to_bytes(2, byteOrder) for value in values)
+
+def baselineTexts(romData, addresses, breakerBytes, byteTable):
+    """
+    Decodes the line at every address one byte at a time, the way the decoder did
+    before the lookup table.
+
+    Parameters:
+        romData (bytes): The ROM data.
+        addresses (list): The address of every line.
+        breakerBytes (set): The line breaker byte values.
+        byteTable (dict): A dictionary mapping byte values to characters or sequences.
+
+    Returns:
+        list: Tuples (address, text, length in bytes).
+    """
+    lines = []
+    for address in addresses:
+        end = address
+        while romData[end] not in breakerBytes:
+            end += 1
+        text = "".join(byteTable.get(byte) or f"~{byte:02X}~" for byte in romData[address:end + 1])
+        lines.append((address, text, end + 1 - address))
+    return lines
+
+def baselineEncodeText(textScript, breakerBytes, encodeTable, longestChar):
+    """
+    Encodes script lines probing every sequence length at each position, the way the
+    encoder did before the trie.
+
+    Parameters:
+        textScript (list): The script lines.
+        breakerBytes (set): The line breaker byte values.
+        encodeTable (dict): Dictionary that maps character sequences to byte values.
+        longestChar (int): Maximum length of sequences to consider.
+
+    Returns:
+        tuple: The encoded text and the pointers (cumulative lengths).
+    """
+    encodedData = bytearray()
+    cumulativeLength = [0]
+    lastPart = b""
+    for line in textScript:
+        parts = [part for part in re.split(r"(~[A-Za-z0-9]+~)", line) if part]
+        processedParts = []
+        for part in parts:
+            # Repeat last pointer
+            if part.startswith("&"):
+                cumulativeLength[-1] = cumulativeLength[-2]
+                continue
+            if re.match(r"~([0-9A-Fa-f]{2})~", part):
+                processedParts.append(bytes([int(part[1:3], 16)]))
+                continue
+            encodedPart = bytearray()
+            i = 0
+            while i < len(part):
+                for length in range(min(longestChar, len(part) - i), 0, -1):
+                    if part[i:i + length] in encodeTable:
+                        encodedPart.append(encodeTable[part[i:i + length]])
+                        i += length
+                        break
+                else:
+                    encodedPart.append(ord(part[i]))
+                    i += 1
+            processedParts.append(bytes(encodedPart))
+        encodedData.extend(b"".join(processedParts))
+        # The line breakers of the last encoded piece end the line, an empty line ends
+        # like the line before it
+        if processedParts:
+            lastPart = processedParts[-1]
+        elif parts:
+            lastPart = b""
+        cumulativeLength.extend(len(encodedData) for byte in lastPart if byte in breakerBytes)
+    cumulativeLength.pop()
+    return bytes(encodedData), cumulativeLength
+
+class LineSharingTest(unittest.TestCase):
+
+    def testSharedLinesSaveBytes(self):
+        lines = ["ab/", "cd/", "ab/"]
+        plainStrings, plainSize = encodeStrings(lines)
+        for mode in ("lines", "tails"):
+            strings, size = encodeStrings(lines, mode)
+            self.assertEqual(strings, plainStrings)
+            self.assertLess(size, plainSize)
+
+    def testBreakerlessLineIsNotShared(self):
+        # Both "ab" run into a different next line
+        lines = ["ab", "cd/", "ab", "dd/"]
+        for mode in (None, "lines", "tails"):
+            self.assertEqual(encodeStrings(lines, mode)[0], ["abcd/", "abdd/"])
+
+    def testBreakerlessLineIsNotTailHost(self):
+        # "bc" ends "aabc", but "aabc" goes on with "d/" and "bc" with "dd/"
+        lines = ["aabc", "d/", "bc", "dd/"]
+        self.assertEqual(encodeStrings(lines, "tails")[0], ["aabcd/", "bcdd/"])
+
+    def testMultiLineStrings(self):
+        lines = ["ab", "cd/", "cd/", "ab", "cd/", "d/", "bcd/", "a", "b", "cd/"]
+        plainStrings = encodeStrings(lines)[0]
+        for mode in ("lines", "tails"):
+            self.assertEqual(encodeStrings(lines, mode)[0], plainStrings)
+
+class ScriptTestCase(unittest.TestCase):
+    """
+    Writes a table, a blank ROM and scripts in a temporary directory. Blocks have their
+    pointer table at 0x10 and their text at 0x100, without header.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.tblFile = os.path.join(self.directory, "table.tbl")
+        with open(self.tblFile, "w", encoding="UTF-8") as f:
+            f.write(tableText)
+        self.romFile = os.path.join(self.directory, "rom.bin")
+        with open(self.romFile, "wb") as f:
+            f.write(bytes(0x400))
+        self.scriptFile = os.path.join(self.directory, "script.txt")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def writeScript(self, lines):
+        with open(self.scriptFile, "w", encoding="UTF-8") as f:
+            f.write(";{00000010-0000002F-00000020}-FF\n")
+            for line in lines:
+                f.write(line + "\n")
+
+    def block(self, **settings):
+        block = {
+            "file": self.scriptFile,
+            "pointersFormat": "-2b",
+            "textStartAddress": 0x100,
+            "textSize": 0x80,
+            "pointersStartAddress": 0x10,
+            "headerSize": 0,
+        }
+        block.update(settings)
+        return block
+
+    def readBlock(self, romData, block, pointersCount):
+        """
+        Reads the pointer table of a block back and decodes the string at every pointer.
+        """
+        pointersFormat = block["pointersFormat"]
+        tableSize = {"-3b": 3, "-4b": 4}.get(pointersFormat, 2) * pointersCount
+        tablePointers = bytes(romData[block["pointersStartAddress"]:block["pointersStartAddress"] + tableSize])
+        addresses = ba.pointersFormats[pointersFormat][0](tablePointers, block["headerSize"])
+        return readStrings(romData, addresses)
+
+class ManifestTest(ScriptTestCase):
+
+    def readManifest(self, manifest):
+        manifestFile = os.path.join(self.directory, "manifest.json")
+        with open(manifestFile, "w", encoding="UTF-8") as f:
+            json.dump(manifest, f)
+        return ba.readManifest(manifestFile)
+
+    def testDefaultsApplied(self):
+        manifest = {"rom": self.romFile, "encoderTbl": self.tblFile, "decoderTbl": self.tblFile, "headerSize": "0x10",
+                    "blocks": [{"file": self.scriptFile}, {"file": self.scriptFile, "headerSize": "0x20"}]}
+        blocks = self.readManifest(manifest)[1]
+        self.assertEqual([block["headerSize"] for block in blocks], ["0x10", "0x20"])
+        self.assertEqual(blocks[0]["rom"], self.romFile)
+
+    def testMissingTopLevelValue(self):
+        manifest = {"rom": self.romFile, "encoderTbl": self.tblFile, "decoderTbl": self.tblFile, "blocks": []}
+        for key in ("rom", "encoderTbl", "decoderTbl", "blocks"):
+            with self.assertRaises(KeyError) as raised:
+                self.readManifest({name: value for name, value in manifest.items() if name != key})
+            self.assertEqual(raised.exception.args, (key,))
+        with self.assertRaises(ValueError):
+            self.readManifest([])
+
+class IncrementalTest(ScriptTestCase):
+
+    def encode(self, lines):
+        """
+        Encodes the script with the sidecar cache and writes the changed ranges to the ROM.
+        """
+        self.writeScript(lines)
+        charTable, longestChar = en.readTblFileInverted(self.tblFile)
+        with open(self.romFile, "rb") as f:
+            romData = bytearray(f.read())
+        block = self.block()
+        freeBytes, pointersCount, ranges, inPlace = inc.encodeBlock(bytes(romData), block, charTable, longestChar, inc.fileHash(self.tblFile))
+        for offset, data in ranges:
+            romData[offset:offset + len(data)] = data
+        with open(self.romFile, "wb") as f:
+            f.write(romData)
+        return self.readBlock(romData, block, pointersCount), inPlace
+
+    def testShrunkLineStaysInPlace(self):
+        self.encode(["aaaa/", "bbbb/"])
+        self.assertEqual(self.encode(["aa/", "bbbb/"]), (["aa/", "bbbb/"], True))
+
+    def testShrunkBreakerlessLine(self):
+        self.encode(["aaaa", "bbbb/"])
+        self.assertEqual(self.encode(["aa", "bbbb/"])[0], ["aabbbb/"])
+
+    def testMultiLineStrings(self):
+        self.encode(["ab", "cd/", "dd/", "a", "b", "c/"])
+        self.assertEqual(self.encode(["ab", "cc/", "d/", "a", "b", "c/"])[0], ["abcc/", "d/", "abc/"])
+
+class SpillTest(ScriptTestCase):
+
+    def encode(self, lines, textSize, freeRegions):
+        """
+        Encodes the script spilling to the free regions, and applies the writes to the ROM.
+        """
+        self.writeScript(lines)
+        charTable, longestChar = en.readTblFileInverted(self.tblFile)
+        block = self.block(textSize=textSize)
+        writes, freeBytes, pointersCount, spilledBytes, textBytes = ba.encodeBlock(block, charTable, longestChar, freeRegions)
+        romData = bytearray(0x400)
+        for offset, data in writes:
+            romData[offset:offset + len(data)] = data
+        return self.readBlock(romData, block, pointersCount), spilledBytes
+
+    def testStringKeptWhole(self):
+        # "aaaa" goes on with the line after it, they are moved together
+        freeRegions = [[0x200, 0x240]]
+        strings, spilledBytes = self.encode(["aaaa", "bbbbbbbb/", "c/"], 6, freeRegions)
+        self.assertEqual(strings, ["aaaabbbbbbbb/", "c/"])
+        self.assertEqual(spilledBytes, 13)
+
+    def testTextBlockFilledFirst(self):
+        freeRegions = [[0x200, 0x240]]
+        strings, spilledBytes = self.encode(["aa/", "bb/", "cccccccc/"], 7, freeRegions)
+        self.assertEqual(strings, ["aa/", "bb/", "cccccccc/"])
+        self.assertEqual(spilledBytes, 9)
+        self.assertEqual(freeRegions, [[0x209, 0x240]])
+
+    def testMultiLineStrings(self):
+        lines = ["ab", "cd/", "dd/", "a", "b", "c/", "abcd", "abcd/", "d/"]
+        strings, spilledBytes = self.encode(lines, 8, [[0x200, 0x210], [0x300, 0x340]])
+        self.assertEqual(strings, ["abcd/", "dd/", "abc/", "abcdabcd/", "d/"])
+        self.assertGreater(spilledBytes, 0)
+
+class JournalTest(ScriptTestCase):
+
+    def testOverlapRejected(self):
+        journal = jn.WriteJournal(self.romFile)
+        journal.stage(0x100, b"abcd", "first")
+        journal.stage(0x102, b"cd", "second")
+        with self.assertRaises(ValueError):
+            journal.stage(0x103, b"xy", "third")
+        with self.assertRaises(IndexError):
+            journal.stage(0x3FF, b"xy", "fourth")
+
+    def testCommitInPlace(self):
+        journal = jn.WriteJournal(self.romFile)
+        journal.stage(0x100, b"ab", "text")
+        journal.stage(0x10, b"\x12\x01", "pointers")
+        self.assertEqual(journal.commit(inPlace=True), [(0x10, b"\x12\x01"), (0x100, b"ab")])
+        with open(self.romFile, "rb") as f:
+            romData = f.read()
+        self.assertEqual(romData[0x10:0x12] + romData[0x100:0x102], b"\x12\x01ab")
+        self.assertEqual(len(romData), 0x400)
+
+class VerifyTest(ScriptTestCase):
+
+    lines = ["ab", "cd/", "ab", "cd/", "dd/", "a", "b", "c/"]
+
+    def check(self, block, freeRegions=None, damage=None):
+        """
+        Encodes the block, applies the writes and damage to a blank ROM and verifies it.
+        """
+        self.writeScript(self.lines)
+        charTable, longestChar = en.readTblFileInverted(self.tblFile)
+        lookupTable = de.buildLookupTable(de.readTbl(self.tblFile))
+        addresses = []
+        lineCache = {}
+        script = {}
+        writes, freeBytes, pointersCount, spilledBytes, textBytes = ba.encodeBlock(block, charTable, longestChar, freeRegions, lineCache, addresses, script)
+        self.assertEqual(script, {"lines": self.lines, "lineBreakers": lineBreakers})
+        romData = bytearray(0x400)
+        for offset, data in writes + (damage or []):
+            romData[offset:offset + len(data)] = data
+        return vf.checkBlock(romData, block, lookupTable, script, addresses, lineCache)
+
+    def testPointerFormats(self):
+        for pointersFormat in ("-2b", "-2bs", "-2bb", "-3b", "-4b"):
+            for shareLines in (None, "lines", "tails"):
+                self.assertEqual(self.check(self.block(pointersFormat=pointersFormat, shareLines=shareLines, headerSize=0x80)), [])
+
+    def testSpilledAndCompressed(self):
+        self.assertEqual(self.check(self.block(textSize=8), [[0x200, 0x240]]), [])
+        self.assertEqual(self.check(self.block(codec="lzss")), [])
+
+    def testDamagedText(self):
+        problems = self.check(self.block(), damage=[(0x101, b"\x13")])
+        self.assertEqual(len(problems), 1)
+        self.assertIn("pointer 0", problems[0])
+
+    def testPointerOutOfReach(self):
+        problems = self.check(self.block(headerSize=0x200))
+        self.assertIn("pointer 0 can't reach 0x100", problems)
+
+    def testPlainText(self):
+        # The plain text rebuilt from the line cache is the encoding without shared lines
+        rng = random.Random(17)
+        longestChar = max(len(chars) for chars in TrieEncodeTest.encodeTable)
+        for _ in range(10):
+            lines = TrieEncodeTest.randomScript(rng, 60)
+            lineCache = {}
+            encodedText, pointersList = en.encodeText(lines, TrieEncodeTest.breakerBytes, TrieEncodeTest.encodeTable, longestChar, False, "tails", lineCache)
+            plainText, plainPointers = en.encodeText(lines, TrieEncodeTest.breakerBytes, TrieEncodeTest.encodeTable, longestChar)
+            self.assertEqual(vf.plainText(lines, lineCache, TrieEncodeTest.breakerBytes), (plainText, list(plainPointers)))
+
+    def testIncremental(self):
+        self.writeScript(self.lines)
+        lookupTable = de.buildLookupTable(de.readTbl(self.tblFile))
+        romData = bytearray(0x400)
+        for edit in (None, "dd/", "abcd/"):
+            if edit:
+                self.lines = self.lines[:4] + [edit] + self.lines[5:]
+                self.writeScript(self.lines)
+            block = self.block()
+            addresses, lineCache, script = [], {}, {}
+            freeBytes, pointersCount, ranges, inPlace = inc.encodeBlock(bytes(romData), block, charTable, 1, inc.fileHash(self.tblFile), lineCache, addresses, script)
+            for offset, data in ranges:
+                romData[offset:offset + len(data)] = data
+            self.assertEqual(vf.checkBlock(romData, block, lookupTable, script, addresses, lineCache), [])
+
+class PointerFormatTest(unittest.TestCase):
+
+    def testDecodeMatchesBaseline(self):
+        rng = random.Random(3)
+        data = bytes(rng.randrange(256) for _ in range(12 * 40))
+        for pointersFormat, (decode, encode) in ba.pointersFormats.items():
+            for header in (0, 0x10, 0x30010):
+                expected = baselinePointers(data, header, pointersFormat)
+                self.assertEqual(list(decode(data, header)), expected, pointersFormat)
+                self.assertEqual(list(decode(memoryview(data), header)), expected, pointersFormat)
+            self.assertEqual(list(decode(b"", 0)), [], pointersFormat)
+
+    def testEncodeMatchesBaseline(self):
+        rng = random.Random(4)
+        pointersList = sorted(rng.randrange(0x8000) for _ in range(50))
+        for pointersFormat, (decode, encode) in ba.pointersFormats.items():
+            for firstPointer, headerSize in ((0, 0), (0x387DE, 0x30010), (0x1C000, 0x10)):
+                expected = baselinePointerTable(pointersList, firstPointer, headerSize, pointersFormat)
+                self.assertEqual(bytes(encode(pointersList, firstPointer, headerSize)), expected, pointersFormat)
+
+    def testRoundTrip(self):
+        rng = random.Random(5)
+        pointersList = sorted(rng.randrange(0x4000) for _ in range(50))
+        for pointersFormat, (decode, encode) in ba.pointersFormats.items():
+            # The 3 and 4 byte formats keep the bank, the header only applies to 2 byte pointers
+            headerSize = 0 if pointersFormat in ("-3b", "-4b") else 0x10
+            table = bytes(encode(pointersList, 0x8010, headerSize))
+            addresses = [0x8010 + pointer for pointer in pointersList]
+            self.assertEqual(list(decode(table, headerSize)), addresses, pointersFormat)
+
+class LookupDecodeTest(unittest.TestCase):
+
+    def testMatchesBaseline(self):
+        # Single characters, DTE/MTE entries, a latin-1 character, unmapped bytes and
+        # an unmapped line breaker
+        byteTable = {byte: chr(byte) for byte in range(0x41, 0x5B)}
+        byteTable.update({0x80: "th", 0x81: "the ", 0x82: "\u00e9", 0x2F: "/", 0xFF: "[END]"})
+        breakerBytes = {0x00, 0x2F, 0xFF}
+        rng = random.Random(6)
+        values = list(byteTable) + [0x00, 0x01, 0x7F, 0xFE]
+        romData = bytes(rng.choice(values) for _ in range(4000)) + b"\xff"
+        addresses = sorted(rng.sample(range(4000), 300))
+        expected = baselineTexts(romData, addresses, breakerBytes, byteTable)
+        self.assertEqual(list(de.scanTexts(romData, addresses, breakerBytes, byteTable)), expected)
+        lookupTable = de.buildLookupTable(byteTable)
+        breakers = de.compileBreakers(breakerBytes)
+        self.assertEqual(list(de.iterTexts(memoryview(romData), addresses, breakerBytes, byteTable, lookupTable, breakers)), expected)
+
+    def testLookupTable(self):
+        lookupTable = de.buildLookupTable(decodeTable)
+        self.assertEqual(len(lookupTable), 256)
+        self.assertEqual((lookupTable[0x10], lookupTable[0xFF], lookupTable[0x00]), ("a", "/", "~00~"))
+
+class TrieEncodeTest(unittest.TestCase):
+
+    # Overlapping DTE/MTE entries, so the longest match matters, and two line breakers
+    encodeTable = {"a": 0x10, "b": 0x11, "c": 0x12, "d": 0x13, " ": 0x14, "ab": 0x20, "abc": 0x21,
+                   "bca": 0x22, "ca": 0x23, "d a": 0x24, "/": 0xFF, "!": 0x2F}
+    breakerBytes = {0xFF, 0x2F}
+
+    @staticmethod
+    def randomScript(rng, count):
+        pieces = ["a", "b", "c", "d", " ", "ab", "bca", "x", "~7E~", "~ff~", "!"]
+        lines = ["abc/"]
+        for _ in range(count):
+            kind = rng.random()
+            if kind < 0.05:
+                lines.append("")
+            elif kind < 0.1:
+                lines.append("&")
+            else:
+                line = "".join(rng.choice(pieces) for _ in range(rng.randrange(12)))
+                lines.append(line + rng.choice(["/", "/", "!", "", "~FF~"]))
+        return lines
+
+    def testGreedyMatchesBaseline(self):
+        rng = random.Random(7)
+        longestChar = max(len(chars) for chars in self.encodeTable)
+        trie = en.buildTrie(self.encodeTable)
+        for _ in range(200):
+            part = "".join(rng.choice("abcd xy") for _ in range(rng.randrange(20)))
+            expected = baselineEncodeText([part], self.breakerBytes, self.encodeTable, longestChar)[0]
+            self.assertEqual(bytes(en.encodeGreedy(part, trie, longestChar)), expected, part)
+
+    def testEncodeTextMatchesBaseline(self):
+        rng = random.Random(8)
+        longestChar = max(len(chars) for chars in self.encodeTable)
+        for _ in range(20):
+            lines = self.randomScript(rng, 60)
+            encodedText, pointersList = en.encodeText(lines, self.breakerBytes, self.encodeTable, longestChar)
+            self.assertEqual((bytes(encodedText), list(pointersList)), baselineEncodeText(lines, self.breakerBytes, self.encodeTable, longestChar))
+
+class EncodeCountersTest(unittest.TestCase):
+
+    def testCounters(self):
+        # "abc" is a sequence hit, "d", " ", "/" and "!" single characters, "x" is missing
+        # from the table; the line is counted each time it is written
+        lines = ["abcd x~7E~/", "&", "abcd x~7E~/", "!"]
+        expected = {"sequenceHits": 2, "singleChars": 7, "fallbackChars": 2, "escapesEncoded": 2, "pointerReuses": 1}
+        for optimal in (False, True):
+            for lineCache in (None, {}, {"!": (b"\x2f", False, b"\x2f")}):
+                with st.collect() as collector:
+                    en.encodeText(lines, TrieEncodeTest.breakerBytes, TrieEncodeTest.encodeTable, 3, optimal, None, lineCache)
+                counters = collector.report()["counters"]
+                self.assertEqual({name: counters[name] for name in expected}, expected, (optimal, lineCache))
+
+class OptimalEncodeTest(unittest.TestCase):
+
+    encodeTable = TrieEncodeTest.encodeTable
+
+    def shortestLength(self, part):
+        # Every way of cutting the text into table sequences, for short texts only
+        best = [0] + [None] * len(part)
+        for end in range(1, len(part) + 1):
+            for chars in self.encodeTable:
+                start = end - len(chars)
+                if start >= 0 and best[start] is not None and part[start:end] == chars:
+                    if best[end] is None or best[start] + 1 < best[end]:
+                        best[end] = best[start] + 1
+        return best[-1]
+
+    def testNeverLongerThanGreedy(self):
+        rng = random.Random(9)
+        longestChar = max(len(chars) for chars in self.encodeTable)
+        trie = en.buildTrie(self.encodeTable)
+        decodeBytes = {byte: chars for chars, byte in self.encodeTable.items()}
+        for _ in range(300):
+            part = "".join(rng.choice("abcd ") for _ in range(rng.randrange(14)))
+            optimal = en.encodeOptimal(part, trie, longestChar)
+            self.assertLessEqual(len(optimal), len(en.encodeGreedy(part, trie, longestChar)), part)
+            self.assertEqual(len(optimal), self.shortestLength(part), part)
+            self.assertEqual("".join(decodeBytes[byte] for byte in optimal), part)
+
+    def testEncodeTextRoundTrip(self):
+        rng = random.Random(10)
+        lines = ["".join(rng.choice("abcd") for _ in range(rng.randrange(1, 10))) + "/" for _ in range(80)]
+        for optimal in (False, True):
+            encodedText, pointersList = en.encodeText(lines, lineBreakers, charTable, 1, optimal=optimal)
+            self.assertEqual(readStrings(encodedText, pointersList), lines)
+
+class ScriptCacheTest(ScriptTestCase):
+
+    def testLinesAreClosed(self):
+        self.writeScript(["ab/", "cd/"])
+        sc.buildScriptCache(self.scriptFile)
+        with sc.loadScriptCache(self.scriptFile) as lines:
+            self.assertEqual(list(lines), ["ab/", "cd/"])
+        self.assertTrue(lines.data.closed)
+
+    def testEncodeBlockFromSidecar(self):
+        self.writeScript(["ab/", "cd/"])
+        sc.buildScriptCache(self.scriptFile)
+        block = self.block()
+        romData = bytearray(0x400)
+        writes, freeBytes, pointersCount, spilledBytes, textBytes = ba.encodeBlock(block, charTable, 1)
+        for address, data in writes:
+            romData[address:address + len(data)] = data
+        self.assertEqual(self.readBlock(romData, block, pointersCount), ["ab/", "cd/"])
+
+class PointerScanTest(ScriptTestCase):
+
+    settings = {"headers": [0, 0x10], "minPointers": 8, "maxLength": 0x400, "maxUnmapped": 0.1, "top": 5}
+
+    def writeRom(self, rng, pointersFormat):
+        """
+        Writes random data with a text block at 0x4100 and its pointer table at 0x1000.
+        """
+        lines = ["".join(rng.choice("abcd") for _ in range(rng.randrange(3, 12))) + "/" for _ in range(30)]
+        encodedText, pointersList = en.encodeText(lines, lineBreakers, charTable, 1)
+        headerSize = 0 if pointersFormat in ("-3b", "-4b") else 0x10
+        table = bytes(ba.pointersFormats[pointersFormat][1](pointersList, 0x4100, headerSize))
+        romData = bytearray(rng.randrange(256) for _ in range(0x8000))
+        romData[0x4100:0x4100 + len(encodedText)] = encodedText
+        romData[0x1000:0x1000 + len(table)] = table
+        with open(self.romFile, "wb") as f:
+            f.write(romData)
+        return {"pointersFormat": pointersFormat, "pointersStartAddress": 0x1000, "tablePointersSize": len(table),
+                "headerSize": headerSize, "pointers": len(lines), "textStart": 0x4100}
+
+    def testFindsEveryFormat(self):
+        rng = random.Random(11)
+        for pointersFormat in sn.scanFormats:
+            expected = self.writeRom(rng, pointersFormat)
+            best = sn.scanRom(self.romFile, lineBreakers, decodeTable, self.settings, list(sn.scanFormats))[0]
+            self.assertEqual({key: best[key] for key in expected}, expected)
+
+    def testJobsMatchSingleProcess(self):
+        self.writeRom(random.Random(12), "-2b")
+        single = sn.scanRom(self.romFile, lineBreakers, decodeTable, self.settings, list(sn.scanFormats))
+        self.assertEqual(sn.scanRom(self.romFile, lineBreakers, decodeTable, self.settings, list(sn.scanFormats), 2), single)
+
+class TextScanTest(ScriptTestCase):
+
+    # Capital letters and space, strings end in 0x00
+    scanTable = {byte: chr(byte) for byte in [0x20] + list(range(0x41, 0x5B))}
+    words = ["THE", "KING", "SWORD", "OF", "A", "HERO", "CASTLE", "NORTH", "GOES", "TO"]
+
+    def writeStrings(self, rng):
+        """
+        Writes strings without pointers between random unmapped bytes, returning their
+        address, text and length.
+        """
+        romData = bytearray(rng.randrange(0x80, 0x100) for _ in range(0x2000))
+        strings = []
+        address = 0x100
+        for _ in range(25):
+            line = " ".join(rng.choice(self.words) for _ in range(rng.randrange(2, 6)))
+            romData[address:address + len(line) + 1] = line.encode("ascii") + b"\0"
+            strings.append((address, line + "~00~", len(line) + 1))
+            address += len(line) + 1 + rng.randrange(8, 40)
+        return bytes(romData), strings
+
+    def testFindsStrings(self):
+        romData, strings = self.writeStrings(random.Random(13))
+        textRuns = sn.findTextRuns(romData, {0x00}, self.scanTable)
+        self.assertEqual([(address, length) for address, length, score in textRuns], [(address, length) for address, text, length in strings])
+        self.assertEqual(list(sn.textRecords(romData, textRuns, self.scanTable)), strings)
+        # A scanned range keeps the ROM addresses
+        textRuns = sn.findTextRuns(romData[0x80:], {0x00}, self.scanTable)
+        self.assertEqual(list(sn.textRecords(romData[0x80:], textRuns, self.scanTable, 0x80)), strings)
+
+    def testMinLength(self):
+        romData, strings = self.writeStrings(random.Random(14))
+        textRuns = sn.findTextRuns(romData, {0x00}, self.scanTable, minLength=12)
+        # Runs may lose a leading byte pair the other runs never use, but they end at the breaker
+        self.assertTrue(all(length >= 12 for address, length, score in textRuns))
+        self.assertLessEqual({address + length for address, length, score in textRuns}, {address + length for address, text, length in strings if length >= 12})
+        self.assertGreater(len(textRuns), len([text for address, text, length in strings if length >= 12]) // 2)
+
+    def testMinLengthRejected(self):
+        result = subprocess.run([sys.executable, os.path.join(sourceDirectory, "main.py"), "-t", self.romFile, self.tblFile, "0xFF",
+                                 os.path.join(self.directory, "strings.txt"), "--min-length", "2"], capture_output=True, text=True)
+        self.assertEqual(result.stdout.strip(), f"Error: --min-length must be at least {sn.shortestRun}.")
+        self.assertEqual(result.returncode, 1)
+
+class CompressionTest(ScriptTestCase):
+
+    codecs = ["lzss", "rle", "huffman", "rle,huffman", "lzss,huffman", "rle,lzss"]
+
+    def samples(self):
+        rng = random.Random(15)
+        encodedText = en.encodeText(["".join(rng.choice("abcd") for _ in range(rng.randrange(1, 30))) + "/" for _ in range(200)],
+                                    lineBreakers, charTable, 1)[0]
+        return [b"", b"a", bytes(300), b"ab" * 500, bytes(range(256)) * 3, bytes(rng.randrange(256) for _ in range(3000)),
+                bytes(rng.choice(b"  abc") for _ in range(5000)), bytes(encodedText)]
+
+    def testRoundTrip(self):
+        for codec in self.codecs:
+            for data in self.samples():
+                self.assertEqual(cp.decompress(cp.compress(data, codec), codec), data, (codec, data[:16]))
+
+    def testPackedBlock(self):
+        rng = random.Random(16)
+        lines = ["".join(rng.choice("aab") for _ in range(rng.randrange(1, 20))) + "/" for _ in range(30)]
+        self.writeScript(lines)
+        for codec in self.codecs:
+            block = self.block(codec=codec, textSize=0x200)
+            romData = bytearray(0x400)
+            writes, freeBytes, pointersCount, spilledBytes, textBytes = ba.encodeBlock(block, charTable, 1)
+            for address, data in writes:
+                romData[address:address + len(data)] = data
+            self.assertLess(0x200 - freeBytes, textBytes, codec)
+            tableSize = 2 * pointersCount
+            addresses = ba.pointersFormats["-2b"][0](bytes(romData[0x10:0x10 + tableSize]), 0)
+            texts = [text for address, text, length in cp.iterPackedTexts(romData, addresses, lineBreakers, decodeTable, codec, 0x100, 0x200 - freeBytes)]
+            self.assertEqual(texts, lines, codec)
+
+class TableCacheTest(ScriptTestCase):
+
+    def cacheFile(self):
+        return os.path.join(cacheDirectory, tc.tableKey(self.tblFile) + ".pickle")
+
+    def testCacheDirectory(self):
+        self.assertEqual(tc.cacheDirectory(), cacheDirectory)
+        tc.loadedTables.clear()
+        self.assertEqual(tc.readTbl(self.tblFile), decodeTable)
+        self.assertTrue(os.path.exists(self.cacheFile()))
+
+    def testBadCacheFile(self):
+        for content in (b"not a pickle", b"\x80\x04K\x01.", pickle.dumps({"decodeTable": {}}), pickle.dumps([1, 2, 3])):
+            with open(self.cacheFile(), "wb") as f:
+                f.write(content)
+            tc.loadedTables.clear()
+            self.assertEqual(tc.readTblFileInverted(self.tblFile), (charTable, 1))
+            # The bad file was replaced with the compiled table
+            with open(self.cacheFile(), "rb") as f:
+                self.assertTrue(tc.isCompiledTable(pickle.load(f)))
+
+class CommandTest(ScriptTestCase):
+
+    def encodeArgs(self):
+        return ["-e", "-2b", self.scriptFile, "0x100", "0x80", "0x10", "0", self.romFile, self.tblFile]
+
+    def runMain(self, args, requests=None):
+        return subprocess.run([sys.executable, os.path.join(sourceDirectory, "main.py")] + args, input=requests,
+                              capture_output=True, text=True)
+
+    def testCommandTable(self):
+        for name, (command, shortest) in main.commands.items():
+            self.assertTrue(name.startswith("-") and callable(command) and shortest >= 2, name)
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            self.assertEqual(main.runCommand(["HexString"]), 1)
+            self.assertEqual(main.runCommand(["HexString", "-x"]), 1)
+            # Too short for -e, help is shown instead
+            self.assertEqual(main.runCommand(["HexString", "-e", "-2b"]), 1)
+        self.assertEqual(output.getvalue().count("Usage:"), 3)
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            self.assertEqual(main.runCommand(["HexString", "-v"]), 0)
+        self.assertIn("version", output.getvalue())
+
+    def testServer(self):
+        self.writeScript(["ab/", "cd/", "abcd/"])
+        outFile = os.path.join(self.directory, "out.txt")
+        requests = [
+            json.dumps({"id": 1, "args": self.encodeArgs()}),
+            "",
+            json.dumps(["-d", "-2b", self.romFile, "0x10", "0x6", "0", "0xFF", outFile, self.tblFile]),
+            json.dumps({"id": "missing", "args": ["-e", "-2b", "missing.txt", "0x100", "0x80", "0x10", "0", self.romFile, self.tblFile]}),
+            "not json",
+            json.dumps(["-w", "manifest.json"]),
+            json.dumps({"id": 5, "args": ["-v"]}),
+        ]
+        result = self.runMain(["-r"], "\n".join(requests) + "\n")
+        self.assertEqual(result.returncode, 0)
+        answers = [json.loads(line) for line in result.stdout.splitlines()]
+        self.assertEqual([(answer["id"], answer["status"]) for answer in answers], [(1, 0), (None, 0), ("missing", 1), (None, 1), (None, 1), (5, 0)])
+        self.assertIn("Pointers table written at offset 0x10 with 3 pointers.", answers[0]["output"])
+        self.assertIn("Error: File missing.txt not found in directory.", answers[2]["output"])
+        self.assertIn("Error: Commands must be JSON arrays", answers[3]["output"])
+        self.assertIn("Error: -w can't be run by -r.", answers[4]["output"])
+        self.assertIn("version", answers[5]["output"])
+        with open(outFile, encoding="UTF-8") as f:
+            self.assertEqual([line.rstrip("\n") for line in f if not line.startswith((";", "@", "|"))], ["ab/", "cd/", "abcd/"])
+
+        # The server writes the same ROM as the command line
+        with open(self.romFile, "rb") as f:
+            servedRom = f.read()
+        with open(self.romFile, "wb") as f:
+            f.write(bytes(0x400))
+        self.assertEqual(self.runMain(self.encodeArgs()).returncode, 0)
+        with open(self.romFile, "rb") as f:
+            self.assertEqual(f.read(), servedRom)
+
+class LineRecordsTest(unittest.TestCase):
+
+    def testMatchesBaseline(self):
+        # Unsorted and repeated addresses, DTE/MTE entries and a character outside ASCII
+        byteTable = {byte: chr(byte) for byte in range(0x41, 0x5B)}
+        byteTable.update({0x80: "th", 0x81: "\u00e9", 0x82: "\u3042", 0xFF: "/"})
+        breakerBytes = {0x00, 0xFF}
+        rng = random.Random(18)
+        values = list(byteTable) + [0x00, 0x01]
+        romData = bytes(rng.choice(values) for _ in range(3000)) + b"\xff"
+        addresses = rng.sample(range(3000), 200) + [5, 5]
+        expected = baselineTexts(romData, addresses, breakerBytes, byteTable)
+        records = de.extractTexts(romData, addresses, breakerBytes, byteTable)
+        self.assertEqual(list(records.texts()), [text for address, text, length in expected])
+        self.assertEqual(list(records.lengths), [length for address, text, length in expected])
+        self.assertEqual(list(records.addresses), addresses)
+        self.assertEqual(list(records), expected)
+        self.assertEqual([records[i] for i in range(-len(records), len(records))], expected + expected)
+        self.assertEqual(records.totalBytes(), abs(addresses[-1] + expected[-1][2] - addresses[0]))
+        self.assertEqual(list(pickle.loads(pickle.dumps(records))), expected)
+        with self.assertRaises(IndexError):
+            records.text(len(records))
+
+    def testEmpty(self):
+        records = rc.LineRecords()
+        self.assertEqual((len(records), list(records), records.totalBytes()), (0, [], 0))
+        records.append(0x10, "", 1)
+        records.extend([(0x11, "ab", 2)])
+        self.assertEqual(list(records), [(0x10, "", 1), (0x11, "ab", 2)])
+        self.assertEqual(records.totalBytes(), 3)
+
+if __name__ == "__main__":
+    unittest.main()